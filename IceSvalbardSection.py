@@ -3,42 +3,41 @@
 Created on Mon Sep 28 10:44:10 2015
 
 @author: max
+
+Mean ice concentration in rings (25 - 400 km) and sections (NE, SE, SW, W, NW)
+around Svalbard from the daily NSIDC sea ice concentration charts.
+
+ProcessYears runs YearZonalStats for each year, writes the daily values
+into the sqlite database and the monthly means of MonthlyMeans with 
+CreateRingStatistics into RingStatistics<year>.shp
+* ReadNSIDCBin, ReprojectionIndex -- NSIDC reading and reprojection of SeaIceFrequency.py
+* RingSectionZones -- zone label of all ring / section polygons, rasterized once
+* NSIDCZoneWeights -- fraction of each NSIDC pixel in each zone, polygons projected to EPSG:3411
+* ZonalMeans -- mean concentration of all zones of one day in one bincount
+* MonthlyMeans -- monthly means of the daily zone means of a year
+* CreateRingStatistics -- write the monthly means of a year into RingStatistics<year>.shp
+* IceEdgeZones -- Svalbard coast, distance from it and section pixels, computed once
+* IceEdgeDistance -- distance from the Svalbard coast to the nearest ice edge per section and day
+* YearZonalStats -- daily mean, valid pixel count and ice edge distance for one year
+* CreateStatisticsDatabase / InsertZonalStats / InsertIceEdgeDistance -- daily statistics as indexed sqlite tables
+* ProcessYears -- all years in a pool of processes, one table and shapefile per year
 """
 
 import struct, numpy, gdal, gdalconst, glob, os, osr
-import shutil, sys, ogr
+import shutil, sys, ogr, tempfile, multiprocessing, sqlite3
+from scipy import ndimage
 
-def EPSG3411_2_EPSG3575(infile):
-    '''
-    reprojects the infile from NSIDC 3411 to EPSG 3575
-    outputfile has 25km resolution
-    '''
-    
-    (infilepath, infilename) = os.path.split(infile)
-    (infileshortname, extension) = os.path.splitext(infilename)
-    outdirectory = infilepath + '//EPSG3575//'
-    if not os.path.exists(outdirectory):
-        os.makedirs(outdirectory)
-    outfile =  outdirectory + infileshortname + '_EPSG3575.tif'
-    print ' Reproject ', infile, ' to ', outfile 
-    os.system('gdalwarp -q -s_srs EPSG:3411 -tr 25000 -25000 -t_srs EPSG:3575'\
-               + ' -of GTiff ' + infile + ' ' + outfile)
+# NSIDC reading and reprojection are shared with SeaIceFrequency.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SeaIceFrequency'))
+from SeaIceFrequency import EPSG3411_2_EPSG3575, ReprojectWithIndex, ReprojectionIndex, ReprojectArray, ReadNSIDCBin
 
 def EPSG3411_2_EPSG32633(infile):
     '''
-    reprojects the infile from NSIDC 3411 to EPSG 3575
+    reprojects the infile from NSIDC 3411 to EPSG 32633
     outputfile has 25km resolution
     '''
     
-    (infilepath, infilename) = os.path.split(infile)
-    (infileshortname, extension) = os.path.splitext(infilename)
-    outdirectory = infilepath + '//EPSG32633//'
-    if not os.path.exists(outdirectory):
-        os.makedirs(outdirectory)
-    outfile =  outdirectory + infileshortname + '_EPSG32633.tif'
-    print ' Reproject ', infile, ' to ', outfile 
-    os.system('gdalwarp -q -s_srs EPSG:3411 -tr 25000 -25000 -t_srs EPSG:32633'\
-             + ' -of GTiff ' + infile + ' ' + outfile)
+    ReprojectWithIndex(infile, 'EPSG:32633')
 
 
 def Bin2GeoTiff(infile,outfilepath ):
@@ -117,125 +116,433 @@ def Bin2GeoTiff(infile,outfilepath ):
     EPSG3411_2_EPSG3575(outfile)
     EPSG3411_2_EPSG32633(outfile)
 
-def ExtractRingSection(ring, section, infile, outputfilepath):
+def RingSectionZones(ringsectionshapefile, rings, sections, outproj = 'EPSG:32633'):
     '''
+    Rasterizes the polygons of ringsectionshapefile (fields POLY_ID for the
+    ring and SECTION) once on the grid of ReprojectionIndex(outproj). Zone 
+    of ring i and section j (positions in rings, sections) is 
+    i * len(sections) + j + 1, 0 is outside all polygons.
+    
+    As the reprojection index gives the NSIDC pixel each pixel of the grid 
+    is taken from, the zones are returned as NSIDC pixels and their zone, 
+    such that the daily charts are used without reprojecting them. 
+    Dictionary with
+    * labels -- zone raster on the grid of outproj
+    * pixels -- NSIDC pixel number (flat index) of each zone pixel
+    * zones -- zone of each of these pixels
+    * weights -- weight of each of these pixels, here 1
+    * rings, sections -- as given
     '''
-    #Define file names 
-    (infilepath, infilename) = os.path.split(infile)             
-    (infileshortname, extension) = os.path.splitext(infilename)
     
-    RingSectionFile = outputfilepath + infileshortname + '_ring' + str(ring) +\
-                      '_section' + str(section) + '.tif'
-    cutline = '//home//max//Documents//DagIskart//RingSectionsMerge.shp'    
-    print "create ",  infileshortname + '_ring' + str(ring) +\
-                      '_section' + str(section)  
-    os.system('gdalwarp  -q -cutline ' + cutline + ' -of GTiff '\
-                + '-cwhere "POLY_ID=' + str(ring) + " AND SECTION='"  \
-                + str(section) +  "'\" " + infile + ' ' +  RingSectionFile)
+    index = ReprojectionIndex(outproj)
+    
+    driver = gdal.GetDriverByName('MEM')
+    zoneraster = driver.Create('', index['cols'], index['rows'], 1, gdal.GDT_Int32)
+    zoneraster.SetGeoTransform(index['geotransform'])
+    zoneraster.SetProjection(index['projection'])
+    
+    ringsections = ogr.Open(ringsectionshapefile)
+    layer = ringsections.GetLayer()
+    for i, ring in enumerate(rings):
+        for j, section in enumerate(sections):
+            layer.SetAttributeFilter("POLY_ID=" + str(ring) + " AND SECTION='" + str(section) + "'")
+            gdal.RasterizeLayer(zoneraster, [1], layer, burn_values = [i * len(sections) + j + 1])
+    layer = None
+    ringsections = None
+    
+    labels = zoneraster.GetRasterBand(1).ReadAsArray()
+    zoneraster = None
     
+    zonelabels = labels.ravel()[index['targetpixels']]
+    inzone = zonelabels > 0
+    
+    zones = {}
+    zones['labels'] = labels
+    zones['pixels'] = index['sourcepixels'][inzone]
+    zones['zones'] = zonelabels[inzone]
+    zones['weights'] = numpy.ones(inzone.sum())
+    zones['rings'] = list(rings)
+    zones['sections'] = list(sections)
+    return zones
 
-def MonthlyStats(outputfilepath, filelist, year, ring, section):
+def NSIDCZoneWeights(ringsectionshapefile, rings, sections, supersample = 10):
     '''
+    As RingSectionZones, but the polygons are projected once into the NSIDC
+    grid (EPSG:3411) instead of taking the zones from the EPSG:32633 grid.
+    
+    The polygons are rasterized on a grid supersample times finer than the
+    25km NSIDC cells, covering only the cells around the polygons. The 
+    weight of a NSIDC pixel in a zone is the fraction of its subpixels in
+    the zone, so pixels on a ring border count in both rings by their share.
+    The shapefile is taken to be EPSG:32633 if it has no projection.
+    Returns the dictionary of RingSectionZones, labels being the zones of
+    the subpixels
     '''
-    NumberOfDays = len(filelist)
-    monthDict={1:'January', 2:'February', 3:'March', 4:'April', 5:'May', \
-               6:'June', 7:'July', 8:'August', 9:'September', 10:'October', \
-               11:'November', 12:'December'}    
-    outputtextfile = outputfilepath + "MonthlyStatistics" + str(year) + ".txt"
-    cumulativepermonth = 0
-    cumulativeperday = 0 
-    
-    for ringsectionfile in filelist:
-        (ringsectionfilenamepath, ringsectionfilename) = os.path.split(ringsectionfile)
-        year = int(ringsectionfilename[3:7])
-        monthAsNumber = int(ringsectionfilename[7:9])
-        month = monthDict[int(ringsectionfilename[7:9])]
-        
-        gdal.AllRegister()
-        
-        # open the image
-        ds = gdal.Open(ringsectionfile, gdalconst.GA_ReadOnly)
-        if ds is None:
-            print 'Could not open '
-            sys.exit(1)
-        referencefilename = '//home//max//Documents//DagIskart//Rasterize' + section + '.tif'
-        referencefile = gdal.Open(referencefilename, gdalconst.GA_ReadOnly)
-        
-        # get image size
-        rows = ds.RasterYSize
-        cols = ds.RasterXSize
+    
+    nsidcgeotransform = (-3850000.0, 25000.0 ,0.0 ,5850000.0, 0.0, -25000.0)
+    nsidcRef = osr.SpatialReference()
+    nsidcRef.ImportFromProj4('+proj=stere +lat_0=90 +lat_ts=70 +lon_0=-45 '\
+           + '+k=1 +x_0=0 +y_0=0 +a=6378273 +b=6356889.449 +units=m +no_defs')
+    
+    ringsections = ogr.Open(ringsectionshapefile)
+    layer = ringsections.GetLayer()
+    shapeRef = layer.GetSpatialRef()
+    if shapeRef is None:
+        shapeRef = osr.SpatialReference()
+        shapeRef.ImportFromEPSG(32633)
+    transformation = osr.CoordinateTransformation(shapeRef, nsidcRef)
+    
+    # all polygons projected to EPSG:3411 in a memory layer with their zone
+    memorysource = ogr.GetDriverByName('Memory').CreateDataSource('zones')
+    memorylayer = memorysource.CreateLayer('zones', nsidcRef, ogr.wkbPolygon)
+    memorylayer.CreateField(ogr.FieldDefn('ZONE', ogr.OFTInteger))
+    for i, ring in enumerate(rings):
+        for j, section in enumerate(sections):
+            layer.SetAttributeFilter("POLY_ID=" + str(ring) + " AND SECTION='" + str(section) + "'")
+            for feature in layer:
+                geometry = feature.GetGeometryRef().Clone()
+                geometry.Transform(transformation)
+                zonefeature = ogr.Feature(memorylayer.GetLayerDefn())
+                zonefeature.SetGeometry(geometry)
+                zonefeature.SetField('ZONE', i * len(sections) + j + 1)
+                memorylayer.CreateFeature(zonefeature)
+                zonefeature = None
+    layer = None
+    ringsections = None
+    
+    # NSIDC cells covering the polygons
+    (minx, maxx, miny, maxy) = memorylayer.GetExtent()
+    firstcol = max(int(numpy.floor((minx - nsidcgeotransform[0]) / nsidcgeotransform[1])), 0)
+    lastcol = min(int(numpy.ceil((maxx - nsidcgeotransform[0]) / nsidcgeotransform[1])), 304)
+    firstrow = max(int(numpy.floor((maxy - nsidcgeotransform[3]) / nsidcgeotransform[5])), 0)
+    lastrow = min(int(numpy.ceil((miny - nsidcgeotransform[3]) / nsidcgeotransform[5])), 448)
+    
+    driver = gdal.GetDriverByName('MEM')
+    zoneraster = driver.Create('', (lastcol - firstcol) * supersample, (lastrow - firstrow) * supersample, 1, gdal.GDT_Int32)
+    zoneraster.SetGeoTransform((nsidcgeotransform[0] + firstcol * nsidcgeotransform[1], nsidcgeotransform[1] / supersample, 0.0, \
+                                nsidcgeotransform[3] + firstrow * nsidcgeotransform[5], 0.0, nsidcgeotransform[5] / supersample))
+    zoneraster.SetProjection(nsidcRef.ExportToWkt())
+    gdal.RasterizeLayer(zoneraster, [1], memorylayer, options = ['ATTRIBUTE=ZONE'])
+    labels = zoneraster.GetRasterBand(1).ReadAsArray()
+    zoneraster = None
+    memorylayer = None
+    memorysource = None
+    
+    # NSIDC pixel of each subpixel, subpixels per pixel and zone
+    rows = numpy.arange(labels.shape[0]) // supersample + firstrow
+    cols = numpy.arange(labels.shape[1]) // supersample + firstcol
+    nsidcpixels = (rows[:, numpy.newaxis] * 304 + cols).ravel()
+    inzone = labels.ravel() > 0
+    NumberOfZones = len(rings) * len(sections)
+    keys, counts = numpy.unique(nsidcpixels[inzone] * (NumberOfZones + 1) + labels.ravel()[inzone], return_counts = True)
+    
+    zones = {}
+    zones['labels'] = labels
+    zones['pixels'] = keys // (NumberOfZones + 1)
+    zones['zones'] = keys % (NumberOfZones + 1)
+    zones['weights'] = counts / float(supersample * supersample)
+    zones['rings'] = list(rings)
+    zones['sections'] = list(sections)
+    return zones
 
-        #Read input raster into array
-        ringsectionraster = ds.ReadAsArray()
-        referenceraster = referencefile.ReadAsArray()
-        
-        percentage = 0
-        cumulativeperday = 0
-        count = 0
-        for i in range(rows):
-            for j in range(cols):
-                if (referenceraster[i,j] == int(ring)) and \
-                   ( 0<= ringsectionraster[i,j] <= 250):
-                    percentage = ringsectionraster[i,j] *100/250.0
-                    count = count + 1
-                    cumulativeperday = cumulativeperday + percentage
-                    
-        cumulativeperday = cumulativeperday / count
-        cumulativepermonth = cumulativepermonth + cumulativeperday / NumberOfDays
-        ds = None
-        referencefile = None
+def ZonalMeans(dayarray, zones):
+    '''
+    Returns the mean ice concentration (%) of all zones of RingSectionZones
+    for one NSIDC chart, as array of shape (rings, sections), and the number
+    of valid pixels (concentration 0 - 250) of each zone. The mean is 
+    weighted with the weights of the zone pixels, see NSIDCZoneWeights.
+    Both are one bincount over the zone pixels, zones without valid pixel are nan
+    '''
+    
+    NumberOfZones = len(zones['rings']) * len(zones['sections'])
+    values = dayarray.ravel()[zones['pixels']]
+    valid = values <= 250
+    weights = zones['weights'][valid]
+    
+    weightsum = numpy.bincount(zones['zones'][valid], weights, NumberOfZones + 1)[1:]
+    concentrationsum = numpy.bincount(zones['zones'][valid], weights * values[valid], NumberOfZones + 1)[1:]
+    count = numpy.bincount(zones['zones'][valid], None, NumberOfZones + 1)[1:]
+    
+    with numpy.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = concentrationsum / weightsum * 100 / 250.0
+    shape = (len(zones['rings']), len(zones['sections']))
+    return mean.reshape(shape), count.reshape(shape)
 
-    print 'Year and month = ', str(year), month
-    print 'Mean Ice Concentration = ', cumulativepermonth
-    textfile = open( outputtextfile, 'a')
-    textfile.write(str(year) + ', ' + month + ', ' + ring + ', ' + section + ', ' \
-                      + str(cumulativepermonth) + '\n' )   
-    textfile.close()
-    ds = None
-    CreateRingStatistics(ring, section, year, monthAsNumber, cumulativepermonth)
+def IceEdgeZones(landraster, zones, coastalerrorraster = None):
+    '''
+    Prepares the ice edge distance once for all days, from the land values
+    (252-255) of landraster on the NSIDC grid and the zones of 
+    RingSectionZones / NSIDCZoneWeights. Dictionary with
+    * coast -- Svalbard coast, land pixels touching the innermost ring
+    * distance -- distance (km) of each pixel to the nearest coast pixel,
+      Euclidean distance transform of the coast
+    * pixels, sections -- NSIDC pixel number and section (0, 1, ...) of
+      each pixel in a section, a pixel on a section border is in both
+    * NumberOfSections
+    * errorpixels -- boolean raster of the coastal error areas
+    
+    The concentration along the coast is falsified by land spill-over, as 
+    in the coastal filter of SeaIceFrequency.py. If coastalerrorraster (the
+    coastal error mask, 1 coast, 2 Baltic, 3 never ice) is given, its error
+    pixels are left out of the edge pixels and are not taken as open water
+    next to an edge, such that no false edge is found about 25 km off the coast
+    '''
+    
+    NumberOfSections = len(zones['sections'])
+    land = (landraster >= 252) & (landraster <= 255)
+    errorpixels = numpy.zeros(land.shape, bool)
+    if coastalerrorraster is not None:
+        errorpixels = (coastalerrorraster >= 1) & (coastalerrorraster <= 3)
+    
+    # the innermost ring has the zones 1 ... NumberOfSections
+    innerring = numpy.zeros(land.size, bool)
+    innerring[zones['pixels'][zones['zones'] <= NumberOfSections]] = True
+    innerring = ndimage.binary_dilation(innerring.reshape(land.shape), numpy.ones((3, 3), bool))
+    coast = land & innerring
+    
+    # pixel and section pairs of all zones
+    pairs = numpy.unique(zones['pixels'] * NumberOfSections + (zones['zones'] - 1) % NumberOfSections)
+    pairs = pairs[~errorpixels.ravel()[pairs // NumberOfSections]]
+    
+    edgezones = {}
+    edgezones['coast'] = coast
+    edgezones['distance'] = ndimage.distance_transform_edt(~coast, sampling = 25.0)
+    edgezones['pixels'] = pairs // NumberOfSections
+    edgezones['sections'] = pairs % NumberOfSections
+    edgezones['NumberOfSections'] = NumberOfSections
+    edgezones['errorpixels'] = errorpixels
+    return edgezones
 
-def CreateRingStatistics(ring, section, year, monthAsNumber, cumulativepermonth):
+def IceEdgeDistance(stack, edgezones):
     '''
+    Distance (km) from the Svalbard coast to the nearest ice edge in each 
+    section for a stack of daily charts (days, 448, 304), as array 
+    (days, sections), nan where a section has no ice edge.
+    
+    Ice is concentration 38 (15%) - 251, an ice edge pixel is ice with open
+    water (0 - 37) as 4-neighbour. The distance of an edge pixel is taken 
+    from the coast distance of IceEdgeZones, so no distance transform is 
+    done per day, all days of the stack are processed at once. Pixels of 
+    the coastal error areas are neither edge nor water, see IceEdgeZones
     '''
-    driver = ogr.GetDriverByName('ESRI Shapefile')
-    #datasource = driver.Open('/home/max/Documents/DagIskart/RingStatisticsTest.shp', 1)
-    datasource = driver.Open('/home/max/Documents/DagIskart/RingStatistics' + str(year) + '.shp', 1)
+    
+    ice = (stack >= 38) & (stack <= 251)
+    water = (stack < 38) & ~edgezones['errorpixels']
+    waterneighbour = numpy.zeros(stack.shape, bool)
+    waterneighbour[:, 1:, :] |= water[:, :-1, :]
+    waterneighbour[:, :-1, :] |= water[:, 1:, :]
+    waterneighbour[:, :, 1:] |= water[:, :, :-1]
+    waterneighbour[:, :, :-1] |= water[:, :, 1:]
+    edge = (ice & waterneighbour).reshape((len(stack), -1))[:, edgezones['pixels']]
+    
+    distance = numpy.where(edge, edgezones['distance'].ravel()[edgezones['pixels']], numpy.inf)
+    edgedistance = numpy.empty((len(stack), edgezones['NumberOfSections']))
+    for section in range(edgezones['NumberOfSections']):
+        edgedistance[:, section] = distance[:, edgezones['sections'] == section].min(axis = 1)
+    edgedistance[numpy.isinf(edgedistance)] = numpy.nan
+    return edgedistance
 
-#    if not os.path.isfile(datasource): 
-#        shutil.copyfile('/home/max/Documents/DagIskart/RingStatistics.shp', datasource)
+def YearZonalStats(year, nsidcpath, zones, edgezones = None):
+    '''
+    Mean ice concentration and number of valid pixels of all rings and 
+    sections for each daily chart of year, found as 
+    nsidcpath//YYYY//nt_YYYYMMDD*_n.bin, see ZonalMeans, and if edgezones of
+    IceEdgeZones is given the ice edge distance of each section.
+    Each day is counted once, if both a final and a near real time
+    (nt_YYYYMMDD_*_nrt_n.bin) chart are present the final one is taken.
+    Returns the dates (YYYYMMDD), the means and counts as arrays
+    (days, rings, sections) and the distances (days, sections) or None
+    '''
     
-    layer = datasource.GetLayer()
+    # one chart per date, the final chart replaces a near real time one
+    charts = {}
+    for icechart in glob.glob(nsidcpath + str(year) + '//nt_' + str(year) + '*_n.bin'):
+        date = os.path.split(icechart)[1][3:11]
+        if (date not in charts) or ('_nrt_' in charts[date]):
+            charts[date] = icechart
+    filelist = [charts[date] for date in sorted(charts)]
+    shape = (len(filelist), len(zones['rings']), len(zones['sections']))
+    dates = numpy.zeros(len(filelist), numpy.int32)
+    stack = numpy.zeros((len(filelist), 448, 304), numpy.uint8)
+    means = numpy.zeros(shape)
+    counts = numpy.zeros(shape, numpy.int32)
+    for i, icechart in enumerate(filelist):
+        dates[i] = int(os.path.split(icechart)[1][3:11])
+        stack[i] = ReadNSIDCBin(icechart)
+        means[i], counts[i] = ZonalMeans(stack[i], zones)
     
-    if monthAsNumber < 11:
-        monthAsNumberString = '0' + str(monthAsNumber)
-    elif monthAsNumber > 10:
-        monthAsNumberString = str(monthAsNumber)
+    edgedistance = None
+    if edgezones is not None:
+        edgedistance = IceEdgeDistance(stack, edgezones)
     
-    yearmonth = str(year) + monthAsNumberString
+    print 'stats for ', year, ', ', len(filelist), ' days'
+    return dates, means, counts, edgedistance
+
+def MonthlyMeans(dates, means):
+    '''
+    Monthly means {month: array (rings, sections)} as mean of the daily 
+    means of YearZonalStats
+    '''
     
-    feature = layer.GetFeature(0)
-    try:
-        feature.GetField(yearmonth)
-    except:
-        fieldDef = ogr.FieldDefn(yearmonth, ogr.OFTReal)
-        layer.CreateField(fieldDef)
+    monthlymeans = {}
+    months = (dates // 100) % 100
+    for month in sorted(set(months)):
+        with numpy.errstate(invalid = 'ignore'):
+            monthlymeans[int(month)] = numpy.nanmean(means[months == month], axis = 0)
+    return monthlymeans
 
+def CreateStatisticsDatabase(databasefile):
+    '''
+    Opens the sqlite database databasefile, creating the table
+    ringstatistics (year, month, day, ring, section, mean, count) and 
+    iceedgedistance (year, month, day, section, distance) with their 
+    indices if not present. Returns the connection
+    '''
     
-    featurecount = layer.GetFeatureCount()
-    for i in range(0, featurecount):
-        feature = layer.GetFeature(i)
+    connection = sqlite3.connect(databasefile)
+    connection.execute('CREATE TABLE IF NOT EXISTS ringstatistics (year INTEGER, month INTEGER, day INTEGER, '
+                       'ring INTEGER, section TEXT, mean REAL, count INTEGER)')
+    connection.execute('CREATE INDEX IF NOT EXISTS ringstatistics_zone ON ringstatistics (ring, section, year, month)')
+    connection.execute('CREATE INDEX IF NOT EXISTS ringstatistics_date ON ringstatistics (year, month, day)')
+    connection.execute('CREATE TABLE IF NOT EXISTS iceedgedistance (year INTEGER, month INTEGER, day INTEGER, '
+                       'section TEXT, distance REAL)')
+    connection.execute('CREATE INDEX IF NOT EXISTS iceedgedistance_section ON iceedgedistance (section, year, month)')
+    connection.commit()
+    return connection
 
-        
-        featurering = str(feature.GetFieldAsInteger('RING'))
-        featuresection = feature.GetFieldAsString('SECTION')
-        if (featurering == ring) and (featuresection == section):
-            feature.SetField(yearmonth, cumulativepermonth)
-            layer.SetFeature(feature)
-            layer.ResetReading()
-            #feature.Destroy()
-            datasource.Destroy()
-            return
+def InsertZonalStats(connection, year, dates, means, counts, rings, sections):
+    '''
+    Replaces all rows of year in the ringstatistics table with the daily
+    statistics of YearZonalStats, one row per day, ring and section.
+    Zones without valid pixel have mean NULL
+    '''
+    
+    days, NumberOfRings, NumberOfSections = means.shape
+    dayindex = numpy.repeat(numpy.arange(days), NumberOfRings * NumberOfSections)
+    ringindex = numpy.tile(numpy.repeat(numpy.arange(NumberOfRings), NumberOfSections), days)
+    sectionindex = numpy.tile(numpy.arange(NumberOfSections), days * NumberOfRings)
+    
+    means = means.ravel()
+    rows = zip((dates[dayindex] // 10000).tolist(), ((dates[dayindex] // 100) % 100).tolist(), (dates[dayindex] % 100).tolist(), \
+               [int(rings[i]) for i in ringindex], [str(sections[j]) for j in sectionindex], \
+               numpy.where(numpy.isnan(means), None, means).tolist(), counts.ravel().tolist())
+    
+    connection.execute('DELETE FROM ringstatistics WHERE year = ?', (year,))
+    connection.executemany('INSERT INTO ringstatistics VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    connection.commit()
+
+def InsertIceEdgeDistance(connection, year, dates, edgedistance, sections):
+    '''
+    Replaces all rows of year in the iceedgedistance table with the 
+    distances of YearZonalStats, one row per day and section. Sections 
+    without ice edge have distance NULL
+    '''
+    
+    days, NumberOfSections = edgedistance.shape
+    dayindex = numpy.repeat(numpy.arange(days), NumberOfSections)
+    sectionindex = numpy.tile(numpy.arange(NumberOfSections), days)
+    
+    edgedistance = edgedistance.ravel()
+    rows = zip((dates[dayindex] // 10000).tolist(), ((dates[dayindex] // 100) % 100).tolist(), (dates[dayindex] % 100).tolist(), \
+               [str(sections[j]) for j in sectionindex], numpy.where(numpy.isnan(edgedistance), None, edgedistance).tolist())
+    
+    connection.execute('DELETE FROM iceedgedistance WHERE year = ?', (year,))
+    connection.executemany('INSERT INTO iceedgedistance VALUES (?, ?, ?, ?, ?)', rows)
+    connection.commit()
+
+def ProcessYears(startyear, stopyear, nsidcpath, zones, databasefile, processes = None, \
+                 ringstatisticspath = None, edgezones = None):
+    '''
+    Runs YearZonalStats for startyear - stopyear inclusive in a pool of
+    processes (None uses all cores). The results are written by this
+    process as they arrive, into the tables of databasefile (rows of a year
+    done again are replaced) and, if ringstatisticspath is given, as 
+    monthly means into RingStatistics<year>.shp there. The ice edge 
+    distance is done if edgezones of IceEdgeZones is given
+    '''
+    
+    connection = CreateStatisticsDatabase(databasefile)
+    
+    pool = multiprocessing.Pool(processes)
+    results = [(year, pool.apply_async(YearZonalStats, (year, nsidcpath, zones, edgezones))) \
+               for year in range(startyear, stopyear + 1)]
+    pool.close()
+    
+    for (year, result) in results:
+        dates, means, counts, edgedistance = result.get()
+        if len(dates) == 0:
+            print 'No files for ', year
+            continue
+        InsertZonalStats(connection, year, dates, means, counts, zones['rings'], zones['sections'])
+        if edgedistance is not None:
+            InsertIceEdgeDistance(connection, year, dates, edgedistance, zones['sections'])
+        if ringstatisticspath is not None:
+            CreateRingStatistics(year, MonthlyMeans(dates, means), zones['rings'], zones['sections'], ringstatisticspath)
+    
+    pool.join()
+    connection.close()
+
+def RingStatisticsIndex(layer):
+    '''
+    Returns the FID of each feature of the RingStatistics layer as 
+    dictionary {(RING, SECTION): FID}, RING as string as in ringDict
+    '''
+    
+    index = {}
     layer.ResetReading()
+    for feature in layer:
+        index[(str(feature.GetFieldAsInteger('RING')), feature.GetFieldAsString('SECTION'))] = feature.GetFID()
+    layer.ResetReading()
+    return index
+
+def CreateRingStatistics(year, monthlymeans, rings, sections, \
+                         ringstatisticspath = '/home/max/Documents/DagIskart/'):
+    '''
+    Writes the monthly means of one year into RingStatistics<year>.shp, 
+    one field YYYYMM per month, called by ProcessYears for each year.
+    monthlymeans is {month: array (rings, sections)} as returned by 
+    MonthlyMeans from the daily means of YearZonalStats. If the shapefile is missing the year
+    is skipped with a message.
+    
+    The shapefile is opened once, all missing month fields are created
+    first, features are found through RingStatisticsIndex and every feature
+    is written once with all months. Zones without valid pixel (nan) are
+    left empty
+    '''
+    
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    ringstatisticsfile = ringstatisticspath + 'RingStatistics' + str(year) + '.shp'
+    datasource = driver.Open(ringstatisticsfile, 1)
+    if datasource is None:
+        print 'Could not open ', ringstatisticsfile, ', monthly means of ', year, ' not written'
+        return
+    layer = datasource.GetLayer()
+    
+    months = sorted(monthlymeans)
+    # Field names are YYYYMM for all months. Earlier versions wrote October
+    # as YYYY010 (year + '0' + month), shapefiles of those versions have
+    # their October values in that field and get a new field YYYY10
+    yearmonths = [str(year * 100 + month) for month in months]
+    for yearmonth in yearmonths:
+        if layer.GetLayerDefn().GetFieldIndex(yearmonth) < 0:
+            layer.CreateField(ogr.FieldDefn(yearmonth, ogr.OFTReal))
+    
+    index = RingStatisticsIndex(layer)
+    
+    # no transaction, the ESRI Shapefile driver writes each feature directly
+    for i, ring in enumerate(rings):
+        for j, section in enumerate(sections):
+            if (str(ring), str(section)) not in index:
+                print 'No feature for ring ', ring, ' section ', section
+                continue
+            feature = layer.GetFeature(index[(str(ring), str(section))])
+            for (month, yearmonth) in zip(months, yearmonths):
+                if not numpy.isnan(monthlymeans[month][i, j]):
+                    feature.SetField(yearmonth, float(monthlymeans[month][i, j]))
+            layer.SetFeature(feature)
+            feature = None
+    
+    layer = None
     datasource.Destroy()
     
     
@@ -247,72 +554,70 @@ def CreateRingStatistics(ring, section, year, monthAsNumber, cumulativepermonth)
 ##############################################################################
 
 
-startyear = 2002
-stopyear = 2002
-
-
-monthDict={1:'January', 2:'February', 3:'March', 4:'April', 5:'May', 6:'June', 7:'July', 8:'August', 9:'September', 10:'October', 11:'November', 12:'December'}
-#monthDict = {1:'January'}
-ringDict={1:'25', 2:'50', 3:'75', 4:'100', 5:'125', 6:'150', 7:'175', 8:'200',\
-          9: '225', 10:'250', 11:'275', 12:'300', 13:'325', 14:'350', 15:'375',\
-          16:'400'}
-sectionDict={1:'NE', 2:'SE', 3:'SW', 4:'W', 5:'NW'}
-#outfilepath = 'C:\\Users\\max\\Documents\\IcePersistency\\' + monthDict[month] + '\\'
-
+if __name__ == '__main__':
     
-#Create filelist including all files for the given month between startyear and stopyear inclusive
-filelist = []
-for year in range(startyear, stopyear + 1):
-    outfilepath = '//media//max//Transcend//DagIskart//' + str(year) + '//'
-    
-    if os.path.exists(outfilepath):
-        answer = raw_input(outfilepath + " exists, delete and overwrite folder? [Y]es?")
-        if answer.lower().startswith('y'):
-            print "Overwriting " + outfilepath        
-            shutil.rmtree(outfilepath)
-            os.makedirs(outfilepath)
-        else:
-            print "Ending program"
-            sys.exit()
-        
-    elif not os.path.exists(outfilepath):
-        os.makedirs(outfilepath)
-    
-    for month in range(1,13):
-        foldername = '//media//max//Transcend//NSIDC//north//daily//' + str(year) + '//'
-        if month < 10: 
-            file_searchstring = 'nt_' + str(year) + '0' + str(month) + '*.bin'
-        else:
-            file_searchstring = 'nt_' + str(year)  + str(month) + '*.bin'
-        
-        foldersearchstring = foldername + file_searchstring
-        filelist = []        
-        filelist = glob.glob(foldersearchstring)
-        # presentoutput = where in this iteration files are saved
-        presentoutput = outfilepath + '//' + monthDict[month] + '//'
-        os.makedirs(presentoutput)
-        for icechart in filelist:
-                #Convert NSIDC files to GeoTiff
-                print'convert ', icechart
-                Bin2GeoTiff(icechart, presentoutput)
-        
-        projectedlist = []
-        projectedlist = glob.glob(presentoutput + '//EPSG32633//*EPSG32633.tif')
-        
-        #Create file for each section and ring
-
-
-        for projectedfile in projectedlist:
-            for i in ringDict:
-                for j in sectionDict:
-                    ExtractRingSection(ringDict[i], sectionDict[j], \
-                               projectedfile, presentoutput + '//EPSG32633//')
-        for i in ringDict:
-            for j in sectionDict:
-                print 'stats for ring ', i,'section', j
-                ringsectionlist = glob.glob(presentoutput + 'EPSG32633//*ring' + \
-                           str(ringDict[i]) + '_section' + str(sectionDict[j]) + '.tif')
-                MonthlyStats(outfilepath, ringsectionlist, year, str(ringDict[i]), str(sectionDict[j]))
-        
-print "Done"        
-    
\ No newline at end of file
+    #############################
+    # SET PATH AND VARIABLES HERE
+    #############################
+    
+    startyear = 1979
+    stopyear = 2015
+    
+    ringDict={1:'25', 2:'50', 3:'75', 4:'100', 5:'125', 6:'150', 7:'175', 8:'200',\
+              9: '225', 10:'250', 11:'275', 12:'300', 13:'325', 14:'350', 15:'375',\
+              16:'400'}
+    sectionDict={1:'NE', 2:'SE', 3:'SW', 4:'W', 5:'NW'}
+    
+    # Ring and section polygons, rasterized once for all days
+    ringsectionshapefile = '//home//max//Documents//DagIskart//RingSectionsMerge.shp'
+    
+    # False takes the zones from the EPSG:32633 grid as in the published 
+    # statistics, True projects the polygons to the NSIDC grid and weights 
+    # each pixel with its share in the zone (values differ slightly)
+    nativegrid = False
+    
+    # NSIDC daily charts, one folder per year
+    nsidcpath = '//media//max//Transcend//NSIDC//north//daily//'
+    
+    # Daily statistics of all years, rows of years done again are replaced
+    databasefile = '//media//max//Transcend//DagIskart//RingStatistics.sqlite'
+    
+    # Folder of RingStatistics<year>.shp for the monthly means, None for none
+    ringstatisticspath = '/home/max/Documents/DagIskart/'
+    
+    # Number of years processed at the same time, None uses all cores
+    processes = None
+    
+    # Landmask on the NSIDC grid for the daily distance from the Svalbard 
+    # coast to the ice edge in each section, None for no distance
+    landmask_raster = '//mnt//seaiceremotesensing//Isfrekvens//landmasks//NSIDC_landmask_raster.tif'
+    
+    # Coastal error mask on the NSIDC grid, its pixels are left out of the 
+    # ice edge, None to use all pixels
+    coastalerrormask_raster = '//mnt//seaiceremotesensing//Isfrekvens//landmasks//NSIDC_coastalerrormask_raster.tif'
+    
+    ##############################
+    # END OF VARIABLES TO BE SET
+    ##############################
+    
+    rings = [ringDict[i] for i in sorted(ringDict)]
+    sections = [sectionDict[j] for j in sorted(sectionDict)]
+    if nativegrid:
+        zones = NSIDCZoneWeights(ringsectionshapefile, rings, sections)
+    else:
+        zones = RingSectionZones(ringsectionshapefile, rings, sections)
+    
+    edgezones = None
+    if landmask_raster is not None:
+        landmask = gdal.Open(landmask_raster, gdalconst.GA_ReadOnly)
+        coastalerrorraster = None
+        if coastalerrormask_raster is not None:
+            coastalerrormask = gdal.Open(coastalerrormask_raster, gdalconst.GA_ReadOnly)
+            coastalerrorraster = coastalerrormask.ReadAsArray()
+            coastalerrormask = None
+        edgezones = IceEdgeZones(landmask.ReadAsArray(), zones, coastalerrorraster)
+        landmask = None
+    
+    ProcessYears(startyear, stopyear, nsidcpath, zones, databasefile, processes, ringstatisticspath, edgezones)
+    
+    print "Done"
@@ -10,6 +10,7 @@ Parameters are set in Core of the Program, see below all functions
  * ReprojectShapefile -- reprojects the shapefile
  * Shape2Raster -- converts shapefile to GeoTIFF raster
  * AddMissingDays -- a missing file is replaced with the next available previous day.
+ * ReadAhead -- reads the next ice charts in threads while the current one is processed (SeaIceFrequency/ReadAhead.py)
  * CreateMapFastIceDays -- a map whose values indicated (non-consecutive) days of fast ice
  * CreateConsecFastIceDays -- map showing consecutive days of fast ice (wanted minimum number as input)
  * CreatePercentageMap -- map showing percentage sea ice cover over a given period
@@ -25,6 +26,10 @@ Parameters are set in Core of the Program, see below all functions
 # Import Modules
 import ogr, osr, os, sys, glob, numpy, gdal, gdalconst, datetime, shutil, fnmatch, subprocess
 
+# ReadAhead is shared with SeaIceFrequency.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SeaIceFrequency'))
+from ReadAhead import ReadAhead
+
 
 
 ##############################################################################
@@ -322,6 +327,19 @@ def AddMissingDays(outfilepath, filelist):
     print "Done replacing missing dates"    
     
     
+def ReadIceChart(infile):
+    '''
+    Reads an ice chart GeoTIFF into an array, None if it cannot be opened
+    '''
+    
+    icechart = gdal.Open(infile, gdalconst.GA_ReadOnly)
+    if icechart is None:
+        print 'Could not open ', infile
+        return None
+    iceraster = icechart.ReadAsArray()
+    icechart = None
+    return iceraster
+    
 def CreateMapFastIceDays(inpath, outfilepath, filelist):
     '''
     Creates Map where number indicates days with fast ice, 999 is land
@@ -372,30 +390,16 @@ def CreateMapFastIceDays(inpath, outfilepath, filelist):
     outarray = numpy.zeros((rows, cols), numpy.float)    
     
     #Loop through all files to do calculation
-    for infile in filelist:
-        
-        (infilepath, infilename) = os.path.split(infile)
-        (infileshortname, extension) = os.path.splitext(infilename)
-        infile = outfilepath+ infileshortname + '.tif'
-        print 'Processing ', infilename
-        
-        #open the IceChart
-        icechart = gdal.Open(infile, gdalconst.GA_ReadOnly)
-        if infile is None:
-            print 'Could not open ', infilename
-            return
-        
-        #get image size
-        rows = icechart.RasterYSize
-        cols = icechart.RasterXSize
-                
-        #get the bands 
-        outband = outraster.GetRasterBand(1)
+    #the next ice charts are read in threads while one is processed
+    outband = outraster.GetRasterBand(1)
+    tiffiles = [outfilepath + os.path.splitext(os.path.split(infile)[1])[0] + '.tif' for infile in filelist]
+    for (infile, iceraster) in ReadAhead(tiffiles, ReadIceChart):
         
-
+        print 'Processing ', os.path.split(infile)[1]
+        if iceraster is None:
+            print 'Skipping ', os.path.split(infile)[1]
+            continue
         
-        #Read input raster into array
-        iceraster = icechart.ReadAsArray()
         
         #Count pixel, if fastice add one, of not keep value -- add land mask
         outarray = numpy.where( (iceraster == 100), outarray + 1 , outarray)
@@ -467,30 +471,16 @@ def CreatePercentageMap(inpath, outfilepath, filelist):
     outarray = numpy.zeros((rows, cols), numpy.float)    
     
     #Loop through all files to do calculation
-    for infile in filelist:
-        
-        (infilepath, infilename) = os.path.split(infile)
-        (infileshortname, extension) = os.path.splitext(infilename)
-        infile = outfilepath + infileshortname + '.tif'
-        print 'Processing ', infilename
-        
-        #open the IceChart
-        icechart = gdal.Open(infile, gdalconst.GA_ReadOnly)
-        if infile is None:
-            print 'Could not open ', infilename
-            return
-        
-        #get image size
-        rows = icechart.RasterYSize
-        cols = icechart.RasterXSize
-                
-        #get the bands 
-        outband = outraster.GetRasterBand(1)
+    #the next ice charts are read in threads while one is processed
+    outband = outraster.GetRasterBand(1)
+    tiffiles = [outfilepath + os.path.splitext(os.path.split(infile)[1])[0] + '.tif' for infile in filelist]
+    for (infile, iceraster) in ReadAhead(tiffiles, ReadIceChart):
         
-
+        print 'Processing ', os.path.split(infile)[1]
+        if iceraster is None:
+            print 'Skipping ', os.path.split(infile)[1]
+            continue
         
-        #Read input raster into array
-        iceraster = icechart.ReadAsArray()
         
         #Process the image
 
@@ -685,33 +675,21 @@ def CreateMapConsecutiveFastIceDays(inpath, outfilepath, consecutivenumber, file
     #fill previousraster with ones
     previousraster = outarray + 1
     countingraster = outarray
+    #last chart read, for the land mask after the loop
+    lastraster = outarray
     
     #Loop through all files to do calculation
-    for infile in filelist:
-        
-        (infilepath, infilename) = os.path.split(infile)
-        (infileshortname, extension) = os.path.splitext(infilename)
-        infile = outfilepath + infileshortname + '.tif'
-        print 'Processing ', infilename
-        
-        #open the IceChart
-        icechart = gdal.Open(infile, gdalconst.GA_ReadOnly)
-        if infile is None:
-            print 'Could not open ', infilename
-            return
+    #the next ice charts are read in threads while one is processed
+    outband = outraster.GetRasterBand(1)
+    tiffiles = [outfilepath + os.path.splitext(os.path.split(infile)[1])[0] + '.tif' for infile in filelist]
+    for (infile, iceraster) in ReadAhead(tiffiles, ReadIceChart):
         
-        #get image size
-        rows = icechart.RasterYSize
-        cols = icechart.RasterXSize
-                
-        #get the bands 
-        outband = outraster.GetRasterBand(1)
+        print 'Processing ', os.path.split(infile)[1]
+        if iceraster is None:
+            print 'Skipping ', os.path.split(infile)[1]
+            continue
         
-
         ###CALCULATE CONSECUTIVE DAYS###
-        #Read input raster into array
-        iceraster = icechart.ReadAsArray()
-        
         #Add one where fast ice otherwise keep number, count in countingraster
         outarray = numpy.where( (iceraster == 100), outarray + 1 , outarray)
         #outarray = numpy.where( (iceraster >=80), outarray + 1 , outarray)
@@ -729,11 +707,12 @@ def CreateMapConsecutiveFastIceDays(inpath, outfilepath, consecutivenumber, file
         #New previousraster
         previousraster = numpy.where( (iceraster == 100), 1 , 0)
         #previousraster = numpy.where( (iceraster >= 80), 1 , 0)
+        lastraster = iceraster
         
     
     #Has to finish after last run checking last image
     outarray = numpy.where((countingraster < consecutivenumber), 0 , outarray)
-    outarray = numpy.where( (iceraster == 999), 999 , outarray)
+    outarray = numpy.where( (lastraster == 999), 999 , outarray)
 
     
     #Write to file     
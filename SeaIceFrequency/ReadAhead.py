@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Reading files ahead in threads, shared by SeaIceFrequency.py and 
+MetIceCharts/IceChartProcessing.py
+* ReadAhead -- read the next files in threads while the current one is processed
+"""
+
+import multiprocessing.pool
+
+def ReadAhead(filelist, readfunction, prefetch = 4, memorybudget = 256):
+    '''
+    Yields (infile, readfunction(infile)) for all files of filelist in order,
+    while the following files are already read in a pool of prefetch threads.
+    Reading from the network mounts then overlaps with the calculation on
+    the current day.
+    
+    memorybudget (MB) limits the arrays read ahead but not yet used: the
+    number of files read ahead is reduced such that their arrays, estimated
+    from the size of the first one, fit into the budget
+    '''
+    
+    if len(filelist) == 0:
+        return
+    
+    pool = multiprocessing.pool.ThreadPool(prefetch)
+    try:
+        pending = [pool.apply_async(readfunction, (filelist[0],))]
+        nextfile = 1
+        inflight = None
+        for infile in filelist:
+            inarray = pending.pop(0).get()
+            if inflight is None:
+                # the first array gives the number of files read ahead
+                arraysize = max(getattr(inarray, 'nbytes', 1), 1)
+                inflight = max(1, min(prefetch, int(memorybudget * 1024 * 1024 // arraysize)))
+            while (len(pending) < inflight) and (nextfile < len(filelist)):
+                pending.append(pool.apply_async(readfunction, (filelist[nextfile],)))
+                nextfile = nextfile + 1
+            yield infile, inarray
+    finally:
+        pool.terminate()
+        pool.join()
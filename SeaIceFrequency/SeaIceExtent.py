@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Daily sea ice extent and area time series from NSIDC sea ice concentration
+
+All daily charts of the period are decoded into one memory-mapped cube
+(Bin2Cube of SeaIceFrequency.py) and extent and area are summed for each
+region and day from this cube in blocks of days, one bincount per block
+* CellAreas -- area of each pixel of the NSIDC grid in km2
+* ReadRegions -- region label raster on the NSIDC grid
+* ExtentAreaSeries -- extent and area for all regions and days of a cube
+* WriteSeriesCSV -- write the series as one column per region
+
+extent = area of all pixels with concentration >= 15% (value 38)
+area = sum of concentration times pixel area of the pixels >= 15%
+
+As in the NSIDC Sea Ice Index the polar hole (251) is counted as ice in the
+extent, but not in the area
+"""
+
+import numpy, gdal, gdalconst, os, datetime
+import SeaIceFrequency
+
+def CellAreas(cellarea_raster = None, geotransform = (-3850000.0, 25000.0, 0.0, 5850000.0, 0.0, -25000.0), \
+              shape = (448, 304)):
+    '''
+    Returns the area in km2 of each pixel of the NSIDC grid, or of the grid
+    given by geotransform and shape (the scale factor is the same in the 
+    south, true scale at 70S)
+
+    If cellarea_raster is given, the areas are read from this raster (km2),
+    e.g. converted from the NSIDC psn25area file. Otherwise the area is
+    calculated from the scale factor k of the polar stereographic projection
+    (Hughes ellipsoid, true scale at 70N) at the pixel centre as
+    pixelsize / k**2, see Snyder, Map Projections, p. 160-162
+    '''
+
+    if cellarea_raster is not None:
+        arearaster = gdal.Open(cellarea_raster, gdalconst.GA_ReadOnly)
+        cellarea = arearaster.ReadAsArray().astype(numpy.float64)
+        arearaster = None
+        return cellarea
+
+    # Hughes 1980 ellipsoid as in the proj4 definition of EPSG:3411
+    a = 6378273.0
+    b = 6356889.449
+    e = numpy.sqrt(1.0 - (b / a) ** 2)
+    truescale = numpy.radians(70.0)
+
+    # map coordinates of pixel centres
+    rows, cols = shape
+    x = geotransform[0] + (numpy.arange(cols) + 0.5) * geotransform[1]
+    y = geotransform[3] + (numpy.arange(rows) + 0.5) * geotransform[5]
+    x, y = numpy.meshgrid(x, y)
+    rho = numpy.hypot(x, y)
+
+    def m(phi):
+        return numpy.cos(phi) / numpy.sqrt(1.0 - (e * numpy.sin(phi)) ** 2)
+    def t(phi):
+        return numpy.tan(numpy.pi / 4 - phi / 2) / ((1.0 - e * numpy.sin(phi)) / (1.0 + e * numpy.sin(phi))) ** (e / 2)
+
+    # latitude by iteration, Snyder eq. 7-9
+    tpixel = rho * t(truescale) / (a * m(truescale))
+    latitude = numpy.pi / 2 - 2 * numpy.arctan(tpixel)
+    for i in range(6):
+        latitude = numpy.pi / 2 - 2 * numpy.arctan(tpixel * ((1.0 - e * numpy.sin(latitude)) / (1.0 + e * numpy.sin(latitude))) ** (e / 2))
+
+    # at the pole m is 0, k there is the limit of rho / (a m)
+    k = numpy.empty(shape)
+    nearpole = rho < 1.0
+    k[~nearpole] = rho[~nearpole] / (a * m(latitude[~nearpole]))
+    k[nearpole] = m(truescale) / t(truescale) * numpy.sqrt((1 + e) ** (1 + e) * (1 - e) ** (1 - e)) / 2
+
+    return abs(geotransform[1] * geotransform[5]) / k ** 2 / 1.0e6
+
+def ReadRegions(region_raster):
+    '''
+    Reads the region label raster (NSIDC grid, 0 = no region, 1, 2, ... the
+    regions) and returns it as integer array
+    '''
+
+    regions = gdal.Open(region_raster, gdalconst.GA_ReadOnly)
+    labels = regions.ReadAsArray().astype(numpy.intp)
+    regions = None
+    if labels.min() < 0:
+        raise ValueError('Negative region label in ' + region_raster)
+    return labels
+
+def ExtentAreaSeries(cubefile, labels, cellarea, blocksize = 64):
+    '''
+    Sums extent and area (km2) for all valid days of the cube and all
+    region labels. Returns the dates and two arrays of shape (days, labels)
+    where column l is the region with label l. The whole grid is then the
+    sum over all columns.
+
+    Each block of days is summed with one bincount, the bin of pixel p on
+    day d being d * NumberOfLabels + labels[p], weighted with the pixel area
+    times 1 (extent) or the concentration (area) from a lookup table
+    '''
+
+    # weight of each value 0-255 for extent and area
+    extentweight = numpy.zeros(256)
+    extentweight[38:252] = 1.0
+    areaweight = numpy.zeros(256)
+    areaweight[38:251] = numpy.arange(38, 251) / 250.0
+
+    cube, dates, valid = SeaIceFrequency.OpenCube(cubefile)
+    daylist = numpy.flatnonzero(valid)
+
+    NumberOfLabels = labels.max() + 1
+    labels = labels.ravel()
+    cellarea = cellarea.ravel()
+
+    extent = numpy.zeros((len(daylist), NumberOfLabels))
+    area = numpy.zeros((len(daylist), NumberOfLabels))
+
+    for start in range(0, len(daylist), blocksize):
+        block = daylist[start:start + blocksize]
+        print 'Processing ', dates[block[0]], ' - ', dates[block[-1]]
+
+        values = cube[block].reshape((len(block), -1))
+        index = (numpy.arange(len(block)) * NumberOfLabels)[:, numpy.newaxis] + labels
+        index = index.ravel()
+        NumberOfBins = len(block) * NumberOfLabels
+
+        extent[start:start + len(block)] = numpy.bincount(index, (extentweight[values] * cellarea).ravel(), \
+                                  NumberOfBins).reshape((len(block), NumberOfLabels))
+        area[start:start + len(block)] = numpy.bincount(index, (areaweight[values] * cellarea).ravel(), \
+                                  NumberOfBins).reshape((len(block), NumberOfLabels))
+
+    cube = None
+    return [dates[day] for day in daylist], extent, area
+
+def WriteSeriesCSV(outfile, dates, extent, area, regionnames):
+    '''
+    Writes the series as csv, one row per day and extent and area columns
+    for the whole grid and each region in regionnames {label: name}
+    '''
+
+    names = sorted(regionnames.items())
+    csvfile = open(outfile, 'w')
+    csvfile.write('date, extent_total, area_total')
+    for (label, name) in names:
+        csvfile.write(', extent_' + name + ', area_' + name)
+    csvfile.write('\n')
+
+    for i, date in enumerate(dates):
+        csvfile.write(date.strftime('%Y-%m-%d') + ', %.1f, %.1f' % (extent[i].sum(), area[i].sum()))
+        for (label, name) in names:
+            csvfile.write(', %.1f, %.1f' % (extent[i, label], area[i, label]))
+        csvfile.write('\n')
+    csvfile.close()
+
+
+##############################################################################
+
+###   Core of Program follows here ###
+
+##############################################################################
+
+if __name__ == '__main__':
+
+    #############################
+    # SET PATH AND VARIABLES HERE
+    #############################
+
+    # Region label raster on the NSIDC grid and the name of each label
+    region_raster = '//mnt//seaiceremotesensing//Isfrekvens//landmasks//NSIDC_regions.tif'
+    regionnames = {1:'BarentsSea', 2:'FramStrait'}
+
+    # Pixel areas in km2 on the NSIDC grid, None calculates them from the projection
+    cellarea_raster = None
+
+    # Period of the time series
+    startdate = datetime.date(1979, 1, 1)
+    stopdate = datetime.date.today()
+
+    # Set path where NSIDC sea ice concentration is stored
+    nsidcpath = '//mnt//seaiceremotesensing//SSMI//IceConcentration//NASATEAM//final-gsfc//north//daily//'
+    
+    # Product in nsidcpath, one of SeaIceFrequency.NSIDCProducts, region raster on its grid
+    product = 'nsidc0051_north'
+
+    # Results, the cube is kept here such that a rerun does not decode again
+    outfilepath = '//mnt//seaiceremotesensing//Isfrekvens//SeaIceExtent//'
+
+    ##############################
+    # END OF VARIABLES TO BE SET
+    ##############################
+
+    if not os.path.exists(outfilepath):
+        os.makedirs(outfilepath)
+
+    datelist = [startdate + datetime.timedelta(days = i) for i in range((stopdate - startdate).days + 1)]
+    cubefile = outfilepath + 'NSIDC_cube_' + startdate.strftime('%Y%m%d') + '_' + stopdate.strftime('%Y%m%d') + '.npy'
+    if not os.path.exists(cubefile):
+        SeaIceFrequency.Bin2Cube(datelist, nsidcpath, cubefile, product)
+
+    labels = ReadRegions(region_raster)
+    grid = SeaIceFrequency.ProductGrid(product)
+    cellarea = CellAreas(cellarea_raster, grid['geotransform'], grid['shape'])
+
+    dates, extent, area = ExtentAreaSeries(cubefile, labels, cellarea)
+    outfile = outfilepath + 'SeaIceExtent_' + startdate.strftime('%Y%m%d') + '_' + stopdate.strftime('%Y%m%d') + '.csv'
+    WriteSeriesCSV(outfile, dates, extent, area, regionnames)
+
+    print 'Written ', outfile
@@ -6,20 +6,42 @@ Created on Wed Feb 26 08:18:31 2014
  
 Creating ice persistency maps from NSIDC sea ice concentration charts
 * Bin2GeoTiff -- converting binary NSIDC maps to GeoTIFF
+* Bin2Cube -- decode all NSIDC maps of a period into one memory-mapped cube
+* ReadAhead -- read the next files in threads while the current one is processed (ReadAhead.py)
+* NSIDCProducts / NSIDCGrids -- registry of readable products and their grids
+* AddMissingDays -- replace missing days in the cube with neighbouring days
+* FilterCoastalAreas -- remove erroneous ice pixels along the coast
+* ReduceIceStack -- count ice days in one pass through the cube
+* OceanPixels / ScatterPixels -- reduce only the ocean pixels as 1-D arrays, full grid at output
 * CreateSeaIceFrequencyMap -- create SeaIceFrequency map
 * CreateMaxMinIce -- create min/max ice maps
+* CreateFrequencyIsolines -- 10% - 90% isolines of the frequency map by marching squares
 * EPSG3411_2_EPSG3575 -- reproject raster from EPSG:3411 to EPSG:3575
+* ReprojectionIndex -- cached pixel mapping from EPSG:3411 to other projections
+* ReprojectCube -- reproject all days of a cube in one step
 * ReprojectShapefile -- reproject shapefiles from EPSG:3411 to EPSG:3575
+* ProcessMonth / ProcessMonths -- complete run for one month / several months in parallel
+* RunStages -- run stages in dependency order, skipping those with up to date outputs
+* UpdateMonth -- move a month climatology to a new period using the per year counts
+* ConcentrationHistogram / HistogramAccumulator -- ice maps for any threshold from concentration classes
+* IceDayTrend / CreateTrendMaps -- per pixel trend, significance and anomaly of ice days
+* CreateBootstrapMaps -- confidence band of the frequency map from resampled years
+* IceSeasonMetrics / CreateIceSeasonMaps -- first and last ice day, season length and gaps per season
+* CreatePrefixSums / WindowAccumulator -- counts of any period from cumulative per year counts
+* ProcessRollingWindows / ProcessRollingMonths -- several overlapping periods in one run
 Documentation before each function and at https://github.com/npolar/RemoteSensing/wiki/Sea-Ice-Frequency
 """
 
-import struct, numpy, gdal, gdalconst, glob, os, osr
-import shutil, sys, datetime
+import numpy, gdal, gdalconst, glob, os, osr, ogr
+import shutil, sys, datetime, tempfile, multiprocessing, calendar, Queue
+import multiprocessing.pool, threading
+from ReadAhead import ReadAhead
+from scipy import stats
 
 
-def AddMissingDays(year, month, infilepath):
+def AddMissingDays(year, month, cubefile):
     '''
-        Replaces missing days with files from previous day
+        Replaces missing days in the cube with data from previous day
     '''
     
     #http://pymotw.com/2/datetime/
@@ -35,70 +57,207 @@ def AddMissingDays(year, month, infilepath):
     #date3 is working date to be looped through  -- set to start date   
     d3 = d1
     
-    print "REPLACE MISSING FILES FOR ", year
+    print "REPLACE MISSING DAYS FOR ", year
     
+    cube, dates, valid = OpenCube(cubefile, 'r+')
+    # dictionary giving the position of each date in the cube
+    dateindex = dict((date, i) for (i, date) in enumerate(dates))
     
     while d3 != d2:
-        # Create searchstring for file to be checked if it exists
-        day = d3.day
         
-        checkfile = infilepath + "nt_" + d3.strftime('%Y%m%d') + "*"
+        # Only days which are part of the cube can be replaced
+        if d3 not in dateindex:
+            d3 = (d3 + diff)
+            continue
+        missing = dateindex[d3]
         
-        # Check if that file exists
-        checkfilelist = glob.glob(checkfile)
-        
-        # If that file does not exist, replace it with previous day file
+        # If that day does not exist, replace it with previous day
         # check 1-3 previous days, if not exist, take following day
         # Needed because for first of monty, the 31 of previous month not available
         # as it is programmed now
-        if checkfilelist == []:    
+        if not valid[missing]:
+            replacing = None
             for i in (-1, -2, -3, 1, 2):
                 newdate = d3 + datetime.timedelta(days=i)
-                print newdate
-                replacingfile = infilepath + "nt_" + newdate.strftime('%Y%m%d') + "*"
-                
-                replacingfilelist = glob.glob(replacingfile)
-                print replacingfilelist
-                if replacingfilelist != []:
+                if (newdate in dateindex) and valid[dateindex[newdate]]:
+                    replacing = dateindex[newdate]
                     break
             
-                        
-            try:
-                pathname, filename = os.path.split(replacingfilelist[0])
-            except:
+            # In 1987, 14 days are missing, these are not replaced
+            if replacing is None:
                 d3 = (d3 + diff) 
                 continue
-            if day < 10:
-                missingfile = pathname + "//" + filename[0:9] + "0" + str(day) + filename[11:]
-            else:
-                missingfile = pathname + "//" + filename[0:9] +  str(day) + filename[11:]
-            print "Missing ", missingfile 
-            print "replaced with ", replacingfilelist[0]
             
-            # In 1987, 14 days are missing, these are not replaced, shutil fails here
-            try:
-                shutil.copy(replacingfilelist[0], missingfile)
-            except:
-                d3 = (d3 + diff) 
-                continue
+            print "Missing ", d3
+            print "replaced with ", dates[replacing]
+            cube[missing] = cube[replacing]
+            valid[missing] = True
             
         d3 = (d3 + diff)    
+    
+    cube.flush()
+    numpy.save(CubeFilenames(cubefile)[1], valid)
+    cube = None
 
 
 def EPSG3411_2_EPSG3575(infile):
     '''
     reprojects the infile from NSIDC 3411 to EPSG 3575
-    outputfile has 25km resolution
+    outputfile has 25km resolution, see ReprojectWithIndex
+    '''
+    
+    ReprojectWithIndex(infile, 'EPSG:3575')
+    
+def ReprojectWithIndex(infile, outproj):
     '''
+    reprojects the infile from NSIDC 3411 to the northern projection outproj,
+    output is written to a subfolder named after the projection, e.g. 
+    EPSG3575, with the projection added to the file name
     
+    Files on the NSIDC grid are reprojected with the cached pixel mapping
+    of ReprojectionIndex, other files with gdalwarp
+    '''
+    
+    projname = outproj[0:4] + outproj[5:]
     (infilepath, infilename) = os.path.split(infile)
     (infileshortname, extension) = os.path.splitext(infilename)
-    outdirectory = infilepath + '//EPSG3575//'
+    outdirectory = infilepath + '//' + projname + '//'
     if not os.path.exists(outdirectory):
         os.makedirs(outdirectory)
-    outfile =  outdirectory + infileshortname + '_EPSG3575.tif'
+    outfile =  outdirectory + infileshortname + '_' + projname + '.tif'
     print ' Reproject ', infile, ' to ', outfile 
-    os.system('gdalwarp -s_srs EPSG:3411 -tr 25000 -25000 -t_srs EPSG:3575 -of GTiff ' + infile + ' ' + outfile)
+    
+    inraster = gdal.Open(infile, gdalconst.GA_ReadOnly)
+    shape = (inraster.RasterYSize, inraster.RasterXSize)
+    if shape not in [grid['shape'] for grid in NSIDCGrids.values()]:
+        inraster = None
+        os.system('gdalwarp -s_srs EPSG:3411 -tr 25000 -25000 -t_srs ' + outproj + ' -of GTiff ' + infile + ' ' + outfile)
+        return
+    if NSIDCGrid(shape)['hemisphere'] != 'north':
+        print outproj, ' is a northern projection, ', infile, ' not reprojected'
+        inraster = None
+        return
+    
+    inarray = inraster.ReadAsArray()
+    datatype = inraster.GetRasterBand(1).DataType
+    inraster = None
+    
+    index = ReprojectionIndex(outproj, shape = shape)
+    outarray = ReprojectArray(inarray, index)
+    
+    driver = gdal.GetDriverByName("GTiff")
+    outraster = driver.Create(outfile, index['cols'], index['rows'], 1, datatype)
+    outraster.SetGeoTransform(index['geotransform'])
+    outraster.SetProjection(index['projection'])
+    outband = outraster.GetRasterBand(1)
+    outband.WriteArray(outarray)
+    outband.FlushCache()
+    outband = None
+    outraster = None
+    
+# Reprojection indices already read in this process, see ReprojectionIndex
+ReprojectionIndexCache = {}
+
+def ReprojectionIndex(outproj = 'EPSG:3575', indexpath = None, shape = (448, 304)):
+    '''
+    Returns the nearest neighbour pixel mapping from the NSIDC grid (EPSG:3411)
+    to outproj at 25km resolution, or from the grid of NSIDCGrids with the
+    given shape at its resolution.
+    
+    The NSIDC grid never changes, so the mapping is computed only once: 
+    a raster holding the pixel number of each NSIDC pixel is reprojected 
+    with the same gdalwarp command as used for the ice charts. The result 
+    is cached as GeoTIFF in indexpath (default is the temp directory) and 
+    reused by all later calls.
+    
+    The mapping is a dictionary with rows, cols, geotransform, projection of 
+    the output grid and the arrays targetpixels / sourcepixels, giving for each
+    output pixel inside the NSIDC grid the NSIDC pixel it is taken from
+    '''
+    
+    grid = NSIDCGrid(shape)
+    rows, cols = grid['shape']
+    resolution = str(int(grid['geotransform'][1]))
+    if (outproj, shape) in ReprojectionIndexCache:
+        return ReprojectionIndexCache[(outproj, shape)]
+    
+    if indexpath is None:
+        indexpath = os.path.join(tempfile.gettempdir(), 'NSIDCReprojectionIndex') + '//'
+    if not os.path.exists(indexpath):
+        os.makedirs(indexpath)
+    indexfile = indexpath + 'NSIDC_index_' + outproj[0:4] + outproj[5:] + '.tif'
+    if shape != (448, 304):
+        indexfile = indexpath + 'NSIDC_index_' + str(rows) + 'x' + str(cols) + '_' + outproj[0:4] + outproj[5:] + '.tif'
+    
+    if not os.path.exists(indexfile):
+        print 'Create reprojection index ', indexfile
+        # pixel number + 1, such that 0 is outside the NSIDC grid as gdalwarp fills with 0
+        # unique names since several processes, and stages running in threads
+        # of one process, may create the index at the same time
+        tempname = str(os.getpid()) + '_' + str(threading.current_thread().ident)
+        tempindexfile = indexpath + 'NSIDC_pixelnumber_' + tempname + '.tif'
+        tempwarpedfile = indexpath + 'NSIDC_index_' + tempname + '.tif'
+        pixelraster = CreateNSIDCGeoTiff(tempindexfile, gdal.GDT_Int32, shape = shape)
+        pixelraster.GetRasterBand(1).WriteArray(numpy.arange(1, rows*cols + 1, dtype = numpy.int32).reshape((rows, cols)))
+        pixelraster = None
+        os.system('gdalwarp -q -s_srs "' + grid['proj4'] + '" -tr ' + resolution + ' -' + resolution + ' -t_srs ' + outproj \
+                  + ' -r near -of GTiff ' + tempindexfile + ' ' + tempwarpedfile)
+        os.remove(tempindexfile)
+        os.rename(tempwarpedfile, indexfile)
+    
+    indexraster = gdal.Open(indexfile, gdalconst.GA_ReadOnly)
+    pixelnumber = indexraster.ReadAsArray().ravel()
+    
+    index = {}
+    index['rows'] = indexraster.RasterYSize
+    index['cols'] = indexraster.RasterXSize
+    index['geotransform'] = indexraster.GetGeoTransform()
+    index['projection'] = indexraster.GetProjection()
+    index['targetpixels'] = numpy.flatnonzero(pixelnumber > 0)
+    index['sourcepixels'] = pixelnumber[index['targetpixels']] - 1
+    indexraster = None
+    
+    ReprojectionIndexCache[(outproj, shape)] = index
+    return index
+    
+def ReprojectArray(inarray, index):
+    '''
+    Reprojects an array on the NSIDC grid with the mapping of ReprojectionIndex
+    inarray may be a single day (448, 304) or a stack of days (days, 448, 304),
+    all days are reprojected in one indexing operation. 
+    Pixels outside the NSIDC grid are 0 as with gdalwarp
+    '''
+    
+    leadingshape = inarray.shape[:-2]
+    inarray = inarray.reshape(leadingshape + (-1,))
+    
+    outarray = numpy.zeros(leadingshape + (index['rows'] * index['cols'],), inarray.dtype)
+    outarray[..., index['targetpixels']] = inarray[..., index['sourcepixels']]
+    return outarray.reshape(leadingshape + (index['rows'], index['cols']))
+    
+def ReprojectCube(cubefile, outproj = 'EPSG:3575'):
+    '''
+    Reprojects all days of a cube created with Bin2Cube to outproj,
+    saved as cubefile with _EPSG3575 (or other) added to the name
+    '''
+    
+    (cubeshortname, extension) = os.path.splitext(cubefile)
+    outcubefile = cubeshortname + '_' + outproj[0:4] + outproj[5:] + extension
+    
+    cube, dates, valid = OpenCube(cubefile)
+    index = ReprojectionIndex(outproj, shape = cube.shape[1:])
+    outcube = numpy.lib.format.open_memmap(outcubefile, mode = 'w+', dtype = cube.dtype, \
+                                shape = (cube.shape[0], index['rows'], index['cols']))
+    outcube[:] = ReprojectArray(cube, index)
+    outcube.flush()
+    outcube = None
+    cube = None
+    
+    datesfile, validfile = CubeFilenames(outcubefile)
+    shutil.copy(CubeFilenames(cubefile)[0], datesfile)
+    shutil.copy(CubeFilenames(cubefile)[1], validfile)
+    
+    return outcubefile
     
 def ReprojectShapefile(infile, inproj = "EPSG:3411", outproj = "EPSG:3575"):
     '''
@@ -125,7 +284,7 @@ def ReprojectShapefile(infile, inproj = "EPSG:3411", outproj = "EPSG:3575"):
 
     return reprshapefile    
 
-def Bin2GeoTiff(infile,outfilepath ):
+def Bin2GeoTiff(infile,outfilepath, product = 'nsidc0051_north'):
     '''
         This function takes the NSIDC charts, being a flat binary string, and converts them to GeoTiff. Some details here:
         http://geoinformaticstutorial.blogspot.no/2014/02/reading-binary-data-nsidc-sea-ice.html
@@ -135,6 +294,7 @@ def Bin2GeoTiff(infile,outfilepath ):
         There also is produced a GeoTiff reprojected to EPSG:3575 which is the NP-standard for Barents/Fram-Strait.
         Details on how to map project are found here:
         http://geoinformaticstutorial.blogspot.no/2014/03/geocoding-nsidc-sea-ice-concentration.html
+        Other products and grids are read as declared in NSIDCProducts
         
     '''
     
@@ -143,44 +303,23 @@ def Bin2GeoTiff(infile,outfilepath ):
     (infileshortname, extension) = os.path.splitext(infilename)
         
     outfile = outfilepath + infileshortname + '.tif'
-    #Dimensions from https://nsidc.org/data/docs/daac/nsidc0051_gsfc_seaice.gd.html
-    height = 448
-    width = 304
     
     #####    
     # READ FLAT BINARY INTO ARRAY
     #####
-    #for this code on how to read flat binary string, inspiration found at https://stevendkay.wordpress.com/category/python/
-    icefile = open(infile, "rb")
-    contents = icefile.read()
-    icefile.close()
-    
-    # unpack binary data into a flat tuple z
-    #offset and width/height from https://nsidc.org/data/docs/daac/nsidc0051_gsfc_seaice.gd.html
-    s="%dB" % (int(width*height),)
-    z=struct.unpack_from(s, contents, offset = 300) 
-    nsidc = numpy.array(z).reshape((448,304))
+    nsidc = ReadNSIDCBin(infile, product)
     
     ########
     #WRITE THE ARRAY TO GEOTIFF
     ########
-    driver = gdal.GetDriverByName("GTiff")
-    outraster = driver.Create(outfile,  width, height,1, gdal.GDT_Int16 )
+    outraster = CreateNSIDCGeoTiff(outfile, gdal.GDT_Int16, shape = nsidc.shape)
     if outraster is None: 
         print 'Could not create '
         return
     
-    #set geotransform, values from https://nsidc.org/data/docs/daac/nsidc0051_gsfc_seaice.gd.html
-    geotransform = (-3850000.0, 25000.0 ,0.0 ,5850000.0, 0.0, -25000.0)
-    outraster.SetGeoTransform(geotransform)
     outband = outraster.GetRasterBand(1)
     #Write to file     
     outband.WriteArray(nsidc)
-    
-    spatialRef = osr.SpatialReference()
-    #spatialRef.ImportFromEPSG(3411)  --> this one does for some reason NOT work, but using proj4 does
-    spatialRef.ImportFromProj4('+proj=stere +lat_0=90 +lat_ts=70 +lon_0=-45 +k=1 +x_0=0 +y_0=0 +a=6378273 +b=6356889.449 +units=m +no_defs')
-    outraster.SetProjection(spatialRef.ExportToWkt() )
     outband.FlushCache()
     
     #Clear arrays and close files
@@ -193,108 +332,744 @@ def Bin2GeoTiff(infile,outfilepath ):
     #####
     EPSG3411_2_EPSG3575(outfile)
     
+# Grids of the NSIDC polar stereographic products, from 
+# http://nsidc.org/data/polar_stereo/ps_grids.html
+# Both hemispheres use the Hughes ellipsoid, EPSG:3411 north and EPSG:3412 south
+NSIDCGrids = {
+    'north25': {'shape': (448, 304), 'geotransform': (-3850000.0, 25000.0, 0.0, 5850000.0, 0.0, -25000.0),
+                'proj4': '+proj=stere +lat_0=90 +lat_ts=70 +lon_0=-45 +k=1 +x_0=0 +y_0=0 +a=6378273 +b=6356889.449 +units=m +no_defs',
+                'hemisphere': 'north'},
+    'south25': {'shape': (332, 316), 'geotransform': (-3950000.0, 25000.0, 0.0, 4350000.0, 0.0, -25000.0),
+                'proj4': '+proj=stere +lat_0=-90 +lat_ts=-70 +lon_0=0 +k=1 +x_0=0 +y_0=0 +a=6378273 +b=6356889.449 +units=m +no_defs',
+                'hemisphere': 'south'},
+    'north12': {'shape': (896, 608), 'geotransform': (-3850000.0, 12500.0, 0.0, 5850000.0, 0.0, -12500.0),
+                'proj4': '+proj=stere +lat_0=90 +lat_ts=70 +lon_0=-45 +k=1 +x_0=0 +y_0=0 +a=6378273 +b=6356889.449 +units=m +no_defs',
+                'hemisphere': 'north'},
+    'south12': {'shape': (664, 632), 'geotransform': (-3950000.0, 12500.0, 0.0, 4350000.0, 0.0, -12500.0),
+                'proj4': '+proj=stere +lat_0=-90 +lat_ts=-70 +lon_0=0 +k=1 +x_0=0 +y_0=0 +a=6378273 +b=6356889.449 +units=m +no_defs',
+                'hemisphere': 'south'}
+    }
+
+# Flag codes of the NASA Team products, concentration 0 - 100% is 0 - 250 
+# as expected by ReduceIceStack and the maps
+NSIDCFlags = {251: 'polar hole', 252: 'unused', 253: 'coast', 254: 'land', 255: 'missing'}
+
+# Flag values of a product as {value in the file: code of NSIDCFlags}, the 
+# NASA Team products use the codes themselves
+NASATeamFlags = dict((code, code) for code in NSIDCFlags)
+
+# Flat binary sea ice concentration products. filepattern is the file name 
+# of one year inside the year folder, the date YYYYMMDD is at datecharacters 
+# of the file name. The final files carry their version (_v1.1_), the near 
+# real time files _nrt_ instead, such that both can share a folder.
+# scale is the file value of 100% and flags its flag values, see ReadNSIDCBin.
+# Further products are added with RegisterProduct
+NSIDCProducts = {
+    'nsidc0051_north': {'grid': 'north25', 'header': 300, 'dtype': numpy.uint8, 'scale': 250, 'flags': NASATeamFlags,
+                        'filepattern': 'nt_%Y*_v*_n.bin', 'datecharacters': (3, 11)},
+    'nsidc0051_south': {'grid': 'south25', 'header': 300, 'dtype': numpy.uint8, 'scale': 250, 'flags': NASATeamFlags,
+                        'filepattern': 'nt_%Y*_v*_s.bin', 'datecharacters': (3, 11)},
+    'nsidc0081_north': {'grid': 'north25', 'header': 300, 'dtype': numpy.uint8, 'scale': 250, 'flags': NASATeamFlags,
+                        'filepattern': 'nt_%Y*_nrt_n.bin', 'datecharacters': (3, 11)},
+    'nsidc0081_south': {'grid': 'south25', 'header': 300, 'dtype': numpy.uint8, 'scale': 250, 'flags': NASATeamFlags,
+                        'filepattern': 'nt_%Y*_nrt_s.bin', 'datecharacters': (3, 11)}
+    }
+
+def RegisterProduct(name, grid, header, dtype, filepattern, datecharacters = (3, 11), scale = 250, flags = NASATeamFlags):
+    '''
+    Adds a flat binary product to NSIDCProducts, e.g. a 12.5 km product on
+    the grid north12. scale is the value of 100% concentration in the file
+    (e.g. 1000 for 0.1% steps) and flags maps the flag values of the file to
+    the codes of NSIDCFlags, e.g. {1020: 254} for land. ReadNSIDCBin 
+    converts both to the NASA Team values
+    '''
     
-def CreateSeaIceFrequencyMap(inpath, outfilepath, max_ice, min_ice, landmask_raster):
+    if grid not in NSIDCGrids:
+        raise ValueError('Unknown grid ' + grid + ', known are ' + str(sorted(NSIDCGrids)))
+    if scale <= 0:
+        raise ValueError('Product ' + name + ': scale must be positive')
+    for (value, code) in flags.items():
+        if code not in NSIDCFlags:
+            raise ValueError('Product ' + name + ': flag ' + str(value) + ' maps to ' + str(code) + \
+                             ', not a code of NSIDCFlags ' + str(sorted(NSIDCFlags)))
+        if 0 <= value <= scale:
+            raise ValueError('Product ' + name + ': flag ' + str(value) + ' is a concentration value 0 - ' + str(scale))
+    NSIDCProducts[name] = {'grid': grid, 'header': header, 'dtype': dtype, 'scale': scale, 'flags': flags,
+                           'filepattern': filepattern, 'datecharacters': datecharacters}
+    
+def NSIDCGrid(shape):
     '''
-    Creates map showing percentage ice coverage over a given period
-    This function creates the sea ice frequency charts. 
-    The function loops through each concentration map, if the value is larger
-    than 38 = 15.2%, the value of "100.0 / NumberOfDays" is added --> if there 
-    is ice every single day, that pixel will be "100"
-    Output is available both as EPSG:3411 and EPSG:3575    
+    Returns the grid of NSIDCGrids with the given shape (rows, cols), such
+    that all writers follow the shape of their arrays
     '''
     
-    #register all gdal drivers
-    gdal.AllRegister()
+    for grid in NSIDCGrids.values():
+        if grid['shape'] == tuple(shape):
+            return grid
+    raise ValueError('No NSIDC grid with shape ' + str(shape))
+    
+def ProductGrid(product):
+    '''
+    Returns the grid dictionary of a product of NSIDCProducts
+    '''
     
-    # Iterate through all rasterfiles
-    # filelist is all GeoTIFF files created in outfilepath
-    filelist = glob.glob(outfilepath + 'nt*.tif')
+    if product not in NSIDCProducts:
+        raise ValueError('Unknown product ' + product + ', known are ' + str(sorted(NSIDCProducts)))
+    return NSIDCGrids[NSIDCProducts[product]['grid']]
     
-    #Determine Number of Days from available ice chart files
-    NumberOfDays = len(filelist)
+def ReadNSIDCBin(infile, product = 'nsidc0051_north'):
+    '''
+    Reads one NSIDC chart, being a flat binary string, into a uint8 array
+    of the grid of the product (448 x 304 pixels for NSIDC-0051 north). 
+    The array is decoded directly from the file contents with numpy.frombuffer, 
+    skipping the header (300 byte for NSIDC-0051). Products with another 
+    scale or flag values are converted to those of NASA Team (0 - 250, NSIDCFlags).
+    '''
     
+    #Dimensions from https://nsidc.org/data/docs/daac/nsidc0051_gsfc_seaice.gd.html
+    height, width = ProductGrid(product)['shape']
     
-    firstfilename = filelist[0]
-    #Define file names 
-    (infilepath, infilename) = os.path.split(firstfilename)             #get path and filename seperately
-    (infileshortname, extension) = os.path.splitext(infilename)
-        
-    outfile = inpath + 'icechart_seaicefrequencymap' + os.path.split(filelist[0])[1][3:9] + '_' + os.path.split(filelist[-1])[1][3:9] + '.tif'
+    #for this code on how to read flat binary string, inspiration found at https://stevendkay.wordpress.com/category/python/
+    icefile = open(infile, "rb")
+    contents = icefile.read()
+    icefile.close()
     
-    ########
-    # CREATE OUTPUT FILE AS COPY FROM ONE ICECHART
-    ########
+    #offset and width/height from https://nsidc.org/data/docs/daac/nsidc0051_gsfc_seaice.gd.html
+    nsidc = numpy.frombuffer(contents, dtype = NSIDCProducts[product]['dtype'], count = width*height, \
+                             offset = NSIDCProducts[product]['header'])
+    nsidc = nsidc.reshape((height, width))
+    
+    scale = NSIDCProducts[product]['scale']
+    flags = NSIDCProducts[product]['flags']
+    if (scale == 250) and (flags == NASATeamFlags):
+        return nsidc.astype(numpy.uint8)
+    
+    # other products: concentration scaled to 0 - 250, flags to their codes,
+    # all other values are missing (255)
+    concentration = (nsidc >= 0) & (nsidc <= scale)
+    values = numpy.empty((height, width), numpy.uint8)
+    values.fill(255)
+    values[concentration] = numpy.round(nsidc[concentration] * (250.0 / scale))
+    for (value, code) in flags.items():
+        values[nsidc == value] = code
+    return values
+    
+def CreateNSIDCGeoTiff(outfile, datatype, drivername = "GTiff", shape = (448, 304)):
+    '''
+    Creates an empty GeoTIFF on the NSIDC grid of the given shape, by default
+    the 448 x 304 grid, map projected to EPSG:3411, being the NSIDC-specific 
+    projection. See NSIDCGrids for the other grids.
+    With drivername = "MEM" the raster is created in memory only, outfile
+    is then ignored
+    Returns the opened raster or None if it cannot be created
+    '''
     
-    #open the IceChart
-    icechart = gdal.Open(firstfilename, gdalconst.GA_ReadOnly)
-    if firstfilename is None:
-        print 'Could not open ', firstfilename
-        return
-    #get image size
-    rows = icechart.RasterYSize
-    cols = icechart.RasterXSize    
-    #create output images
-    driver = icechart.GetDriver()
-    outraster = driver.Create(outfile, cols, rows, 1, gdal.GDT_Float64 )
+    grid = NSIDCGrid(shape)
+    height, width = grid['shape']
+    
+    driver = gdal.GetDriverByName(drivername)
+    outraster = driver.Create(outfile,  width, height,1, datatype )
     if outraster is None: 
-        print 'Could not create ', outfile
-        return
+        return None
     
-    # Set Geotransform and projection for outraster
-    outraster.SetGeoTransform(icechart.GetGeoTransform())
-    outraster.SetProjection(icechart.GetProjection())
+    #set geotransform, values from https://nsidc.org/data/docs/daac/nsidc0051_gsfc_seaice.gd.html
+    outraster.SetGeoTransform(grid['geotransform'])
+    
+    spatialRef = osr.SpatialReference()
+    #spatialRef.ImportFromEPSG(3411)  --> this one does for some reason NOT work, but using proj4 does
+    spatialRef.ImportFromProj4(grid['proj4'])
+    outraster.SetProjection(spatialRef.ExportToWkt() )
     
-    rows = outraster.RasterYSize
-    cols = outraster.RasterXSize
-    raster = numpy.zeros((rows, cols), numpy.float) 
-    outraster.GetRasterBand(1).WriteArray( raster )
+    return outraster
     
-    #Create output array and fill with zeros
-    outarray = numpy.zeros((rows, cols), numpy.float)    
+def MonthDates(startyear, stopyear, month):
+    '''
+    Returns a list of all calendar days of the given month for all years 
+    between startyear and stopyear inclusive
+    '''
     
-    #######
-    # CALCULATE SEA ICE FREQUENCY RASTER
-    #######
+    datelist = []
+    for year in range(startyear, (stopyear + 1)):
+        d3 = datetime.date(year, month, 1)
+        while d3.month == month:
+            datelist.append(d3)
+            d3 = d3 + datetime.timedelta(days=1)
+    return datelist
     
-    #Loop through all files to do calculation
-    for infile in filelist:
-        
-        (infilepath, infilename) = os.path.split(infile)
-        print 'Processing ', infilename
+def CubeFilenames(cubefile):
+    '''
+    Returns the names of the date index and the valid day index belonging 
+    to a cube file
+    '''
+    
+    (cubeshortname, extension) = os.path.splitext(cubefile)
+    datesfile = cubeshortname + '_dates.npy'
+    validfile = cubeshortname + '_valid.npy'
+    return datesfile, validfile
+    
+def Bin2Cube(datelist, nsidcpath, cubefile, product = 'nsidc0051_north'):
+    '''
+    Decodes the NSIDC charts of all days in datelist into one memory-mapped 
+    uint8 cube of shape (days, 448, 304), saved as cubefile (.npy). For other
+    products of NSIDCProducts the cube has the shape of their grid
+    
+    Next to the cube a date index (YYYYMMDD for each day in the cube) and 
+    a valid index (True if the chart for this day exists) are stored.
+    Missing days stay empty and are filled in by AddMissingDays.
+    
+    nsidcpath is the folder containing one subfolder per year with the
+    NSIDC nt_YYYYMMDD*.bin files (filepattern of the product)
+    '''
+    
+    datesfile, validfile = CubeFilenames(cubefile)
+    
+    #Find the NSIDC file of each day, one directory listing per year
+    (first, last) = NSIDCProducts[product]['datecharacters']
+    availablefiles = {}
+    for year in sorted(set(date.year for date in datelist)):
+        filepattern = NSIDCProducts[product]['filepattern'].replace('%Y', str(year))
+        for binfile in glob.glob(nsidcpath + str(year) + '//' + filepattern):
+            availablefiles[os.path.split(binfile)[1][first:last]] = binfile
+    
+    cube = numpy.lib.format.open_memmap(cubefile, mode = 'w+', dtype = numpy.uint8, \
+                                        shape = (len(datelist),) + ProductGrid(product)['shape'])
+    valid = numpy.zeros(len(datelist), bool)
+    
+    # position in the cube of each file, the files are read ahead in threads
+    position = {}
+    for i, date in enumerate(datelist):
+        datestring = date.strftime('%Y%m%d')
+        if datestring in availablefiles:
+            position[availablefiles[datestring]] = i
+    filelist = sorted(position, key = position.get)
+    
+    for (binfile, nsidc) in ReadAhead(filelist, lambda binfile: ReadNSIDCBin(binfile, product)):
+        print 'convert ', binfile
+        cube[position[binfile]] = nsidc
+        valid[position[binfile]] = True
+    
+    cube.flush()
+    cube = None
+    
+    numpy.save(datesfile, numpy.array([int(date.strftime('%Y%m%d')) for date in datelist], numpy.int32))
+    numpy.save(validfile, valid)
+    
+    return cubefile
+    
+def OpenCube(cubefile, mode = 'r'):
+    '''
+    Opens a cube created with Bin2Cube as memory-mapped array
+    Returns the cube, the list of dates and the valid index
+    '''
+    
+    datesfile, validfile = CubeFilenames(cubefile)
+    cube = numpy.load(cubefile, mmap_mode = mode)
+    dates = [datetime.date(date // 10000, (date // 100) % 100, date % 100) for date in numpy.load(datesfile)]
+    valid = numpy.load(validfile)
+    return cube, dates, valid
+    
+def ReadRaster(infile):
+    '''
+    Reads the first band of a raster file into an array
+    '''
+    
+    inraster = gdal.Open(infile, gdalconst.GA_ReadOnly)
+    inarray = inraster.ReadAsArray()
+    inraster = None
+    return inarray
+    
+def GeoTiff2Cube(filelist, cubefile):
+    '''
+    Copies the given daily GeoTIFF files (named nt_YYYYMMDD*) into the cube, 
+    replacing the day with the same date. Used for manually interpolated days.
+    '''
+    
+    cube, dates, valid = OpenCube(cubefile, 'r+')
+    dateindex = dict((date.strftime('%Y%m%d'), i) for (i, date) in enumerate(dates))
+    
+    filelist = [infile for infile in filelist if os.path.split(infile)[1][3:11] in dateindex]
+    for (infile, icechart) in ReadAhead(filelist, ReadRaster):
+        print 'insert ', infile
+        datestring = os.path.split(infile)[1][3:11]
+        cube[dateindex[datestring]] = icechart
+        valid[dateindex[datestring]] = True
+    
+    cube.flush()
+    cube = None
+    numpy.save(CubeFilenames(cubefile)[1], valid)
+    
+def OceanPixels(landmask_raster, coastalerrormask_raster = None):
+    '''
+    Returns the flat index vector of the pixels which can have ice: all 
+    pixels not being land (252-255) in the landmask, and if 
+    coastalerrormask_raster is given, not in the never-ice areas (value 3). 
+    
+    The daily reducers take only these pixels of each day, so the work 
+    per day shrinks with the share of land on the grid. Pixels not in the
+    index are 0 in all counts, see ScatterPixels
+    '''
+    
+    landmask = gdal.Open(landmask_raster, gdalconst.GA_ReadOnly)
+    landraster = landmask.ReadAsArray().ravel()
+    landmask = None
+    active = ~((landraster >= 251) & (landraster <= 255))
+    
+    if coastalerrormask_raster is not None:
+        coastalerrormask = gdal.Open(coastalerrormask_raster, gdalconst.GA_ReadOnly)
+        active &= coastalerrormask.ReadAsArray().ravel() != 3
+        coastalerrormask = None
+    
+    return numpy.flatnonzero(active)
+    
+def ScatterPixels(values, oceanpixels, shape, fill = 0):
+    '''
+    Puts the values of the compact pixels oceanpixels (last axis of values)
+    back into full rasters of the given shape, all other pixels are fill
+    '''
+    
+    values = numpy.asarray(values)
+    outarray = numpy.empty(values.shape[:-1] + (shape[0] * shape[1],), values.dtype)
+    outarray.fill(fill)
+    outarray[..., oceanpixels] = values
+    return outarray.reshape(values.shape[:-1] + tuple(shape))
+    
+def ReduceIceStack(cubefile, year = None, oceanpixels = None):
+    '''
+    Streams once through all days in the cube, or only the days of the given
+    year, and counts for each pixel
+    * icedays -- number of days with ice, value larger than 38 = 15.2%
+    * holedays -- number of days the pixel is in the polar hole (value 251)
+    
+    Counting is done with integer accumulators updated in place, so no new 
+    array is created per day. The result is returned as dictionary and used
+    by CreateMaxMinIce and CreateSeaIceFrequencyMap, see IceStackProducts
+    
+    If oceanpixels (see OceanPixels) is given, only these pixels are read 
+    and counted as 1-D arrays, and the counts are scattered back to the 
+    full grid at the end, all other pixels being 0. Raises ValueError if 
+    there is no day with data
+    '''
+    
+    # Iterate through all days in the cube which contain data
+    cube, dates, valid = OpenCube(cubefile)
+    daylist = numpy.flatnonzero(valid)
+    if year is not None:
+        daylist = [day for day in daylist if dates[day].year == year]
+    if len(daylist) == 0:
+        raise ValueError('No days with data' + ('' if year is None else ' in ' + str(year)) + ' in ' + cubefile)
+    
+    rows = cube.shape[1]
+    cols = cube.shape[2]
+    if oceanpixels is None:
+        oceanpixels = numpy.arange(rows * cols)
+    NumberOfPixels = len(oceanpixels)
+    
+    icedays = numpy.zeros(NumberOfPixels, numpy.int32)
+    holedays = numpy.zeros(NumberOfPixels, numpy.int32)
+    
+    # Work arrays reused for every day
+    iceraster = numpy.empty(NumberOfPixels, numpy.uint8)
+    icebuffer = numpy.empty(NumberOfPixels, bool)
+    flagbuffer = numpy.empty(NumberOfPixels, bool)
+    
+    for day in daylist:
         
-        #open the IceChart
-        icechart = gdal.Open(infile, gdalconst.GA_ReadOnly)
-        if infile is None:
-            print 'Could not open ', infilename
-            return
+        print 'Processing ', dates[day]
         
-        #get image size
-        rows = icechart.RasterYSize
-        cols = icechart.RasterXSize
-                
-        #get the bands 
-        outband = outraster.GetRasterBand(1)
-                
-        #Read input raster into array
-        iceraster = icechart.ReadAsArray()
+        #Read ocean pixels of the day from cube into array
+        numpy.take(cube[day].ravel(), oceanpixels, out = iceraster)
         
-        #Array calculation and burn in land values on top
-        outarray = numpy.where( (iceraster >=  38), (outarray + ( 100.0 / NumberOfDays ) ) , outarray)
-        outarray = numpy.where( (iceraster ==   251), 251 , outarray)
-        outarray = numpy.where( (iceraster ==   252), 252 , outarray)
-        outarray = numpy.where( (iceraster ==   253), 253 , outarray)
-        outarray = numpy.where( (iceraster ==   254), 254 , outarray)
-        outarray = numpy.where( (iceraster ==   255), 255 , outarray)
-               
-        #Clear iceraster for next loop -- just in case
-        iceraster = None
+        # ice is 38 to 250, the values 251-255 are polar hole and land
+        numpy.greater_equal(iceraster, 38, out = icebuffer)
+        numpy.less_equal(iceraster, 250, out = flagbuffer)
+        icebuffer &= flagbuffer
+        icedays += icebuffer
         
+        numpy.equal(iceraster, 251, out = flagbuffer)
+        holedays += flagbuffer
+    
+    accumulator = {}
+    accumulator['icedays'] = ScatterPixels(icedays, oceanpixels, (rows, cols))
+    accumulator['holedays'] = ScatterPixels(holedays, oceanpixels, (rows, cols))
+    accumulator['NumberOfDays'] = len(daylist)
+    # months (as YYYYMM) contained in the counts
+    accumulator['months'] = numpy.array(sorted(set(int(dates[day].strftime('%Y%m')) for day in daylist)), numpy.int32)
+    accumulator['period'] = AccumulatorPeriod(accumulator['months'])
+    
+    cube = None
+    return accumulator
+    
+def AccumulatorPeriod(months):
+    '''
+    Returns the period YYYYMM_YYYYMM covered by the months of an accumulator
+    '''
+    
+    return str(min(months)) + '_' + str(max(months))
+    
+def SaveAccumulator(accumulator, accumulatorfile):
+    '''
+    Saves the counts of ReduceIceStack to accumulatorfile (.npz)
+    '''
+    
+    numpy.savez(accumulatorfile, icedays = accumulator['icedays'], holedays = accumulator['holedays'], \
+                NumberOfDays = accumulator['NumberOfDays'], months = accumulator['months'])
+    
+def LoadAccumulator(accumulatorfile):
+    '''
+    Loads counts saved with SaveAccumulator
+    '''
+    
+    accumulatorarchive = numpy.load(accumulatorfile)
+    accumulator = {}
+    accumulator['icedays'] = accumulatorarchive['icedays']
+    accumulator['holedays'] = accumulatorarchive['holedays']
+    accumulator['NumberOfDays'] = int(accumulatorarchive['NumberOfDays'])
+    accumulator['months'] = accumulatorarchive['months']
+    accumulator['period'] = AccumulatorPeriod(accumulator['months'])
+    accumulatorarchive.close()
+    return accumulator
+    
+def AddAccumulator(accumulator, other, sign = 1):
+    '''
+    Folds the counts of other into accumulator (sign = 1) or removes them 
+    from accumulator (sign = -1), e.g. to add a new year to a climatology 
+    or drop the oldest one. Returns the new accumulator.
+    
+    Maximum and minimum follow directly from the summed counts (at least one
+    / every day ice), so no map has to be recalculated from daily data
+    '''
+    
+    months = set(accumulator['months'])
+    othermonths = set(other['months'])
+    if (sign > 0) and (months & othermonths):
+        raise ValueError('Months ' + str(sorted(months & othermonths)) + ' are already contained')
+    if (sign < 0) and not (othermonths <= months):
+        raise ValueError('Months ' + str(sorted(othermonths - months)) + ' are not contained')
+    
+    if sign > 0:
+        months = months | othermonths
+    else:
+        months = months - othermonths
+    
+    result = {}
+    result['icedays'] = accumulator['icedays'] + sign * other['icedays']
+    result['holedays'] = accumulator['holedays'] + sign * other['holedays']
+    result['NumberOfDays'] = accumulator['NumberOfDays'] + sign * other['NumberOfDays']
+    result['months'] = numpy.array(sorted(months), numpy.int32)
+    result['period'] = AccumulatorPeriod(result['months'])
+    return result
+    
+def CreateYearAccumulators(cubefile, accumulatorpath, oceanpixels = None):
+    '''
+    Counts ice days separately for each year in the cube and saves them as
+    accumulator_YYYYMM.npz in accumulatorpath, only oceanpixels if given.
+    Returns the combined accumulator of all years, None if the cube has no 
+    day with data
+    '''
+    
+    cube, dates, valid = OpenCube(cubefile)
+    years = sorted(set(dates[day].year for day in numpy.flatnonzero(valid)))
+    cube = None
+    
+    combined = None
+    for year in years:
+        accumulator = ReduceIceStack(cubefile, year, oceanpixels)
+        SaveAccumulator(accumulator, accumulatorpath + 'accumulator_' + str(accumulator['months'][0]) + '.npz')
+        if combined is None:
+            combined = accumulator
+        else:
+            combined = AddAccumulator(combined, accumulator)
+    
+    return combined
+
+def CreatePrefixSums(accumulatorpath, month, startyear, stopyear):
+    '''
+    Stacks the per year accumulators accumulator_YYYYMM.npz of
+    CreateYearAccumulators for startyear - stopyear and stores cumulative
+    sums along the year axis, entry i holding the sum of all years before
+    startyear + i. The counts of any contiguous window of years are then one
+    subtraction, see WindowAccumulator. Years without accumulator file (no
+    data) count zero days.
+    Saved as accumulator_prefixsums.npz in accumulatorpath and returned as 
+    dictionary. A stored file of the same month and years is loaded instead
+    if it is newer than all per year accumulators
+    '''
+
+    years = range(startyear, stopyear + 1)
+    yearfiles = [accumulatorpath + 'accumulator_' + str(year * 100 + month) + '.npz' for year in years]
+    prefixsumsfile = accumulatorpath + 'accumulator_prefixsums.npz'
+    
+    if os.path.exists(prefixsumsfile):
+        prefixsums = LoadPrefixSums(prefixsumsfile)
+        if (prefixsums['month'] == month) and (prefixsums['startyear'] == startyear) and \
+           (len(prefixsums['present']) == len(years)) and \
+           (list(prefixsums['present']) == [os.path.exists(yearfile) for yearfile in yearfiles]) and \
+           all(os.path.getmtime(yearfile) <= os.path.getmtime(prefixsumsfile) \
+               for yearfile in yearfiles if os.path.exists(yearfile)):
+            print 'Prefix sums up to date, ', prefixsumsfile
+            return prefixsums
+
+    prefixsums = None
+    for i, year in enumerate(years):
+        yearfile = yearfiles[i]
+        if not os.path.exists(yearfile):
+            print 'No counts for ', year, ', ', yearfile, ' missing'
+            continue
+        accumulator = LoadAccumulator(yearfile)
+        if prefixsums is None:
+            rows, cols = accumulator['icedays'].shape
+            prefixsums = {}
+            prefixsums['icedays'] = numpy.zeros((len(years) + 1, rows, cols), numpy.int32)
+            prefixsums['holedays'] = numpy.zeros((len(years) + 1, rows, cols), numpy.int32)
+            prefixsums['NumberOfDays'] = numpy.zeros(len(years) + 1, numpy.int32)
+            prefixsums['present'] = numpy.zeros(len(years), bool)
+        prefixsums['icedays'][i + 1] = accumulator['icedays']
+        prefixsums['holedays'][i + 1] = accumulator['holedays']
+        prefixsums['NumberOfDays'][i + 1] = accumulator['NumberOfDays']
+        prefixsums['present'][i] = True
+
+    if prefixsums is None:
+        raise ValueError('No accumulator files for ' + str(startyear) + ' - ' + str(stopyear) + ' in ' + accumulatorpath)
+
+    # cumulative sums in place, year by year
+    for key in ['icedays', 'holedays', 'NumberOfDays']:
+        numpy.cumsum(prefixsums[key], axis = 0, out = prefixsums[key])
+    prefixsums['month'] = month
+    prefixsums['startyear'] = startyear
+
+    numpy.savez(prefixsumsfile, **prefixsums)
+    return prefixsums
+
+def LoadPrefixSums(prefixsumsfile):
+    '''
+    Loads prefix sums saved by CreatePrefixSums
+    '''
+    
+    prefixsumsarchive = numpy.load(prefixsumsfile)
+    prefixsums = {}
+    for key in ['icedays', 'holedays', 'NumberOfDays', 'present']:
+        prefixsums[key] = prefixsumsarchive[key]
+    prefixsums['month'] = int(prefixsumsarchive['month'])
+    prefixsums['startyear'] = int(prefixsumsarchive['startyear'])
+    prefixsumsarchive.close()
+    return prefixsums
+
+def WindowAccumulator(prefixsums, startyear, stopyear):
+    '''
+    Returns the accumulator for the years startyear - stopyear inclusive from
+    the prefix sums of CreatePrefixSums, to be used as the one of ReduceIceStack
+    '''
+
+    first = startyear - prefixsums['startyear']
+    last = stopyear - prefixsums['startyear'] + 1
+    if (first < 0) or (last > len(prefixsums['present'])) or (first >= last):
+        raise ValueError('Window ' + str(startyear) + ' - ' + str(stopyear) + ' not covered by the prefix sums')
+
+    years = numpy.flatnonzero(prefixsums['present'][first:last]) + startyear
+    if len(years) == 0:
+        raise ValueError('No data in ' + str(startyear) + ' - ' + str(stopyear))
+
+    accumulator = {}
+    accumulator['icedays'] = prefixsums['icedays'][last] - prefixsums['icedays'][first]
+    accumulator['holedays'] = prefixsums['holedays'][last] - prefixsums['holedays'][first]
+    accumulator['NumberOfDays'] = int(prefixsums['NumberOfDays'][last] - prefixsums['NumberOfDays'][first])
+    accumulator['months'] = (years * 100 + prefixsums['month']).astype(numpy.int32)
+    accumulator['period'] = AccumulatorPeriod(accumulator['months'])
+    return accumulator
+
+# Class edges of the concentration histogram in NSIDC units (250 = 100%),
+# about 10% classes with the 15% ice limit 38 as additional edge
+HistogramEdges = [0, 25, 38, 50, 75, 100, 125, 150, 175, 200, 225, 251]
+
+def ConcentrationHistogram(cubefile, year = None, edges = HistogramEdges, oceanpixels = None):
+    '''
+    Streams once through all days in the cube, or only the days of the given
+    year, and counts for each pixel the number of days in each concentration
+    class edges[i] <= value < edges[i+1], followed by one class for the polar
+    hole (251) and one for land / missing (252-255).
+
+    A lookup table maps each value to its class, each pixel falls into one 
+    class per day, so one fancy index increment per day adds the classes of
+    all pixels. Counts are int32 as the accumulators, shape (classes, rows, cols).
+    Frequency, max and min for any threshold being one of edges follow from
+    HistogramAccumulator without reading the daily data again
+    
+    If oceanpixels (see OceanPixels) is given, only these pixels are counted,
+    all classes of the other pixels are 0. Raises ValueError if there is no
+    day with data
+    '''
 
+    if (edges[0] != 0) or (edges[-1] != 251) or (list(edges) != sorted(set(edges))):
+        raise ValueError('edges must be increasing from 0 to 251')
+
+    # value 0-255 to class
+    NumberOfClasses = len(edges) + 1
+    lookup = numpy.zeros(256, numpy.intp)
+    lookup[:251] = numpy.searchsorted(edges, numpy.arange(251), 'right') - 1
+    lookup[251] = NumberOfClasses - 2
+    lookup[252:] = NumberOfClasses - 1
+
+    cube, dates, valid = OpenCube(cubefile)
+    daylist = numpy.flatnonzero(valid)
+    if year is not None:
+        daylist = [day for day in daylist if dates[day].year == year]
+    if len(daylist) == 0:
+        raise ValueError('No days with data' + ('' if year is None else ' in ' + str(year)) + ' in ' + cubefile)
+
+    rows = cube.shape[1]
+    cols = cube.shape[2]
+    if oceanpixels is None:
+        oceanpixels = numpy.arange(rows * cols)
+    NumberOfPixels = len(oceanpixels)
+
+    # pixel i class c is counted at i * NumberOfClasses + c
+    counts = numpy.zeros(NumberOfPixels * NumberOfClasses, numpy.int32)
+    offset = numpy.arange(NumberOfPixels, dtype = numpy.intp) * NumberOfClasses
+    iceraster = numpy.empty(NumberOfPixels, numpy.uint8)
+    index = numpy.empty(NumberOfPixels, numpy.intp)
+
+    for day in daylist:
+
+        print 'Processing ', dates[day]
+
+        numpy.take(cube[day].ravel(), oceanpixels, out = iceraster)
+        numpy.take(lookup, iceraster, out = index)
+        # the indices of one day are unique, one per pixel
+        index += offset
+        counts[index] += 1
+
+    histogram = {}
+    histogram['counts'] = ScatterPixels(counts.reshape((NumberOfPixels, NumberOfClasses)).T, oceanpixels, (rows, cols))
+    histogram['edges'] = numpy.array(edges, numpy.int32)
+    histogram['NumberOfDays'] = len(daylist)
+    histogram['months'] = numpy.array(sorted(set(int(dates[day].strftime('%Y%m')) for day in daylist)), numpy.int32)
+    histogram['period'] = AccumulatorPeriod(histogram['months'])
+
+    cube = None
+    return histogram
+
+def SaveHistogram(histogram, histogramfile):
+    '''
+    Saves the counts of ConcentrationHistogram to histogramfile (.npz)
+    '''
+
+    numpy.savez(histogramfile, counts = histogram['counts'], edges = histogram['edges'], \
+                NumberOfDays = histogram['NumberOfDays'], months = histogram['months'])
+
+def LoadHistogram(histogramfile):
+    '''
+    Loads counts saved with SaveHistogram
+    '''
+
+    histogramarchive = numpy.load(histogramfile)
+    histogram = {}
+    histogram['counts'] = histogramarchive['counts']
+    histogram['edges'] = histogramarchive['edges']
+    histogram['NumberOfDays'] = int(histogramarchive['NumberOfDays'])
+    histogram['months'] = histogramarchive['months']
+    histogram['period'] = AccumulatorPeriod(histogram['months'])
+    histogramarchive.close()
+    return histogram
+
+def HistogramAccumulator(histogram, threshold = 38):
+    '''
+    Returns the accumulator of ReduceIceStack for ice defined as concentration
+    >= threshold (NSIDC units, 38 = 15.2%, 75 = 30%, 125 = 50%), summed from
+    the classes of ConcentrationHistogram. threshold has to be one of the
+    class edges
+    '''
+
+    edges = list(histogram['edges'])
+    if (threshold not in edges) or (threshold == edges[-1]):
+        raise ValueError('Threshold ' + str(threshold) + ' is not a class edge of ' + str(edges))
+
+    # concentration classes from threshold to 250, then polar hole
+    first = edges.index(threshold)
+    NumberOfClasses = histogram['counts'].shape[0]
+
+    accumulator = {}
+    accumulator['icedays'] = histogram['counts'][first:NumberOfClasses - 2].sum(axis = 0, dtype = numpy.int32)
+    accumulator['holedays'] = histogram['counts'][NumberOfClasses - 2].astype(numpy.int32)
+    accumulator['NumberOfDays'] = histogram['NumberOfDays']
+    accumulator['months'] = histogram['months']
+    accumulator['period'] = histogram['period']
+    return accumulator
+
+def CreateThresholdMaps(inpath, histogram, thresholds, landmask_raster, coastalerrormask_raster, \
+                        oceanmask_buffer5, NSIDC_balticmask):
+    '''
+    Creates max/min and sea ice frequency maps for each threshold (NSIDC
+    units) from the histogram, stored in inpath//thresholdXX// with XX the
+    threshold in percent. Returns the list of folders
+    '''
+
+    outpaths = []
+    for threshold in thresholds:
+        accumulator = HistogramAccumulator(histogram, threshold)
+        outpath = inpath + 'threshold' + str(int(round(threshold / 2.5))) + '//'
+        if not os.path.exists(outpath):
+            os.makedirs(outpath)
+        max_ice, min_ice = CreateMaxMinIce(outpath, accumulator, landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask )
+        CreateSeaIceFrequencyMap(outpath, accumulator, max_ice, min_ice, landmask_raster)
+        outpaths.append(outpath)
+    return outpaths
+
+def IceStackProducts(accumulator):
+    '''
+    Derives from the counts of ReduceIceStack
+    * numberofdays -- number of days with ice 
+    * maximum -- 1 where at least one day ice, otherwise 0
+    * minimum -- 1 where every day ice, otherwise 0
+    * frequency -- percentage of days with ice, 251 for the polar hole
+    
+    Days in the polar hole are counted as ice days for number of days, maximum
+    and minimum. Land values are not burnt in, this is done by the calling function
+    '''
+    
+    icedays = accumulator['icedays']
+    holedays = accumulator['holedays']
+    NumberOfDays = accumulator['NumberOfDays']
+    
+    numberofdays = icedays + holedays
+    maximum = (numberofdays > 0).astype(numpy.uint8)
+    minimum = (numberofdays == NumberOfDays).astype(numpy.uint8)
+    
     # The polar hole has different sizes in the earlier years
-    # This results in the line above in %-values larger than 100
-    # so setting these to 251 gives again the maximum polar hole
-    outarray = numpy.where( (outarray >   255), 251 , outarray)
+    # so every pixel being polar hole at least one day is set to 251
+    frequency = icedays * (100.0 / NumberOfDays)
+    frequency[holedays > 0] = 251
+    
+    return numberofdays, maximum, minimum, frequency
+    
+def CreateSeaIceFrequencyMap(inpath, accumulator, max_ice, min_ice, landmask_raster):
+    '''
+    Creates map showing percentage ice coverage over a given period
+    This function creates the sea ice frequency charts. 
+    For each pixel the number of days with a value larger than 38 = 15.2% 
+    is taken from the accumulator of ReduceIceStack, giving the percentage 
+    "100.0 * icedays / NumberOfDays" --> if there is ice every single day, 
+    that pixel will be "100"
+    Output is available both as EPSG:3411 and EPSG:3575    
+    '''
+    
+    #register all gdal drivers
+    gdal.AllRegister()
+    
+    outfile = inpath + 'icechart_seaicefrequencymap' + accumulator['period'] + '.tif'
+    
+    ########
+    # CREATE OUTPUT FILE ON THE NSIDC GRID
+    ########
+    
+    outraster = CreateNSIDCGeoTiff(outfile, gdal.GDT_Float64, shape = accumulator['icedays'].shape)
+    if outraster is None: 
+        print 'Could not create ', outfile
+        return
+    
+    #######
+    # CALCULATE SEA ICE FREQUENCY RASTER
+    #######
+    numberofdays, maximum, minimum, outarray = IceStackProducts(accumulator)
     
     ######
     # Filter noise areas
@@ -321,7 +1096,6 @@ def CreateSeaIceFrequencyMap(inpath, outfilepath, max_ice, min_ice, landmask_ras
        
     #Clear arrays and close files
     outband = None
-    iceraster = None
     outraster = None
     outarray = None
     
@@ -333,303 +1107,91 @@ def CreateSeaIceFrequencyMap(inpath, outfilepath, max_ice, min_ice, landmask_ras
     return outfile
     print 'Done Creating Sea Ice Frequency Map'
     
-def CreateMaxMinIce(inpath, outfilepath, landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask ):   
+def CreateMaxMinIce(inpath, accumulator, landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask, \
+                    writeshapefiles = True):   
     ''' 
          Creates maximum and minimum ice map, GeoTIFF and shapefile
          maximum = at least one day ice at this pixel
          minimum = every day ice at this pixel
          In addition a file simply giving the number of days with ice
+         All three are derived from the accumulator of ReduceIceStack
          
          The poly shapefile has all features as polygon, the line shapefile
          only the max or min ice edge
+         
+         All intermediate rasters and polygons are kept in memory (MEM driver 
+         and OGR Memory datasources), only the final products are written
+         
+         If writeshapefiles is False only the GeoTIFFs are written, the
+         shapefiles are then created from these by CreateMaxMinShapefiles
     
     '''
     
     #register all gdal drivers
     gdal.AllRegister()
     
-    # Iterate through all rasterfiles
-    # filelist is all GeoTIFF files created in outfilepath
-    filelist = glob.glob(outfilepath + 'nt*.tif')
+    #Period covered, used in all file names
+    period = accumulator['period']
     
-    #Determine Number of Days from available ice chart files
-    NumberOfDays = len(filelist)
+    outfile =  inpath + 'icechart_NumberOfDays' + period + '.tif'
+    outfilemax = inpath + 'icechart_maximum' + period + '.tif'
+    outfilemin = inpath + 'icechart_minimum' + period + '.tif'
     
-    #Files are all the same properties, so take first one to get info
-    firstfilename = filelist[0]
-    
-    #Define file names 
-    (infilepath, infilename) = os.path.split(firstfilename)             #get path and filename seperately
-    (infileshortname, extension) = os.path.splitext(infilename)
-    
-    outfile =  inpath + 'icechart_NumberOfDays' + os.path.split(filelist[0])[1][3:9] + '_' + os.path.split(filelist[-1])[1][3:9] + '.tif'
-    outfilemax = inpath + 'icechart_maximum' + os.path.split(filelist[0])[1][3:9] + '_' + os.path.split(filelist[-1])[1][3:9] + '.tif'
-    outfilemin = inpath + 'icechart_minimum' + os.path.split(filelist[0])[1][3:9] + '_' + os.path.split(filelist[-1])[1][3:9] + '.tif'
-    
-    outshape_polymax = inpath + 'icechart_poly_maximum' + os.path.split(filelist[0])[1][3:9]+ '_' + os.path.split(filelist[-1])[1][3:9] + '.shp'
-    outshape_polymin = inpath + 'icechart_poly_minimum' + os.path.split(filelist[0])[1][3:9] + '_' + os.path.split(filelist[-1])[1][3:9] + '.shp'
-    outshape_linemax = inpath + 'icechart_line_maximum' + os.path.split(filelist[0])[1][3:9] + '_' + os.path.split(filelist[-1])[1][3:9] + '.shp'
-    outshape_linemin = inpath + 'icechart_line_minimum' + os.path.split(filelist[0])[1][3:9] + '_' + os.path.split(filelist[-1])[1][3:9] + '.shp'
-    
-    #Temporary shapefile, all subfiles specified so that they can be removed later
-    #Many because gdal commands expect existing files
-    outshape_tempmax = inpath + 'icechart_tempmax.shp'
-    outshape_tempmax2 = inpath + 'icechart_tempmax.dbf'
-    outshape_tempmax3 = inpath + 'icechart_tempmax.prj'
-    outshape_tempmax4 = inpath + 'icechart_tempmax.shx'
-    outshape_tempmin = inpath + 'icechart_tempmin.shp'
-    outshape_tempmin2 = inpath + 'icechart_tempmin.dbf'
-    outshape_tempmin3 = inpath + 'icechart_tempmin.prj'
-    outshape_tempmin4 = inpath + 'icechart_tempmin.shx'
-    
-    outshape_temp2max = inpath + 'icechart_temp2max.shp'
-    outshape_temp2max2 = inpath + 'icechart_temp2max.dbf'
-    outshape_temp2max3 = inpath + 'icechart_temp2max.prj'
-    outshape_temp2max4 = inpath + 'icechart_temp2max.shx'
-    outshape_temp2min = inpath + 'icechart_temp2min.shp'
-    outshape_temp2min2 = inpath + 'icechart_temp2min.dbf'
-    outshape_temp2min3 = inpath + 'icechart_temp2min.prj'
-    outshape_temp2min4 = inpath + 'icechart_temp2min.shx'
-    
-    outshape_temp3max = inpath + 'icechart_temp3max.shp'
-    outshape_temp3max2 = inpath + 'icechart_temp3max.dbf'
-    outshape_temp3max3 = inpath + 'icechart_temp3max.prj'
-    outshape_temp3max4 = inpath + 'icechart_temp3max.shx'
-    outshape_temp3min = inpath + 'icechart_temp3min.shp'
-    outshape_temp3min2 = inpath + 'icechart_temp3min.dbf'
-    outshape_temp3min3 = inpath + 'icechart_temp3min.prj'
-    outshape_temp3min4 = inpath + 'icechart_temp3min.shx'
-   
-    ########
-    # CREATE NUMBER OF DAYS RASTER FILE AS COPY FROM ICE FILE
-    ########    
-    #open the IceChart
-    icechart = gdal.Open(firstfilename, gdalconst.GA_ReadOnly)
-    if firstfilename is None:
-        print 'Could not open ', firstfilename
-        return
-    #get image size
-    rows = icechart.RasterYSize
-    cols = icechart.RasterXSize    
-    #create output images
-    driver = icechart.GetDriver()
-    outraster = driver.Create(outfile, cols, rows, 1, gdal.GDT_Float64 )
-    if outraster is None: 
-        print 'Could not create ', outfile
-        return    
-    
-    outrastermax = driver.Create(outfilemax, cols, rows, 1, gdal.GDT_Float64 )
-    if outrastermax is None: 
-        print 'Could not create ', outfilemax
-        return
-    
-    outrastermin = driver.Create(outfilemin, cols, rows, 1, gdal.GDT_Float64 )
-    if outrastermin is None: 
-        print 'Could not create ', outfilemin
-        return
-   
-    # Set Geotransform and projection for outraster
-    outraster.SetGeoTransform(icechart.GetGeoTransform())
-    outraster.SetProjection(icechart.GetProjection())
-    outrastermax.SetGeoTransform(icechart.GetGeoTransform())
-    outrastermax.SetProjection(icechart.GetProjection())
-    
-    outrastermin.SetGeoTransform(icechart.GetGeoTransform())
-    outrastermin.SetProjection(icechart.GetProjection())
-    
-    rows = outrastermax.RasterYSize
-    cols = outrastermax.RasterXSize
-    raster = numpy.zeros((rows, cols), numpy.float) 
-    
-    outraster.GetRasterBand(1).WriteArray( raster )    
-    outrastermax.GetRasterBand(1).WriteArray( raster )
-    outrastermin.GetRasterBand(1).WriteArray( raster )
-    
-    #Create output array and fill with zeros
-    outarray = numpy.zeros((rows, cols), numpy.float)    
-    outarraymax = numpy.zeros((rows, cols), numpy.float)
-    outarraymin = numpy.zeros((rows, cols), numpy.float)
-    
-    #######
-    # CALCULATE NUMBER OF DAYS RASTER = NUMBER SAYS HOW MANY DAYS ICE IN PIXEL
-    #######
-    #Loop through all files to do calculation
-    for infile in filelist:
-        
-        (infilepath, infilename) = os.path.split(infile)
-        print 'Processing ', infilename
-        
-        #open the IceChart
-        icechart = gdal.Open(infile, gdalconst.GA_ReadOnly)
-        if infile is None:
-            print 'Could not open ', infilename
-            return
-        
-        #Read input raster into array
-        iceraster = icechart.ReadAsArray()
-        
-        #Array calculation -- if ice > 15% count additional day, otherwise keep value
-        outarray = numpy.where( (iceraster >=  38), outarray + 1 , outarray)
-                       
-        #Clear iceraster for next loop -- just in case
-        iceraster = None
+    #######
+    # NUMBER OF DAYS, MAXIMUM AND MINIMUM FROM THE ICE DAY COUNTS
+    #######
+    numberofdays, maximum, minimum, frequency = IceStackProducts(accumulator)
     
+    # Land values 251-255 are burnt into all maps
+    landmask = gdal.Open(landmask_raster , gdalconst.GA_ReadOnly)
+    landraster = landmask.ReadAsArray()
+    landmask = None
+    landpixels = (landraster >= 251) & (landraster <= 255)
     
+    #outarray contains NumberOfDay with ice -- burn in landmask
+    outarray = numberofdays.astype(numpy.float)
+    outarray[landpixels] = landraster[landpixels]
     
-    
-    #outarray contains now NumberOfDay with ice -- burn in landmask
-    landmask = gdal.Open(landmask_raster , gdalconst.GA_ReadOnly)
-    landraster = landmask.ReadAsArray()
-    outarray = numpy.where( (landraster == 251), 251, outarray)
-    outarray = numpy.where( (landraster == 252), 252, outarray)
-    outarray = numpy.where( (landraster == 253), 253, outarray)
-    outarray = numpy.where( (landraster == 254), 254, outarray)
-    outarray = numpy.where( (landraster == 255), 255, outarray)
-    
-    #######
-    # CALCULATE MAXIMUM RASTER
-    #######
     # Where never was ice, set map to 0, elsewhere to 1, i.e. at least one day ice
     # Using landraster again -- otherwise if NumberOfDay mask by chance 252, it is masked out
-    outarraymax = numpy.where( (outarray == 0), 0, 1 )
-    outarraymax = numpy.where( (landraster ==   251), 251 , outarraymax)
-    outarraymax = numpy.where( (landraster ==   252), 252 , outarraymax)
-    outarraymax = numpy.where( (landraster ==   253), 253 , outarraymax)
-    outarraymax = numpy.where( (landraster ==   254), 254 , outarraymax)
-    outarraymax = numpy.where( (landraster ==   255), 255 , outarraymax)
+    outarraymax = maximum.astype(numpy.float)
+    outarraymax[landpixels] = landraster[landpixels]
     
-    #######
-    # CALCULATE MINIMUM RASTER
-    #######
     # Where every day was ice, set to 1, otherwise to 0
     # Keep in mind: Problems may arise when one value is missing (bad file)
     # such that value is just one or two less than NumberofDays
-    outarraymin = numpy.where( (outarray == NumberOfDays), 1, 0 )
-    outarraymin = numpy.where( (landraster ==   251), 251 , outarraymin)
-    outarraymin = numpy.where( (landraster ==   252), 252 , outarraymin)
-    outarraymin = numpy.where( (landraster ==   253), 253 , outarraymin)
-    outarraymin = numpy.where( (landraster ==   254), 254 , outarraymin)
-    outarraymin = numpy.where( (landraster ==   255), 255 , outarraymin)
-    
-        
-    #get the bands 
-    outband = outraster.GetRasterBand(1)    
-    outbandmax = outrastermax.GetRasterBand(1)
-    outbandmin = outrastermin.GetRasterBand(1)
-    
+    outarraymin = minimum.astype(numpy.float)
+    outarraymin[landpixels] = landraster[landpixels]
     
-    #Write all arrays to file
-    
-    outband.WriteArray(outarray)
-    outband.FlushCache()    
-    
-    outbandmax.WriteArray(outarraymax)
-    outbandmax.FlushCache()
-    
-    outbandmin.WriteArray(outarraymin)
-    outbandmin.FlushCache()
+    # Number of days is final and written directly
+    WriteNSIDCArray(outarray, outfile)
     
     ##########
-    # FILTER NOISE IN MINIMUM ARRAY / RASTER
+    # FILTER NOISE IN MAXIMUM AND MINIMUM RASTER
     #########
-    # the sieve filter takes out singular "islands" of pixels
-    srcband = outbandmin
-    dstband = outbandmin    
-    maskband = None
-    print "Apply SieveFilter on ", outfilemin
-    gdal.SieveFilter( srcband, maskband, dstband,threshold = 3, connectedness = 4  )
-    #load outbandmin once more and burn landmask again since sieve influences coastline
-    outarraymin = outrastermin.ReadAsArray()
-    outarraymin = numpy.where( (landraster ==   251), 251 , outarraymin)
-    outarraymin = numpy.where( (landraster ==   252), 252 , outarraymin)
-    outarraymin = numpy.where( (landraster ==   253), 253 , outarraymin)
-    outarraymin = numpy.where( (landraster ==   254), 254 , outarraymin)
-    outarraymin = numpy.where( (landraster ==   255), 255 , outarraymin)
-    outbandmin = outrastermin.GetRasterBand(1)    
-    outbandmin.WriteArray(outarraymin)
-    outbandmin.FlushCache()
-    
-    ##########
-    # FILTER NOISE IN MINIMUM ARRAY / RASTER
-    #########    
-    # the sieve filter takes out singular "islands" of pixels
-    srcband = outbandmax
-    dstband = outbandmax    
-    maskband = None
-    print "Apply SieveFilter one ", outrastermax
-    gdal.SieveFilter( srcband, maskband, dstband,threshold = 3, connectedness = 4  )
-    #load outbandmin once more and burn landmask again since sieve influences coastline
-    outarraymax = outrastermax.ReadAsArray()
-    outarraymax = numpy.where( (landraster ==   251), 251 , outarraymax)
-    outarraymax = numpy.where( (landraster ==   252), 252 , outarraymax)
-    outarraymax = numpy.where( (landraster ==   253), 253 , outarraymax)
-    outarraymax = numpy.where( (landraster ==   254), 254 , outarraymax)
-    outarraymin = numpy.where( (landraster ==   255), 255 , outarraymin)
-    outbandmax = outrastermax.GetRasterBand(1)    
-    outbandmax.WriteArray(outarraymax)
-    outbandmax.FlushCache()
-    
-    #Clear arrays and close files
-    outband = None
-    outbandmax = None
-    outbandmin = None
-    iceraster = None
-    outraster = None    
-    outrastermax = None
-    outrastermin = None
-    outarray = None
-    outarraymax = None
-    outarraymin = None   
-    landraster = None   
-    landmask = None     
+    # the sieve filter takes out singular "islands" of pixels, done on
+    # rasters in memory. Burn landmask again since sieve influences coastline
+    memrastermax = CreateNSIDCGeoTiff('', gdal.GDT_Float64, "MEM", landraster.shape)
+    memrastermin = CreateNSIDCGeoTiff('', gdal.GDT_Float64, "MEM", landraster.shape)
+    for (memraster, memarray) in ((memrastermax, outarraymax), (memrastermin, outarraymin)):
+        memband = memraster.GetRasterBand(1)
+        memband.WriteArray(memarray)
+        print "Apply SieveFilter"
+        gdal.SieveFilter( memband, None, memband, threshold = 3, connectedness = 4  )
+        memarray[:] = memband.ReadAsArray()
+        memarray[landpixels] = landraster[landpixels]
+        memband.WriteArray(memarray)
     
     ###################
-    # CONVERT THE RASTERS CREATED ABOVE TO SHAPEFILES
+    # CONVERT THE RASTERS CREATED ABOVE TO POLYGONS
     ###################
-
-    # conversion to shape    
-    print '\n Convert ', outfilemax, ' to shapefile.'
-    os.system('gdal_polygonize.py ' + outfilemax + ' -f "ESRI Shapefile" ' + outshape_tempmax )
-    print '\n Convert ', outfilemin, ' to shapefile.'
-    os.system('gdal_polygonize.py ' + outfilemin + ' -f "ESRI Shapefile" ' + outshape_tempmin ) 
     
     # FILTERING MAX / MIN    
     # Get the large polygon only, this removes mistaken areas at coast and noise. KEEP IN MIND: CHECK VALUE IF TOO BIG SUCH THAT REAL AREAS ARE REMOVED
     # Do this only for polymax -- the minimum would remove real areas, patches like East of Svalbard. Polymin selects here all polygons basically
     print "Select large polygon, ignoring the small ones"
-    os.system('ogr2ogr -progress '+ outshape_polymax + ' ' + outshape_tempmax + ' -sql "SELECT *, OGR_GEOM_AREA FROM icechart_tempmax WHERE DN=1 AND OGR_GEOM_AREA > 10000000000.0"')
-    os.system('ogr2ogr -progress '+ outshape_polymin + ' ' + outshape_tempmin + ' -sql "SELECT *, OGR_GEOM_AREA FROM icechart_tempmin WHERE DN=1 AND OGR_GEOM_AREA > 10.0"')
-    
-    # Convert polygon to lines
-    print 'Convert ice edge map to Linestring Map'
-    os.system('ogr2ogr -progress -nlt LINESTRING -where "DN=1" ' + outshape_temp2max + ' ' + outshape_polymax)
-    os.system('ogr2ogr -progress -nlt LINESTRING -where "DN=1" ' + outshape_temp2min + ' ' + outshape_polymin)
-    
-    # Remove coast line from ice edge by clipping with coastline
-    # Prerequisite: Create NISDC coast line mask ( ogr2ogr -progress C:\Users\max\Desktop\NSIDC_oceanmask.shp C:\Users \max\Desktop\temp.shp
-    # -sql "SELECT *, OGR_GEOM_AREA FROM temp WHERE DN<250 )
-    # use "dissolve" to get ocean only with one value and the run buffer -5000m such that coast line does not match but overlaps ice polygon
-    # because only then it is clipped
-    os.system('ogr2ogr -progress -clipsrc ' + oceanmask_buffer5 + ' ' +  outshape_linemax + ' ' + outshape_temp2max)
-    os.system('ogr2ogr -progress -clipsrc ' + oceanmask_buffer5 + ' ' +  outshape_linemin + ' ' + outshape_temp2min)
-    
-    #Cleaning up temporary files 
-    os.remove(outshape_tempmax)
-    os.remove(outshape_tempmax2)
-    os.remove(outshape_tempmax3)
-    os.remove(outshape_tempmax4)
-    os.remove(outshape_tempmin)
-    os.remove(outshape_tempmin2)
-    os.remove(outshape_tempmin3)
-    os.remove(outshape_tempmin4)
-    os.remove(outshape_temp2max)
-    os.remove(outshape_temp2max2)
-    os.remove(outshape_temp2max3)
-    os.remove(outshape_temp2max4)
-    os.remove(outshape_temp2min)
-    os.remove(outshape_temp2min2)
-    os.remove(outshape_temp2min3)
-    os.remove(outshape_temp2min4)
+    polymax = PolygonizeIceMap(memrastermax.GetRasterBand(1), None, 10000000000.0)
+    polymin = PolygonizeIceMap(memrastermin.GetRasterBand(1), None, 10.0)
     
     ##########
     # ADDING BALTIC SEA
@@ -637,127 +1199,35 @@ def CreateMaxMinIce(inpath, outfilepath, landmask_raster, coastalerrormask_raste
     
     #Treated separatedly since close to coast and therefore sensitive to coastal errors
     print '\n Add Baltic Sea Ice.'
+    balticmask = gdal.Open(NSIDC_balticmask, gdalconst.GA_ReadOnly)
+    polymax.extend(PolygonizeIceMap(memrastermax.GetRasterBand(1), balticmask.GetRasterBand(1), 20000000000.0))
+    polymin.extend(PolygonizeIceMap(memrastermin.GetRasterBand(1), balticmask.GetRasterBand(1), None))
+    balticmask = None
     
-    #polygonice only Baltic Sea
-    os.system('gdal_polygonize.py ' + outfilemax + ' -mask ' + NSIDC_balticmask + ' -f "ESRI Shapefile" ' + outshape_tempmax )    
-    os.system('gdal_polygonize.py ' + outfilemin + ' -mask ' + NSIDC_balticmask + ' -f "ESRI Shapefile" ' + outshape_tempmin )    
-        
-    # Add Baltic to existing polymax and polymin 
-    os.system('ogr2ogr -update -append ' + outshape_polymax + ' ' +   outshape_tempmax +  ' -sql "SELECT *, OGR_GEOM_AREA FROM icechart_tempmax WHERE DN=1 AND OGR_GEOM_AREA > 20000000000.0"')
-    os.system('ogr2ogr -update -append ' + outshape_polymin + ' ' +   outshape_tempmin +  ' -sql "SELECT *, OGR_GEOM_AREA FROM icechart_tempmin WHERE DN=1"')
-    
-    # Convert polygon to lines
-    print 'Convert ice edge map to Linestring Map'
-    os.system('ogr2ogr -progress -nlt LINESTRING -where "DN=1" ' + outshape_temp2max + ' ' + outshape_polymax)
-    os.system('ogr2ogr -progress -nlt LINESTRING -where "DN=1" ' + outshape_temp2min + ' ' + outshape_polymin)
-    
-    #clip coast as above
-    os.system('ogr2ogr -progress -clipsrc ' + oceanmask_buffer5 + ' ' +  outshape_temp3max + ' ' + outshape_temp2max)
-    os.system('ogr2ogr -progress -clipsrc ' + oceanmask_buffer5 + ' ' +  outshape_temp3min + ' ' + outshape_temp2min)
-    
-    # Add Baltic line to existing min/max line
-    os.system('ogr2ogr -update -append ' + outshape_linemax + ' ' +   outshape_temp3max )
-    os.system('ogr2ogr -update -append ' + outshape_linemin + ' ' +   outshape_temp3min )
-    
-
     #########
     # REDO MAX MIN RASTER
     #########    
     
     #The polygon and line files are now cleaned for noise since only large polygon
     # was chosen for minimum polygon
-    # Re-rasterize to tif, such that the tiff is also cleaned
-
-    # gdal rasterize should be able to overwrite / create new a file. Since this does not work, I set the
-    # existing one to zero and rasterize the polgon into it
+    # Re-rasterize such that the tiff is also cleaned, burn in landmask again -- is not contained in polygon
     print 'Rerasterize max and min GeoTIFF'
-    outarray = gdal.Open( outfilemax, gdalconst.GA_Update)
-    outarraymax = outarray.ReadAsArray()
-    outarraymax = numpy.zeros((rows, cols), numpy.float) 
-    outbandmax = outarray.GetRasterBand(1)    
-    outbandmax.WriteArray(outarraymax)
-    outbandmax.FlushCache()
-    outarray = None
-    
-    #Rasterize polygon
+    for (memraster, polygons, rasterfile) in ((memrastermax, polymax, outfilemax), (memrastermin, polymin, outfilemin)):
+        memband = memraster.GetRasterBand(1)
+        memband.Fill(0)
+        polygonsource = CreateMemoryLayer(polygons, ogr.wkbPolygon, NSIDCSpatialReference(landraster.shape))
+        gdal.RasterizeLayer(memraster, [1], polygonsource.GetLayer(0), burn_values = [1])
+        polygonsource = None
+        memarray = memband.ReadAsArray()
+        memarray[landpixels] = landraster[landpixels]
+        WriteNSIDCArray(memarray, rasterfile)
+    
+    memrastermax = None
+    memrastermin = None
+    
+    if writeshapefiles:
+        WriteMaxMinShapefiles(inpath, period, polymax, polymin, oceanmask_buffer5, landraster.shape)
     
-    os.system('gdal_rasterize -burn 1 ' + outshape_polymax + ' ' + outfilemax )
-    # OPen raster and burn in landmask again -- is not contained in polygon
-    outarray = gdal.Open( outfilemax, gdalconst.GA_Update)
-    outarraymax = outarray.ReadAsArray()
-    landmask = gdal.Open(landmask_raster, gdalconst.GA_ReadOnly)
-    landraster = landmask.ReadAsArray()
-    outarraymax = numpy.where( (landraster ==   251), 251 , outarraymax)
-    outarraymax = numpy.where( (landraster ==   252), 252 , outarraymax)
-    outarraymax = numpy.where( (landraster ==   253), 253 , outarraymax)
-    outarraymax = numpy.where( (landraster ==   254), 254 , outarraymax)
-    outarraymax = numpy.where( (landraster ==   255), 255 , outarraymax)
-    outbandmax = outarray.GetRasterBand(1)    
-    outbandmax.WriteArray(outarraymax)
-    outbandmax.FlushCache()
-    outarray = None
-    landmask = None
-    landraster = None
-    
-    #Reraster the min image
-    outarray = gdal.Open( outfilemin, gdalconst.GA_Update)
-    outarraymin = outarray.ReadAsArray()
-    outarraymin = numpy.zeros((rows, cols), numpy.float) 
-    outbandmin = outarray.GetRasterBand(1)    
-    outbandmin.WriteArray(outarraymin)
-    outbandmin.FlushCache()
-    outarray = None
-    #Rasterize polygon
-    os.system('gdal_rasterize -burn 1 ' + outshape_polymin + ' ' + outfilemin )
-    # OPen raster and burn in landmask again -- is not contained in polygon
-    outarray = gdal.Open( outfilemin, gdalconst.GA_Update)
-    outarraymin = outarray.ReadAsArray()
-    landmask = gdal.Open(landmask_raster, gdalconst.GA_ReadOnly)
-    landraster = landmask.ReadAsArray()
-    outarraymin = numpy.where( (landraster ==   251), 251 , outarraymin)
-    outarraymin = numpy.where( (landraster ==   252), 252 , outarraymin)
-    outarraymin = numpy.where( (landraster ==   253), 253 , outarraymin)
-    outarraymin = numpy.where( (landraster ==   254), 254 , outarraymin)
-    outarraymin = numpy.where( (landraster ==   255), 255 , outarraymin)
-    outbandmin = outarray.GetRasterBand(1)    
-    outbandmin.WriteArray(outarraymin)
-    outbandmin.FlushCache()
-    landmask = None
-    landraster = None
-        
-    #Cleaning up temporary files 
-    os.remove(outshape_tempmax)
-    os.remove(outshape_tempmax2)
-    os.remove(outshape_tempmax3)
-    os.remove(outshape_tempmax4)
-    os.remove(outshape_tempmin)
-    os.remove(outshape_tempmin2)
-    os.remove(outshape_tempmin3)
-    os.remove(outshape_tempmin4)
-    os.remove(outshape_temp2max)
-    os.remove(outshape_temp2max2)
-    os.remove(outshape_temp2max3)
-    os.remove(outshape_temp2max4)
-    os.remove(outshape_temp2min)
-    os.remove(outshape_temp2min2)
-    os.remove(outshape_temp2min3)
-    os.remove(outshape_temp2min4)
-    os.remove(outshape_temp3max)
-    os.remove(outshape_temp3max2)
-    os.remove(outshape_temp3max3)
-    os.remove(outshape_temp3max4)
-    os.remove(outshape_temp3min)
-    os.remove(outshape_temp3min2)
-    os.remove(outshape_temp3min3)
-    os.remove(outshape_temp3min4)
-    
-    
-    #Reproject to EPSG:3575
-    ReprojectShapefile(outshape_polymax)
-    ReprojectShapefile(outshape_polymin)
-    ReprojectShapefile(outshape_linemax)
-    ReprojectShapefile(outshape_linemin)
-  
     #reproject to EPSG3575
     EPSG3411_2_EPSG3575(outfilemax)        
     EPSG3411_2_EPSG3575(outfilemin) 
@@ -766,244 +1236,1429 @@ def CreateMaxMinIce(inpath, outfilepath, landmask_raster, coastalerrormask_raste
     print 'Done Creating Max/Min Maps'        
     return outfilemax, outfilemin
     
-def FilterCoastalAreas(outfilepath, landmask_raster, coastalerrormask_raster):
+def WriteMaxMinShapefiles(inpath, period, polymax, polymin, oceanmask_buffer5, shape = (448, 304)):
+    '''
+    Writes the max / min ice polygons of CreateMaxMinIce and their ice edge
+    lines as poly and line shapefiles of the period to inpath, shape is
+    the one of the NSIDC grid of the polygons
+    '''
+    
+    ##########
+    # ICE EDGE LINES
+    ##########
+    
+    # Convert polygon to lines and remove coast line from ice edge by clipping with coastline
+    # Prerequisite: Create NISDC coast line mask ( ogr2ogr -progress C:\Users\max\Desktop\NSIDC_oceanmask.shp C:\Users \max\Desktop\temp.shp
+    # -sql "SELECT *, OGR_GEOM_AREA FROM temp WHERE DN<250 )
+    # use "dissolve" to get ocean only with one value and the run buffer -5000m such that coast line does not match but overlaps ice polygon
+    # because only then it is clipped
+    print 'Convert ice edge map to Linestring Map'
+    oceanmask = ReadOceanMask(oceanmask_buffer5)
+    linemax = IceEdgeLines(polymax, oceanmask)
+    linemin = IceEdgeLines(polymin, oceanmask)
+    
+    ##########
+    # WRITE SHAPEFILES, EPSG:3411 AND REPROJECTED TO EPSG:3575
+    ##########
+    WriteIceShapefile(inpath + 'icechart_poly_maximum' + period + '.shp', polymax, ogr.wkbPolygon, shape = shape)
+    WriteIceShapefile(inpath + 'icechart_poly_minimum' + period + '.shp', polymin, ogr.wkbPolygon, shape = shape)
+    WriteIceShapefile(inpath + 'icechart_line_maximum' + period + '.shp', linemax, ogr.wkbMultiLineString, shape = shape)
+    WriteIceShapefile(inpath + 'icechart_line_minimum' + period + '.shp', linemin, ogr.wkbMultiLineString, shape = shape)
+    
+def CreateMaxMinShapefiles(inpath, period, oceanmask_buffer5):
+    '''
+    Creates the shapefiles of CreateMaxMinIce from its max / min GeoTIFFs
+    of the period in inpath. These hold only the selected polygons already,
+    so all ice polygons of the GeoTIFFs are taken
+    '''
+    
+    polygons = []
+    for name in ['maximum', 'minimum']:
+        raster = gdal.Open(inpath + 'icechart_' + name + period + '.tif', gdalconst.GA_ReadOnly)
+        shape = (raster.RasterYSize, raster.RasterXSize)
+        polygons.append(PolygonizeIceMap(raster.GetRasterBand(1), None, None))
+        raster = None
+    WriteMaxMinShapefiles(inpath, period, polygons[0], polygons[1], oceanmask_buffer5, shape)
+    
+def WriteNSIDCArray(outarray, outfile):
+    '''
+    Writes an array on the NSIDC grid to a Float64 GeoTIFF
+    '''
+    
+    outraster = CreateNSIDCGeoTiff(outfile, gdal.GDT_Float64, shape = outarray.shape)
+    if outraster is None: 
+        print 'Could not create ', outfile
+        return
+    outband = outraster.GetRasterBand(1)
+    outband.WriteArray(outarray)
+    outband.FlushCache()
+    outband = None
+    outraster = None
+    
+def NSIDCSpatialReference(shape = (448, 304)):
+    '''
+    Returns the spatial reference of the NSIDC grid, EPSG:3411, or of the
+    grid with the given shape, see NSIDCGrids
+    '''
+    
+    spatialRef = osr.SpatialReference()
+    #spatialRef.ImportFromEPSG(3411)  --> this one does for some reason NOT work, but using proj4 does
+    spatialRef.ImportFromProj4(NSIDCGrid(shape)['proj4'])
+    return spatialRef
+    
+def CreateMemoryLayer(geometries, geometrytype, spatialRef = None, levels = None):
+    '''
+    Creates an OGR Memory datasource with one layer containing the geometries,
+    each with the fields DN = 1 and AREA. If levels is given, each geometry
+    gets its level in the additional field LEVEL. spatialRef defaults to the
+    northern 25 km grid, see NSIDCSpatialReference
+    '''
+    
+    if spatialRef is None:
+        spatialRef = NSIDCSpatialReference()
+    datasource = ogr.GetDriverByName('Memory').CreateDataSource('memory')
+    layer = datasource.CreateLayer('icechart', spatialRef, geometrytype)
+    layer.CreateField(ogr.FieldDefn('DN', ogr.OFTInteger))
+    layer.CreateField(ogr.FieldDefn('AREA', ogr.OFTReal))
+    if levels is not None:
+        layer.CreateField(ogr.FieldDefn('LEVEL', ogr.OFTInteger))
+    for i, geometry in enumerate(geometries):
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField('DN', 1)
+        feature.SetField('AREA', geometry.GetArea())
+        if levels is not None:
+            feature.SetField('LEVEL', int(levels[i]))
+        feature.SetGeometry(geometry)
+        layer.CreateFeature(feature)
+        feature = None
+    return datasource
+    
+def PolygonizeIceMap(band, maskband, minimumarea):
+    '''
+    Polygonizes a max or min band in memory and returns the geometries of 
+    all ice polygons (DN = 1) larger than minimumarea (m2, None for all).
+    maskband limits the polygonization to an area as gdal_polygonize -mask
+    '''
+    
+    datasource = ogr.GetDriverByName('Memory').CreateDataSource('polygonize')
+    layer = datasource.CreateLayer('polygonize', NSIDCSpatialReference((band.YSize, band.XSize)), ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn('DN', ogr.OFTInteger))
+    gdal.Polygonize(band, maskband, layer, 0, [], callback = None)
+    
+    polygons = []
+    for feature in layer:
+        if feature.GetField('DN') != 1:
+            continue
+        geometry = feature.GetGeometryRef()
+        if (minimumarea is None) or (geometry.GetArea() > minimumarea):
+            polygons.append(geometry.Clone())
+    datasource = None
+    return polygons
+    
+def IceEdgeLines(polygons, oceanmask):
+    '''
+    Converts the ice polygons to lines and clips them with the ocean mask,
+    such that the coast line is removed from the ice edge
+    '''
+    
+    lines = []
+    for polygon in polygons:
+        line = polygon.Boundary().Intersection(oceanmask)
+        if (line is None) or line.IsEmpty():
+            continue
+        lines.append(ogr.ForceToMultiLineString(line))
+    return lines
+    
+def ReadOceanMask(oceanmask):
+    '''
+    Returns the union of all polygons in the ocean mask shapefile as one geometry
+    '''
+    
+    datasource = ogr.Open(oceanmask)
+    layer = datasource.GetLayer(0)
+    union = ogr.Geometry(ogr.wkbMultiPolygon)
+    for feature in layer:
+        union = union.Union(feature.GetGeometryRef())
+    datasource = None
+    return union
+    
+def WriteIceShapefile(outshapefile, geometries, geometrytype, levels = None, shape = (448, 304)):
+    '''
+    Writes the ice geometries, on the NSIDC grid of the given shape (EPSG:3411 
+    by default), to outshapefile. For the northern grids a copy reprojected
+    to EPSG:3575 is written into the subfolder EPSG3575, same names as
+    created by ReprojectShapefile, EPSG:3575 being an Arctic projection
+    it is skipped for the south. levels see CreateMemoryLayer
+    '''
+    
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    spatialRef = NSIDCSpatialReference(shape)
+    shapefiles = [(outshapefile, geometries, spatialRef)]
+    
+    if NSIDCGrid(shape)['hemisphere'] == 'north':
+        (infilepath, infilename) = os.path.split(outshapefile)
+        (infileshortname, extension) = os.path.splitext(infilename)
+        reprshapepath = infilepath + '//EPSG3575'
+        if not os.path.exists(reprshapepath):
+            os.makedirs(reprshapepath)
+        reprshapefile = reprshapepath + '//' + infileshortname + '_EPSG3575' + extension
+        
+        spatialRef3575 = osr.SpatialReference()
+        spatialRef3575.ImportFromEPSG(3575)
+        transform = osr.CoordinateTransformation(spatialRef, spatialRef3575)
+        reprojected = []
+        for geometry in geometries:
+            geometry = geometry.Clone()
+            geometry.Transform(transform)
+            reprojected.append(geometry)
+        shapefiles.append((reprshapefile, reprojected, spatialRef3575))
+    
+    for (shapefile, shapegeometries, spatialRef) in shapefiles:
+        if os.path.exists(shapefile):
+            driver.DeleteDataSource(shapefile)
+        memorysource = CreateMemoryLayer(shapegeometries, geometrytype, spatialRef, levels)
+        print 'Write ', shapefile
+        outsource = driver.CopyDataSource(memorysource, shapefile)
+        outsource = None
+        memorysource = None
+    
+# Line segments of each marching squares case, edges numbered 0 = top, 
+# 1 = right, 2 = bottom, 3 = left of the cell. Corner bits are 
+# 8 = top left, 4 = top right, 2 = bottom right, 1 = bottom left.
+# The saddles 5 and 10 are resolved with the mean of the cell, see IsolineSegments
+MarchingSquaresSegments = {1: [(3, 2)], 2: [(2, 1)], 3: [(3, 1)], 4: [(0, 1)], 
+                           6: [(0, 2)], 7: [(3, 0)], 8: [(3, 0)], 9: [(0, 2)], 
+                           11: [(0, 1)], 12: [(3, 1)], 13: [(2, 1)], 14: [(3, 2)]}
+
+def IsolineSegments(inarray, level):
+    '''
+    Marching squares on the pixel centres of inarray: returns all line 
+    segments of the isoline at level as array of shape (segments, 2, 2), 
+    each point as (column, row) in pixels. Cells with a NaN corner are skipped
+    '''
+    
+    # NaN corners and edges parallel to the isoline give warnings only
+    olderr = numpy.seterr(divide = 'ignore', invalid = 'ignore')
+    
+    topleft = inarray[:-1, :-1]
+    topright = inarray[:-1, 1:]
+    bottomright = inarray[1:, 1:]
+    bottomleft = inarray[1:, :-1]
+    
+    case = (topleft >= level) * 8 + (topright >= level) * 4 + (bottomright >= level) * 2 + (bottomleft >= level)
+    nancells = numpy.isnan(topleft + topright + bottomright + bottomleft)
+    case[nancells] = 0
+    
+    # crossing point of the isoline on each of the four edges of each cell
+    rows, cols = numpy.mgrid[0:case.shape[0], 0:case.shape[1]].astype(numpy.float)
+    edgepoints = [(cols + (level - topleft) / (topright - topleft), rows), 
+                  (cols + 1, rows + (level - topright) / (bottomright - topright)), 
+                  (cols + (level - bottomleft) / (bottomright - bottomleft), rows + 1), 
+                  (cols, rows + (level - topleft) / (bottomleft - topleft))]
+    
+    # saddles: a high centre connects the high corners
+    centrehigh = (topleft + topright + bottomright + bottomleft) / 4.0 >= level
+    numpy.seterr(**olderr)
+    cases = dict(MarchingSquaresSegments)
+    cases[5] = None
+    cases[10] = None
+    
+    segments = []
+    for (thiscase, edgepairs) in cases.items():
+        if edgepairs is None:
+            if thiscase == 5:
+                pairsets = (((3, 0), (2, 1)), ((3, 2), (0, 1)))
+            else:
+                pairsets = (((0, 1), (3, 2)), ((3, 0), (2, 1)))
+            selections = ((case == thiscase) & centrehigh, (case == thiscase) & ~centrehigh)
+        else:
+            pairsets = (edgepairs,)
+            selections = (case == thiscase,)
+        for (selection, pairs) in zip(selections, pairsets):
+            if not selection.any():
+                continue
+            for (start, stop) in pairs:
+                segment = numpy.empty((selection.sum(), 2, 2))
+                segment[:, 0, 0] = edgepoints[start][0][selection]
+                segment[:, 0, 1] = edgepoints[start][1][selection]
+                segment[:, 1, 0] = edgepoints[stop][0][selection]
+                segment[:, 1, 1] = edgepoints[stop][1][selection]
+                segments.append(segment)
+    
+    if segments == []:
+        return numpy.zeros((0, 2, 2))
+    return numpy.concatenate(segments)
+    
+def ChainSegments(segments):
+    '''
+    Joins line segments sharing end points into polylines.
+    Returns a list of point lists, closed lines end with their first point
+    '''
+    
+    # neighbouring cells calculate identical crossing points on common edges
+    endpoints = {}
+    for i, segment in enumerate(segments):
+        for j in (0, 1):
+            endpoints.setdefault(tuple(segment[j]), []).append((i, j))
+    
+    used = numpy.zeros(len(segments), bool)
+    
+    def Follow(i, j):
+        # start with point j of segment i, walk until no unused segment follows
+        line = [tuple(segments[i][j])]
+        while True:
+            used[i] = True
+            point = tuple(segments[i][1 - j])
+            line.append(point)
+            following = [(k, l) for (k, l) in endpoints[point] if not used[k]]
+            if following == []:
+                return line
+            i, j = following[0]
+    
+    lines = []
+    # open lines start at points with only one segment, then the closed lines
+    for (point, ends) in endpoints.items():
+        if (len(ends) == 1) and not used[ends[0][0]]:
+            lines.append(Follow(ends[0][0], ends[0][1]))
+    for i in range(len(segments)):
+        if not used[i]:
+            lines.append(Follow(i, 0))
+    return lines
+    
+def OceanMaskIndex(oceanmask):
+    '''
+    Splits the ocean mask into its polygons and returns them with their
+    envelopes, used by ClipToOceanMask as simple spatial index
+    '''
+    
+    union = ReadOceanMask(oceanmask)
+    parts = []
+    for i in range(union.GetGeometryCount()):
+        part = union.GetGeometryRef(i).Clone()
+        parts.append((part.GetEnvelope(), part))
+    if parts == []:
+        parts.append((union.GetEnvelope(), union))
+    return parts
+    
+def ClipToOceanMask(line, oceanindex):
+    '''
+    Clips line with those ocean mask polygons whose envelope overlaps the
+    envelope of line. Returns the clipped geometries
+    '''
+    
+    (minx, maxx, miny, maxy) = line.GetEnvelope()
+    clipped = []
+    for (envelope, part) in oceanindex:
+        if (envelope[0] > maxx) or (envelope[1] < minx) or (envelope[2] > maxy) or (envelope[3] < miny):
+            continue
+        geometry = line.Intersection(part)
+        if (geometry is None) or geometry.IsEmpty():
+            continue
+        clipped.append(ogr.ForceToMultiLineString(geometry))
+    return clipped
+    
+def CreateFrequencyIsolines(frequencyfile, oceanmask_buffer5, levels = range(10, 100, 10)):
+    '''
+    Creates the isolines of the sea ice frequency map at all levels (percent)
+    with marching squares, clipped to the ocean mask, written to a line 
+    shapefile named as frequencyfile with "isolines" for "seaicefrequencymap" 
+    and the level in the field LEVEL
+    
+    The polar hole (251) counts as 100%, land (252-255) as 0%, the lines 
+    along the coast are removed by the ocean mask
+    '''
+    
+    frequencyraster = gdal.Open(frequencyfile, gdalconst.GA_ReadOnly)
+    frequency = frequencyraster.ReadAsArray().astype(numpy.float)
+    geotransform = frequencyraster.GetGeoTransform()
+    frequencyraster = None
+    
+    frequency[frequency == 251] = 100
+    frequency[frequency > 251] = 0
+    
+    oceanindex = OceanMaskIndex(oceanmask_buffer5)
+    
+    lines = []
+    linelevels = []
+    for level in levels:
+        for points in ChainSegments(IsolineSegments(frequency, level)):
+            line = ogr.Geometry(ogr.wkbLineString)
+            for (col, row) in points:
+                line.AddPoint_2D(geotransform[0] + (col + 0.5) * geotransform[1], \
+                                 geotransform[3] + (row + 0.5) * geotransform[5])
+            for geometry in ClipToOceanMask(line, oceanindex):
+                lines.append(geometry)
+                linelevels.append(level)
+    
+    (infilepath, infilename) = os.path.split(frequencyfile)
+    outfile = infilepath + '//' + os.path.splitext(infilename)[0].replace('seaicefrequencymap', 'isolines') + '.shp'
+    WriteIceShapefile(outfile, lines, ogr.wkbMultiLineString, linelevels, frequency.shape)
+    return outfile
+    
+def FilterCoastalAreas(cubefile, filteredcubefile, landmask_raster, coastalerrormask_raster):
     '''
     Problem: Along Coastal Areas, the land/ocean boundary appears as ice values
     Solution: Mask for problematice areas, but consider as ice if value remains
     for a number of consecutive days -- filters singular error pixels
     
-    Loop through all NSIDC ice concentration areas
+    Loop through all NSIDC ice concentration days in the cube
     In the coastal areas (defined by NSIDC_coastalerrormask_raster.tif) ice concentration
-    above 15% is only considered if ice is present three days before and after the date
+    above 15% is only considered if ice is present two days before and after the date
+    
+    The days around the present day are kept in a ring buffer, so each day 
+    is read from the cube only once. Coast and Baltic are filtered in one step
+    and the result is written to a new cube, filteredcubefile
+    
+    Only the ocean pixels (see OceanPixels) are kept in the ring buffer and
+    filtered, as 1-D arrays. Land and the never-ice areas are the same on 
+    every day and are taken from one prepared raster when writing the day
     '''
     
     #register all gdal drivers
     gdal.AllRegister()
     
-    # Iterate through all rasterfiles
-    filelist = glob.glob(outfilepath + 'nt*.tif')
-    
+    # ADJUST HOW MANY DAYS PLUS AND MINUS THE PRESENT DATE YOU WANT
+    dayrange = 2
+    windowsize = 2 * dayrange + 1
     
-    #Files are all the same properties, so take first one to get info
-    firstfilename = filelist[0]
-    
-    #Define file names 
-    (infilepath, infilename) = os.path.split(firstfilename)             #get path and filename seperately
-    (infileshortname, extension) = os.path.splitext(infilename)
-    
-
+    cube, dates, valid = OpenCube(cubefile)
+    NumberOfSlots = cube.shape[0]
     
     #Open Coastal Mask into array
     #THe coastal mask defines error areas -- value 1 for coast, value 2 for Baltic and value 3 for never-ice areas.
     coastalerrormask = gdal.Open(coastalerrormask_raster, gdalconst.GA_ReadOnly)
-    coastalerrormaskarray = coastalerrormask.ReadAsArray()
-    
-    #Create file receiving the ice mask
-    #get image size
-    rows = coastalerrormask.RasterYSize
-    cols = coastalerrormask.RasterXSize   
-    
-    coastalicemaskraster = numpy.zeros((rows, cols), numpy.float) 
-    #Loop through all files to do calculation
-    for infile in filelist:
-        #Find present data    
-        #Find present data
-        #If NSIDC changes filenames, this may need adjustment, happened in 2016
-        #(os.path.split(infile)[1] is the filename without path, then split date
-        presentyear = int(os.path.split(infile)[1][3:7])
-        presentmonth = int(os.path.split(infile)[1][7:9])
-        presentday = int(os.path.split(infile)[1][9:11])
+    coastalerrormaskarray = coastalerrormask.ReadAsArray().ravel()
+    
+    landmask = gdal.Open(landmask_raster, gdalconst.GA_ReadOnly)
+    landraster = landmask.ReadAsArray().ravel()
+    
+    # Ocean pixels, without land and never-ice areas, and their position in
+    # the compact 1-D arrays
+    oceanpixels = OceanPixels(landmask_raster, coastalerrormask_raster)
+    compactposition = numpy.empty(landraster.size, numpy.intp)
+    compactposition.fill(-1)
+    compactposition[oceanpixels] = numpy.arange(len(oceanpixels))
+    
+    # Positions of the filtered areas, computed once for all days
+    # Coast and Baltic get the same treatment, so they are filtered together
+    errorpixels = compactposition[(coastalerrormaskarray == 1) | (coastalerrormaskarray == 2)]
+    errorpixels = errorpixels[errorpixels >= 0]
+    
+    # The rest of each day: land burnt in and never-ice areas 0
+    ########################
+    # COASTAL ERROR FOR DEFINITE NO ICE AREAS
+    ########################       
+    landpixels = (landraster >= 251) & (landraster <= 255)
+    outraster = numpy.where(landpixels, landraster, 0).astype(numpy.uint8)
+    
+    # Ring buffer with the days around the present day. Slot i of the cube
+    # is kept at position i % windowsize, icewindow holds if there is ice
+    # in the error areas
+    rasterwindow = numpy.zeros((windowsize, len(oceanpixels)), numpy.uint8)
+    icewindow = numpy.zeros((windowsize, len(errorpixels)), bool)
+    
+    def ReadSlot(slot):
+        position = slot % windowsize
+        numpy.take(cube[slot].ravel(), oceanpixels, out = rasterwindow[position])
+        numpy.greater_equal(rasterwindow[position, errorpixels], 38, out = icewindow[position])
+    
+    filteredcube = numpy.lib.format.open_memmap(filteredcubefile, mode = 'w+', \
+                                        dtype = numpy.uint8, shape = cube.shape)
+    coastalicemaskraster = numpy.zeros(len(errorpixels), numpy.int32)
+    
+    # Fill the ring buffer with the days following the first day
+    for slot in range(0, min(dayrange, NumberOfSlots)):
+        if valid[slot]:
+            ReadSlot(slot)
+    
+    #Loop through all days to do calculation
+    for day in range(NumberOfSlots):
+        
+        # Read the day entering the window
+        if (day + dayrange < NumberOfSlots) and valid[day + dayrange]:
+            ReadSlot(day + dayrange)
         
-        presentdate =  datetime.date(presentyear, presentmonth, presentday) 
+        if not valid[day]:
+            continue
         
-        ########################
-        # COASTAL ERROR FOR COAST
-        ########################        
-        # ADJUST HOW MANY DAYS PLUS AND MINUS THE PRESENT DATE YOU WANT
-        dayrange = 2
+        presentdate = dates[day]
+        print "coastal error mask for ", presentdate
+        present = day % windowsize
         
-        #Let ice value in coastal zone persist if there was ice the days around it
-        presentdayfilename = outfilepath + "nt_" + presentdate.strftime('%Y%m%d') +  str(os.path.split(infile)[1])[11:]
-        presentdayfile = gdal.Open( presentdayfilename, gdalconst.GA_Update)
-        presentdayraster = presentdayfile.ReadAsArray()
-        print "coastal error mask for ", presentdayfilename
-        #Reset coastalicemaskraster to zero
-        coastalicemaskraster = numpy.zeros((rows, cols), numpy.float) 
-        #Loop through the files around present day and determine how many days there is ice in coastal zone    
+        #Determine how many days around present day there is ice in coastal zone    
+        coastalicemaskraster[:] = 0
         for i in range(-dayrange, dayrange +1):
-            diff = datetime.timedelta(days=i)
-            diffdate = presentdate + diff
-            checkfilename = outfilepath + "nt_" + diffdate.strftime('%Y%m%d') +  str(os.path.split(infile)[1])[11:]
-            
-            if os.path.isfile(checkfilename):
-                checkfile = gdal.Open(checkfilename, gdalconst.GA_ReadOnly)
-                #Read input raster into array
-                checkfileraster = checkfile.ReadAsArray()
-                coastalicemaskraster = numpy.where( (coastalerrormaskarray == 1) & (checkfileraster >= 38), coastalicemaskraster + 1 , coastalicemaskraster )
-                
-                
+            slot = day + i
+            if (0 <= slot < NumberOfSlots) and valid[slot] and \
+               (dates[slot] - presentdate).days == i:
+                coastalicemaskraster += icewindow[slot % windowsize]
             else:
-                #If previous day files do not exist, take present day one -- otherwise it does not add up with number of Days                
-                coastalicemaskraster = numpy.where( (coastalerrormaskarray == 1) & (presentdayraster >= 38), coastalicemaskraster + 1 , coastalicemaskraster )
-                
+                #If previous day does not exist, take present day one -- otherwise it does not add up with number of Days
+                coastalicemaskraster += icewindow[present]
         
-
+        presentdayraster = rasterwindow[present].copy()
         
-        presentdayraster = numpy.where( (coastalerrormaskarray == 1) & ( coastalicemaskraster < 5 ), 0, presentdayraster)
-        ########################
-        # COASTAL ERROR FOR DEFINITE NO ICE AREAS
-        ########################       
-        presentdayraster = numpy.where( (coastalerrormaskarray == 3), 0, presentdayraster)
+        # Coast and Baltic -- ice only if ice on all days in the window
+        presentdayraster[errorpixels[coastalicemaskraster < windowsize]] = 0
         
+        # scatter the ocean pixels into the raster with land burnt in
+        outraster[oceanpixels] = presentdayraster
+        filteredcube[day] = outraster.reshape(cube.shape[1:])
+    
+    filteredcube.flush()
+    filteredcube = None
+    cube = None
+    
+    # The filtered cube covers the same days as the input cube
+    datesfile, validfile = CubeFilenames(filteredcubefile)
+    shutil.copy(CubeFilenames(cubefile)[0], datesfile)
+    shutil.copy(CubeFilenames(cubefile)[1], validfile)
+    
+    return filteredcubefile
+    
+     
+def YearIceDays(accumulatorpath, month, startyear, stopyear):
+    '''
+    Reads the per year accumulators accumulator_YYYYMM.npz of the given month
+    for startyear - stopyear. Returns the years found, the ice days of each 
+    year and pixel as array (years, rows, cols) and a valid array of the same
+    shape, False where the pixel is in the polar hole at least one day of that
+    year. Ice days are scaled to the full month where days are missing
+    '''
+    
+    years = []
+    icedays = []
+    valid = []
+    for year in range(startyear, stopyear + 1):
+        yearfile = accumulatorpath + 'accumulator_' + str(year * 100 + month) + '.npz'
+        if not os.path.exists(yearfile):
+            print 'No counts for ', year, ', ', yearfile, ' missing'
+            continue
+        accumulator = LoadAccumulator(yearfile)
+        years.append(year)
+        icedays.append(accumulator['icedays'] * (float(calendar.monthrange(year, month)[1]) / accumulator['NumberOfDays']))
+        valid.append(accumulator['holedays'] == 0)
+    
+    return numpy.array(years), numpy.array(icedays), numpy.array(valid)
+    
+def IceDayTrend(years, icedays, valid):
+    '''
+    Least squares trend of ice days against year for all pixels at once, 
+    only using the valid pixel-years. Sums over the year axis give slope and
+    intercept in closed form, the p-value of the slope follows from the
+    t-distribution with n - 2 degrees of freedom.
+    Returns trend (days per decade), p-value and mean ice days, NaN where
+    a pixel has less than 3 valid years
+    '''
+    
+    weight = valid.astype(numpy.float)
+    x = (years - years.mean()).astype(numpy.float)[:, numpy.newaxis, numpy.newaxis]
+    
+    n = weight.sum(axis = 0)
+    sumx = (weight * x).sum(axis = 0)
+    sumy = (weight * icedays).sum(axis = 0)
+    sumxx = (weight * x * x).sum(axis = 0)
+    sumxy = (weight * x * icedays).sum(axis = 0)
+    
+    olderr = numpy.seterr(divide = 'ignore', invalid = 'ignore')
+    sxx = sumxx - sumx * sumx / n
+    slope = (sumxy - sumx * sumy / n) / sxx
+    intercept = (sumy - slope * sumx) / n
+    
+    residual = weight * (icedays - intercept - slope * x)
+    standarderror = numpy.sqrt((residual * residual).sum(axis = 0) / (n - 2) / sxx)
+    tvalue = slope / standarderror
+    numpy.seterr(**olderr)
+    
+    # constant ice days give a slope 0 without error
+    tvalue[(standarderror == 0) & (slope == 0)] = 0
+    pvalue = 2 * stats.t.sf(abs(tvalue), numpy.maximum(n - 2, 1))
+    
+    toofew = n < 3
+    mean = sumy / numpy.maximum(n, 1)
+    for outarray in (slope, pvalue, mean):
+        outarray[toofew] = numpy.nan
+    
+    return slope * 10, pvalue, mean
+    
+def CreateTrendMaps(inpath, month, startyear, stopyear, anomalyyear, landmask_raster):
+    '''
+    Creates from the per year accumulators in inpath (see CreateYearAccumulators)
+    * icechart_trend -- trend of ice days per decade
+    * icechart_trendpvalue -- p-value of the trend
+    * icechart_anomalyYYYYMM -- ice days of anomalyyear minus the mean of all years
+    
+    Pixel-years in the polar hole are left out of trend and mean, pixels
+    with less than 3 years left and the anomaly year in the polar hole are
+    set to 251. Land values 252-255 are burnt in as in the other maps.
+    Output is available both as EPSG:3411 and EPSG:3575 
+    '''
+    
+    years, icedays, valid = YearIceDays(inpath, month, startyear, stopyear)
+    trend, pvalue, mean = IceDayTrend(years, icedays, valid)
+    period = AccumulatorPeriod(years * 100 + month)
+    
+    if anomalyyear in years:
+        i = list(years).index(anomalyyear)
+        anomaly = numpy.where(valid[i], icedays[i] - mean, numpy.nan)
+    else:
+        print 'No counts for anomaly year ', anomalyyear
+        anomaly = None
+    
+    landmask = gdal.Open(landmask_raster , gdalconst.GA_ReadOnly)
+    landraster = landmask.ReadAsArray()
+    landmask = None
+    landpixels = (landraster >= 251) & (landraster <= 255)
+    
+    outfiles = []
+    for (outarray, name) in ((trend, 'trend'), (pvalue, 'trendpvalue'), (anomaly, 'anomaly' + str(anomalyyear * 100 + month))):
+        if outarray is None:
+            continue
+        outarray[numpy.isnan(outarray)] = 251
+        outarray[landpixels] = landraster[landpixels]
+        outfile = inpath + 'icechart_' + name + period + '.tif'
+        WriteNSIDCArray(outarray, outfile)
+        EPSG3411_2_EPSG3575(outfile)
+        outfiles.append(outfile)
+    
+    return outfiles
+    
+def CreateBootstrapMaps(inpath, month, startyear, stopyear, landmask_raster, replicates = 1000, \
+                        percentiles = (2.5, 97.5), blocksize = 5000, seed = 0, period = None):
+    '''
+    Confidence band of the sea ice frequency map by resampling the years
+    with replacement. Each replicate draws len(years) years and is given by
+    the number of times each year is drawn, so its frequency is a weighted
+    sum of the per year accumulators in inpath (see CreateYearAccumulators)
+    and no daily data is read. 
+    
+    Pixels are processed in blocks of blocksize, such that only
+    replicates x blocksize frequencies are in memory at once. The same
+    replicates (fixed seed) are used for all blocks.
+    
+    Writes icechart_seaicefrequencylower / upper with the lower and upper
+    percentile next to the frequency map, filtered with the maximum map, 
+    polar hole and land burnt in as in CreateSeaIceFrequencyMap. period 
+    names the maximum map read and the output as in ProcessMonth, by 
+    default the period of the years found
+    '''
+    
+    years = []
+    icedays = []
+    holedays = []
+    NumberOfDays = []
+    for year in range(startyear, stopyear + 1):
+        yearfile = inpath + 'accumulator_' + str(year * 100 + month) + '.npz'
+        if not os.path.exists(yearfile):
+            print 'No counts for ', year, ', ', yearfile, ' missing'
+            continue
+        accumulator = LoadAccumulator(yearfile)
+        years.append(year)
+        icedays.append(accumulator['icedays'].ravel())
+        holedays.append(accumulator['holedays'].ravel())
+        NumberOfDays.append(accumulator['NumberOfDays'])
+    if len(years) == 0:
+        raise ValueError('No accumulator files for ' + str(startyear) + ' - ' + str(stopyear) + ' in ' + inpath)
+    rows, cols = accumulator['icedays'].shape
+    icedays = numpy.array(icedays, numpy.float)
+    NumberOfDays = numpy.array(NumberOfDays, numpy.float)
+    holepixels = numpy.array(holedays).sum(axis = 0) > 0
+    if period is None:
+        period = AccumulatorPeriod(numpy.array(years) * 100 + month)
+    
+    # number of times each year is drawn, one row per replicate
+    randomstate = numpy.random.RandomState(seed)
+    weights = randomstate.multinomial(len(years), numpy.ones(len(years)) / len(years), size = replicates).astype(numpy.float)
+    replicatedays = numpy.dot(weights, NumberOfDays)[:, numpy.newaxis]
+    
+    lower = numpy.zeros(rows * cols)
+    upper = numpy.zeros(rows * cols)
+    for start in range(0, rows * cols, blocksize):
+        frequency = numpy.dot(weights, icedays[:, start:start + blocksize]) * 100.0 / replicatedays
+        lower[start:start + blocksize], upper[start:start + blocksize] = numpy.percentile(frequency, percentiles, axis = 0)
+    
+    max_chart = gdal.Open(inpath + 'icechart_maximum' + period + '.tif', gdalconst.GA_ReadOnly)
+    max_chartraster = max_chart.ReadAsArray()
+    max_chart = None
+    landmask = gdal.Open(landmask_raster , gdalconst.GA_ReadOnly)
+    landraster = landmask.ReadAsArray()
+    landmask = None
+    landpixels = (landraster >= 252) & (landraster <= 255)
+    
+    outfiles = []
+    for (outarray, name) in ((lower, 'lower'), (upper, 'upper')):
+        outarray = outarray.reshape((rows, cols))
+        outarray = numpy.where(max_chartraster == 1, outarray, 0)
+        outarray[holepixels.reshape((rows, cols))] = 251
+        outarray[landpixels] = landraster[landpixels]
+        outfile = inpath + 'icechart_seaicefrequency' + name + period + '.tif'
+        WriteNSIDCArray(outarray, outfile)
+        EPSG3411_2_EPSG3575(outfile)
+        outfiles.append(outfile)
+    
+    return outfiles
+    
+def SeasonDates(year, startmonth = 9):
+    '''
+    Returns the list of days of the ice season starting on the first of
+    startmonth in year and ending the day before one year later
+    '''
+    
+    d3 = datetime.date(year, startmonth, 1)
+    d2 = datetime.date(year + 1, startmonth, 1)
+    datelist = []
+    while d3 != d2:
+        datelist.append(d3)
+        d3 = d3 + datetime.timedelta(days=1)
+    return datelist
+    
+def IceSeasonMetrics(cubefile, oceanpixels = None):
+    '''
+    Calculates for each pixel from a cube holding one ice season
+    * firsticeday -- first day with ice, as day of the season starting with 1
+    * lasticeday -- last day with ice
+    * seasonlength -- days from first to last ice day inclusive
+    * icefreegaps -- number of ice free periods between first and last ice day
+    * holepixels -- True where the pixel is in the polar hole at least one day
+    
+    Ice is a value larger than 38 = 15.2%, the polar hole counts as ice. 
+    Pixels without ice are 0 in all maps. All values follow from argmax on 
+    the boolean ice cube along the time axis, days missing in the cube 
+    are skipped. If oceanpixels (see OceanPixels) is given, only these
+    pixels are held in memory as (days, pixels) and the maps are scattered
+    back to the full grid
+    '''
+    
+    cube, dates, valid = OpenCube(cubefile)
+    daylist = numpy.flatnonzero(valid)
+    shape = cube.shape[1:]
+    if oceanpixels is None:
+        oceanpixels = numpy.arange(shape[0] * shape[1])
+    values = numpy.empty((len(daylist), len(oceanpixels)), numpy.uint8)
+    for (i, day) in enumerate(daylist):
+        numpy.take(cube[day].ravel(), oceanpixels, out = values[i])
+    cube = None
+    
+    ice = (values >= 38) & (values <= 251)
+    holepixels = (values == 251).any(axis = 0)
+    values = None
+    
+    NumberOfDays = len(daylist)
+    anyice = ice.any(axis = 0)
+    first = ice.argmax(axis = 0)
+    last = NumberOfDays - 1 - ice[::-1].argmax(axis = 0)
+    
+    # an ice free period starts where ice is followed by no ice, it counts
+    # as gap if it starts before the last ice day
+    gapstart = ice[:-1] & ~ice[1:]
+    gapstart &= numpy.arange(NumberOfDays - 1)[:, numpy.newaxis] < last
+    
+    dayofseason = daylist + 1
+    metrics = {}
+    metrics['firsticeday'] = ScatterPixels(numpy.where(anyice, dayofseason[first], 0), oceanpixels, shape)
+    metrics['lasticeday'] = ScatterPixels(numpy.where(anyice, dayofseason[last], 0), oceanpixels, shape)
+    metrics['seasonlength'] = ScatterPixels(numpy.where(anyice, dayofseason[last] - dayofseason[first] + 1, 0), oceanpixels, shape)
+    metrics['icefreegaps'] = ScatterPixels(gapstart.sum(axis = 0), oceanpixels, shape)
+    metrics['holepixels'] = ScatterPixels(holepixels, oceanpixels, shape, False)
+    return metrics
+    
+def CreateIceSeasonMaps(inpath, cubefile, landmask_raster, season):
+    '''
+    Creates first ice day, last ice day, season length and ice free gap maps
+    from a cube holding one ice season, see IceSeasonMetrics. season is the
+    label used in the file names, e.g. 2014_2015.
+    
+    As in the other maps the polar hole is set to 251 and land values 
+    252-255 are burnt in. Note that days of the season can reach 366, 
+    so 251-255 are only land codes where the landmask has them.
+    Output is available both as EPSG:3411 and EPSG:3575 
+    '''
+    
+    metrics = IceSeasonMetrics(cubefile, OceanPixels(landmask_raster))
+    
+    landmask = gdal.Open(landmask_raster , gdalconst.GA_ReadOnly)
+    landraster = landmask.ReadAsArray()
+    landmask = None
+    landpixels = (landraster >= 251) & (landraster <= 255)
+    
+    outfiles = []
+    for name in ['firsticeday', 'lasticeday', 'seasonlength', 'icefreegaps']:
+        outarray = metrics[name].astype(numpy.float)
+        outarray[metrics['holepixels']] = 251
+        outarray[landpixels] = landraster[landpixels]
+        outfile = inpath + 'icechart_' + name + season + '.tif'
+        WriteNSIDCArray(outarray, outfile)
+        EPSG3411_2_EPSG3575(outfile)
+        outfiles.append(outfile)
+    
+    return outfiles
+    
+def PrepareCube(startyear, stopyear, month, nsidcpath, outfilepath, landmask_raster, \
+                coastalerrormask_raster, interpolated1988path = None, product = 'nsidc0051_north'):
+    '''
+    Decodes all NSIDC files for the given month between startyear and stopyear
+    inclusive into one cube in outfilepath, replaces missing days and filters
+    coastal areas. Returns the filtered cube file
+    '''
+    
+    return PrepareDateCube(MonthDates(startyear, stopyear, month), nsidcpath, outfilepath, \
+                landmask_raster, coastalerrormask_raster, interpolated1988path, product)
+    
+def PrepareDateCube(datelist, nsidcpath, outfilepath, landmask_raster, \
+                    coastalerrormask_raster, interpolated1988path = None, product = 'nsidc0051_north'):
+    '''
+    As PrepareCube for any list of days, e.g. one ice season
+    product is one of NSIDCProducts, the masks have to be on its grid
+    '''
+    
+    #Decode all NSIDC files into one memory-mapped cube, all following steps read from this cube
+    cubefile = outfilepath + 'NSIDC_cube.npy'
+    Bin2Cube(datelist, nsidcpath, cubefile, product)
         
-        ########################
-        # COASTAL ERROR FOR BALTIC
-        ########################
-        dayrange = 2
-        #Reset coastalicemaskraster to zero
-        coastalicemaskraster = numpy.zeros((rows, cols), numpy.float) 
-        #Loop through the files around present day and determine how many days there is ice in coastal zone    
-        for i in range(-dayrange, dayrange +1):
-            diff = datetime.timedelta(days=i)
-            diffdate = presentdate + diff
-            checkfilename = outfilepath + "nt_" + diffdate.strftime('%Y%m%d') +  str(os.path.split(infile)[1])[11:]
-            
-            if os.path.isfile(checkfilename):
-                checkfile = gdal.Open(checkfilename, gdalconst.GA_ReadOnly)
-                #Read input raster into array
-                checkfileraster = checkfile.ReadAsArray()
-                
-                coastalicemaskraster = numpy.where( (coastalerrormaskarray == 2) & (checkfileraster >= 38), coastalicemaskraster + 1 , coastalicemaskraster )
-            else:
-                #If previous day files do not exist, take present day one -- otherwise it does not add up with number of Days                
-                
-                coastalicemaskraster = numpy.where( (coastalerrormaskarray == 2) & (presentdayraster >= 38), coastalicemaskraster + 1 , coastalicemaskraster )
-                
-                
+    # Fix January 1988
+    # 1-12 January 1988 data is missing
+    # Manually interpolated data is copied (linear interpolated between 31/12 and 13/1)
+    # If other unterpolation wanted, just replace all data in folder
+    # Files of days not in the cube are ignored by GeoTiff2Cube
+    if (datetime.date(1988, 1, 1) in datelist) and (interpolated1988path is not None):
+        list1988 = glob.glob(interpolated1988path + "nt*.tif")
+        GeoTiff2Cube(list1988, cubefile)
+    
+    # Add missing days
+    for (year, month) in sorted(set((date.year, date.month) for date in datelist)):
+        AddMissingDays(year,month, cubefile)
+    
+    #Filter erroneous pixels at coast line, written to a new cube
+    filteredcubefile = outfilepath + 'NSIDC_cube_filtered.npy'
+    FilterCoastalAreas(cubefile, filteredcubefile, landmask_raster, coastalerrormask_raster)
+    
+    return filteredcubefile
+    
+def StageUpToDate(stage):
+    '''
+    True if all outputs of the stage exist and none is older than its newest input
+    '''
+    
+    for outfile in stage['outputs']:
+        if not os.path.exists(outfile):
+            return False
+    inputs = [infile for infile in stage['inputs'] if os.path.exists(infile)]
+    if inputs == []:
+        return True
+    return max(os.path.getmtime(infile) for infile in inputs) <= \
+           min(os.path.getmtime(outfile) for outfile in stage['outputs'])
+    
+def RunStageInThread(stage, finished):
+    '''
+    Runs one stage in a thread of RunStages and reports name and exception
+    info (type, value, traceback), None if successful, to the queue finished
+    '''
+    
+    try:
+        stage['function'](*stage['args'])
+        finished.put((stage['name'], None))
+    except Exception:
+        finished.put((stage['name'], sys.exc_info()))
+    
+def RunStages(stages, threads = 2):
+    '''
+    Runs a list of stages, each a dictionary with
+    * name -- unique name of the stage
+    * function, args -- called as function(*args)
+    * inputs -- files read by the stage
+    * outputs -- files written by the stage
+    
+    A stage depends on the stages writing its inputs and is started once
+    these are done, independent stages run at the same time in a pool of
+    threads (processes are not possible, since ProcessMonths already runs
+    each month in a process of a pool). A stage is skipped if its outputs
+    are newer than its inputs and none of the stages it depends on was run.
+    Returns the names of the stages which were run
+    '''
+    
+    producer = {}
+    for stage in stages:
+        for outfile in stage['outputs']:
+            producer[outfile] = stage['name']
+    dependencies = {}
+    for stage in stages:
+        dependencies[stage['name']] = set(producer[infile] for infile in stage['inputs'] \
+                        if (infile in producer) and (producer[infile] != stage['name']))
+    
+    pool = multiprocessing.pool.ThreadPool(threads)
+    finished = Queue.Queue()
+    waiting = list(stages)
+    running = set()
+    done = set()
+    rerun = set()
+    
+    while waiting or running:
+        # start or skip all stages whose dependencies are done, scanning
+        # again as long as a stage was started or skipped, since a skipped
+        # stage may be the last dependency of a stage listed before it
+        changed = True
+        while changed:
+            changed = False
+            for stage in list(waiting):
+                if not (dependencies[stage['name']] <= done):
+                    continue
+                waiting.remove(stage)
+                changed = True
+                if (dependencies[stage['name']] & rerun) or not StageUpToDate(stage):
+                    print 'Run stage ', stage['name']
+                    running.add(stage['name'])
+                    rerun.add(stage['name'])
+                    pool.apply_async(RunStageInThread, (stage, finished))
+                else:
+                    print 'Skip stage ', stage['name'], ', outputs up to date'
+                    done.add(stage['name'])
         
-
-        # coastalicemaskraster < 5 or rather a value of 4 should be considered in future checks
-        presentdayraster = numpy.where( (coastalerrormaskarray == 2) & (coastalicemaskraster < 5 ), 0, presentdayraster)
-                
-        # outarray contains filtered values -- burn in landmask
-        landmask = gdal.Open(landmask_raster, gdalconst.GA_ReadOnly)
-        landraster = landmask.ReadAsArray()
-        presentdayraster = numpy.where( (landraster == 251), 251, presentdayraster)
-        presentdayraster = numpy.where( (landraster == 252), 252, presentdayraster)
-        presentdayraster = numpy.where( (landraster == 253), 253, presentdayraster)
-        presentdayraster = numpy.where( (landraster == 254), 254, presentdayraster)
-        presentdayraster = numpy.where( (landraster == 255), 255, presentdayraster)        
+        if not running:
+            if waiting:
+                raise ValueError('Cyclic dependencies between stages ' + str([stage['name'] for stage in waiting]))
+            break
         
-        presentdayfileband = presentdayfile.GetRasterBand(1)
-            
-        presentdayfileband.WriteArray(presentdayraster)
-        presentdayfileband.FlushCache()
+        name, error = finished.get()
+        running.remove(name)
+        if error is not None:
+            pool.close()
+            pool.join()
+            # raised with the traceback of the failing stage
+            raise error[0], error[1], error[2]
+        done.add(name)
+    
+    pool.close()
+    pool.join()
+    return sorted(rerun)
+    
+def CreateClimatology(filteredcubefile, outfilepath, landmask_raster, coastalerrormask_raster):
+    '''
+    Stage of ProcessMonth: per year and combined counts (accumulator_climatology.npz)
+    '''
     
-     
-##############################################################################
-
-###   Core of Program follows here ###
-
-##############################################################################
-
+    accumulator = CreateYearAccumulators(filteredcubefile, outfilepath, \
+                        OceanPixels(landmask_raster, coastalerrormask_raster))
+    if accumulator is None:
+        raise ValueError('No days with data in ' + filteredcubefile + ', no climatology in ' + outfilepath)
+    SaveAccumulator(accumulator, outfilepath + 'accumulator_climatology.npz')
+    
+def LoadStageAccumulator(accumulatorfile, period = None):
+    '''
+    Loads the counts for a stage of ProcessMonth. If period is given, it
+    replaces the period of the counts in all file names, such that the 
+    outputs are named as declared also if the first or last year has no data
+    '''
+    
+    accumulator = LoadAccumulator(accumulatorfile)
+    if period is not None:
+        accumulator['period'] = period
+    return accumulator
+    
+def CreateMaxMinIceFromFile(inpath, accumulatorfile, landmask_raster, coastalerrormask_raster, \
+                            oceanmask_buffer5, NSIDC_balticmask, period = None):
+    '''
+    Stage of ProcessMonth: max / min GeoTIFFs of CreateMaxMinIce from saved
+    counts, the shapefiles are the stage CreateMaxMinShapefiles
+    '''
+    
+    return CreateMaxMinIce(inpath, LoadStageAccumulator(accumulatorfile, period), landmask_raster, \
+                  coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask, False)
+    
+def CreateSeaIceFrequencyMapFromFile(inpath, accumulatorfile, landmask_raster, period = None):
+    '''
+    Stage of ProcessMonth: CreateSeaIceFrequencyMap from saved counts, using
+    the maximum and minimum map of CreateMaxMinIce
+    '''
+    
+    accumulator = LoadStageAccumulator(accumulatorfile, period)
+    max_ice = inpath + 'icechart_maximum' + accumulator['period'] + '.tif'
+    min_ice = inpath + 'icechart_minimum' + accumulator['period'] + '.tif'
+    return CreateSeaIceFrequencyMap(inpath, accumulator, max_ice, min_ice, landmask_raster)
+    
+def CreateHistogram(filteredcubefile, histogramfile, landmask_raster, coastalerrormask_raster):
+    '''
+    Stage of ProcessMonth: concentration histogram of the cube saved to histogramfile
+    '''
+    
+    oceanpixels = OceanPixels(landmask_raster, coastalerrormask_raster)
+    SaveHistogram(ConcentrationHistogram(filteredcubefile, oceanpixels = oceanpixels), histogramfile)
+    
+def CreateThresholdMapsFromFile(inpath, histogramfile, thresholds, landmask_raster, \
+                                coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask, period = None):
+    '''
+    Stage of ProcessMonth: CreateThresholdMaps from a saved histogram, 
+    period as in LoadStageAccumulator
+    '''
+    
+    histogram = LoadHistogram(histogramfile)
+    if period is not None:
+        histogram['period'] = period
+    return CreateThresholdMaps(inpath, histogram, thresholds, landmask_raster, \
+                  coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask)
+    
+def WriteParameterStamp(stampfile, parameters):
+    '''
+    Writes the run parameters (dictionary) to stampfile, used as input of 
+    the first stage of ProcessMonth. The file is only written if the 
+    parameters differ from those in it, so its time changes only then and 
+    all stages are run again for other parameters
+    '''
+    
+    stamp = ''.join(str(key) + ' = ' + str(parameters[key]) + '\n' for key in sorted(parameters))
+    if os.path.exists(stampfile):
+        stampfileobject = open(stampfile, 'r')
+        oldstamp = stampfileobject.read()
+        stampfileobject.close()
+        if oldstamp == stamp:
+            return stampfile
+    stampfileobject = open(stampfile, 'w')
+    stampfileobject.write(stamp)
+    stampfileobject.close()
+    return stampfile
+    
+def ProcessMonth(startyear, stopyear, month, destinationpath, nsidcpath, landmask_raster, \
+                 coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask, \
+                 overwrite = False, interpolated1988path = None, thresholds = None, threads = 2, \
+                 product = 'nsidc0051_north'):
+    '''
+    Runs the complete processing for one month between startyear and stopyear:
+    conversion to cube, AddMissingDays, FilterCoastalAreas, max/min maps and
+    sea ice frequency map. Results are stored in destinationpath in a folder
+    named after the month.
+    
+    The steps are stages of RunStages with their input and output files, 
+    independent stages run in threads parallel, e.g. the shapefiles of the 
+    max / min maps and the frequency map. There is no question before 
+    overwriting: if the folder of the month exists, it is deleted and 
+    recreated if overwrite is True, otherwise only stages with outputs 
+    missing or older than their inputs are run again. The run parameters 
+    (period, product, input paths) are kept in parameters.txt, input of 
+    the cube stage, so a run with other parameters redoes all stages.
+    
+    interpolated1988path is the folder with the manually interpolated
+    GeoTIFFs for 1-12 January 1988, only used for January
+    
+    thresholds is a list of further ice limits (NSIDC units, e.g. [75, 125]
+    for 30% and 50%), for which maps are created from the concentration
+    histogram, see CreateThresholdMaps
+    
+    product is one of NSIDCProducts, the masks have to be on its grid
+    '''
+    
+    monthDict={1:'January', 2:'February', 3:'March', 4:'April', 5:'May', 6:'June', 7:'July', 8:'August', 9:'September', 10:'October', 11:'November', 12:'December'}
+    outfilepath = destinationpath + monthDict[month] + '//'
+    
+    if os.path.exists(outfilepath) and overwrite:
+        print "Overwriting " + outfilepath        
+        shutil.rmtree(outfilepath)
+    if not os.path.exists(outfilepath):
+        os.makedirs(outfilepath)
+    
+    # File names of all stages, the outputs are named by the period asked for
+    period = AccumulatorPeriod([startyear * 100 + month, stopyear * 100 + month])
+    stampfile = WriteParameterStamp(outfilepath + 'parameters.txt', {'startyear': startyear, 'stopyear': stopyear, \
+                    'month': month, 'product': product, 'nsidcpath': nsidcpath, 'interpolated1988path': interpolated1988path})
+    filteredcubefile = outfilepath + 'NSIDC_cube_filtered.npy'
+    climatologyfile = outfilepath + 'accumulator_climatology.npz'
+    histogramfile = outfilepath + 'histogram_climatology.npz'
+    max_ice = outfilepath + 'icechart_maximum' + period + '.tif'
+    min_ice = outfilepath + 'icechart_minimum' + period + '.tif'
+    frequencyfile = outfilepath + 'icechart_seaicefrequencymap' + period + '.tif'
+    masks = [landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask]
+    
+    stages = []
+    
+    #Decode, fill in missing days and filter coastal areas
+    stages.append({'name': 'cube', 'function': PrepareCube, 
+                   'args': (startyear, stopyear, month, nsidcpath, outfilepath, landmask_raster, coastalerrormask_raster, interpolated1988path, product), 
+                   'inputs': [stampfile, landmask_raster, coastalerrormask_raster], 'outputs': [filteredcubefile]})
+    
+    #Count ice days in one pass through the cube, used for all maps below
+    #the counts are saved for each year, such that years can be added and removed later
+    stages.append({'name': 'counts', 'function': CreateClimatology, 
+                   'args': (filteredcubefile, outfilepath, landmask_raster, coastalerrormask_raster), 
+                   'inputs': [filteredcubefile, landmask_raster, coastalerrormask_raster], 'outputs': [climatologyfile]})
+    
+    #Create maximum and minimum extent map
+    #Max / Min must be done before sea ice frequency , since the latter is filtered with max-map
+    stages.append({'name': 'maxmin', 'function': CreateMaxMinIceFromFile, 
+                   'args': (outfilepath, climatologyfile, landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask, period), 
+                   'inputs': [climatologyfile] + masks, 
+                   'outputs': [max_ice, min_ice, outfilepath + 'icechart_NumberOfDays' + period + '.tif']})
+    
+    #Polygons and ice edge lines of max / min, parallel to the frequency map
+    stages.append({'name': 'shapefiles', 'function': CreateMaxMinShapefiles, 
+                   'args': (outfilepath, period, oceanmask_buffer5), 
+                   'inputs': [max_ice, min_ice, oceanmask_buffer5], 
+                   'outputs': [outfilepath + 'icechart_poly_maximum' + period + '.shp', outfilepath + 'icechart_poly_minimum' + period + '.shp', 
+                               outfilepath + 'icechart_line_maximum' + period + '.shp', outfilepath + 'icechart_line_minimum' + period + '.shp']})
+    
+    #Create the isfrekvens / ice frequency / ice persistence map
+    stages.append({'name': 'frequency', 'function': CreateSeaIceFrequencyMapFromFile, 
+                   'args': (outfilepath, climatologyfile, landmask_raster, period), 
+                   'inputs': [climatologyfile, max_ice, min_ice, landmask_raster], 'outputs': [frequencyfile]})
+    
+    #Isolines 10%, 20%, ... 90% of the frequency map
+    stages.append({'name': 'isolines', 'function': CreateFrequencyIsolines, 'args': (frequencyfile, oceanmask_buffer5), 
+                   'inputs': [frequencyfile, oceanmask_buffer5], 
+                   'outputs': [outfilepath + 'icechart_isolines' + period + '.shp']})
+    
+    #Maps for other ice limits from the concentration histogram, parallel to the above
+    if thresholds:
+        stages.append({'name': 'histogram', 'function': CreateHistogram, 
+                       'args': (filteredcubefile, histogramfile, landmask_raster, coastalerrormask_raster), 
+                       'inputs': [filteredcubefile, landmask_raster, coastalerrormask_raster], 'outputs': [histogramfile]})
+        stages.append({'name': 'thresholds', 'function': CreateThresholdMapsFromFile, 
+                       'args': (outfilepath, histogramfile, thresholds, landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask, period), 
+                       'inputs': [histogramfile] + masks, 
+                       'outputs': [outfilepath + 'threshold' + str(int(round(threshold / 2.5))) + '//icechart_seaicefrequencymap' + period + '.tif' \
+                                   for threshold in thresholds]})
+    
+    RunStages(stages, threads)
+    
+    print "Done creating Ice Persistance Map for " + monthDict[month]
+    return outfilepath
+    
+def UpdateMonth(startyear, stopyear, month, destinationpath, nsidcpath, landmask_raster, \
+                coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask, \
+                interpolated1988path = None, product = 'nsidc0051_north'):
+    '''
+    Moves the climatology of a month created with ProcessMonth to the period
+    startyear - stopyear, e.g. from 1986-2015 to 1987-2016.
+    
+    Years outside the new period are removed from accumulator_climatology.npz
+    and new years are added, both using the per year accumulator files. Only 
+    years without accumulator file are read from the NSIDC archive, years
+    without NSIDC files are skipped. The maps are then created from the 
+    updated counts.
+    '''
+    
+    monthDict={1:'January', 2:'February', 3:'March', 4:'April', 5:'May', 6:'June', 7:'July', 8:'August', 9:'September', 10:'October', 11:'November', 12:'December'}
+    outfilepath = destinationpath + monthDict[month] + '//'
+    
+    climatologyfile = outfilepath + 'accumulator_climatology.npz'
+    accumulator = LoadAccumulator(climatologyfile)
+    
+    presentyears = set(yearmonth // 100 for yearmonth in accumulator['months'])
+    wantedyears = set(range(startyear, stopyear + 1))
+    
+    # Drop years no longer in the period
+    for year in sorted(presentyears - wantedyears):
+        print 'Remove ', year, ' from ', monthDict[month]
+        yearaccumulator = LoadAccumulator(outfilepath + 'accumulator_' + str(year * 100 + month) + '.npz')
+        accumulator = AddAccumulator(accumulator, yearaccumulator, -1)
+    
+    # Add new years, counting those not yet done from the NSIDC archive
+    for year in sorted(wantedyears - presentyears):
+        print 'Add ', year, ' to ', monthDict[month]
+        yearfile = outfilepath + 'accumulator_' + str(year * 100 + month) + '.npz'
+        if not os.path.exists(yearfile):
+            yearpath = outfilepath + str(year) + '//'
+            if not os.path.exists(yearpath):
+                os.makedirs(yearpath)
+            filteredcubefile = PrepareCube(year, year, month, nsidcpath, yearpath, \
+                  landmask_raster, coastalerrormask_raster, interpolated1988path, product)
+            cube, dates, valid = OpenCube(filteredcubefile)
+            cube = None
+            if not valid.any():
+                print 'No NSIDC files for ', year, ' in ', nsidcpath, ', year skipped'
+                shutil.rmtree(yearpath)
+                continue
+            SaveAccumulator(ReduceIceStack(filteredcubefile, None, \
+                  OceanPixels(landmask_raster, coastalerrormask_raster)), yearfile)
+            shutil.rmtree(yearpath)
+        accumulator = AddAccumulator(accumulator, LoadAccumulator(yearfile))
+    
+    SaveAccumulator(accumulator, climatologyfile)
+    
+    max_ice, min_ice = CreateMaxMinIce(outfilepath, accumulator, landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask )
+    frequencyfile = CreateSeaIceFrequencyMap(outfilepath, accumulator, max_ice, min_ice, landmask_raster)
+    CreateFrequencyIsolines(frequencyfile, oceanmask_buffer5)
+    
+    return outfilepath
+    
+def ProcessMonths(startyear, stopyear, months, destinationpath, nsidcpath, landmask_raster, \
+                  coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask, \
+                  overwrite = False, interpolated1988path = None, processes = None, thresholds = None, \
+                  product = 'nsidc0051_north'):
+    '''
+    Runs ProcessMonth for all given months in a pool of processes, each month
+    in its own folder, with the stages of a month in threads parallel. processes is the number of months processed at the 
+    same time, default is the number of cores.
+    Returns the list of output folders
+    '''
+    
+    pool = multiprocessing.Pool(processes)
+    results = []
+    for month in months:
+        results.append(pool.apply_async(ProcessMonth, (startyear, stopyear, month, \
+                        destinationpath, nsidcpath, landmask_raster, coastalerrormask_raster, \
+                        oceanmask_buffer5, NSIDC_balticmask, overwrite, interpolated1988path, thresholds, 2, product)))
+    pool.close()
+    
+    # get() raises the exception of a failed month here
+    outfilepaths = [result.get() for result in results]
+    pool.join()
+    return outfilepaths
 
-#############################
-# SET PATH AND VARIABLES HERE
-#############################
+def ReadEmptyYears(emptyyearsfile):
+    '''
+    Returns the set of years listed in emptyyearsfile, one per line, empty
+    set if the file does not exist
+    '''
+    
+    if not os.path.exists(emptyyearsfile):
+        return set()
+    emptyyearsfileobject = open(emptyyearsfile, 'r')
+    emptyyears = set(int(line) for line in emptyyearsfileobject if line.strip() != '')
+    emptyyearsfileobject.close()
+    return emptyyears
 
-### Location of needed Raster Masks ###
-### these files are located on \\berner\SeaIceRemoteSensing\Isfrekvens\landmasks
-### the present paths below are mounted Ubuntu paths to this location
+def WriteEmptyYears(emptyyearsfile, emptyyears):
+    '''
+    Writes the years without data to emptyyearsfile, one per line
+    '''
+    
+    emptyyearsfileobject = open(emptyyearsfile, 'w')
+    for year in sorted(emptyyears):
+        emptyyearsfileobject.write(str(year) + '\n')
+    emptyyearsfileobject.close()
 
-landmask_raster = '//mnt//seaiceremotesensing//Isfrekvens//landmasks//NSIDC_landmask_raster.tif'
-coastalerrormask_raster = "//mnt//seaiceremotesensing//Isfrekvens//landmasks//NSIDC_coastalerrormask_raster.tif"
-oceanmask_buffer5 = '//mnt//seaiceremotesensing//Isfrekvens//landmasks//NSIDC_oceanmask_buffer5.shp'
-NSIDC_balticmask = '//mnt//seaiceremotesensing//Isfrekvens//landmasks//NSIDC_balticmask.tif'
+def ProcessRollingWindows(windows, month, destinationpath, nsidcpath, landmask_raster, \
+                          coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask, \
+                          interpolated1988path = None, product = 'nsidc0051_north'):
+    '''
+    Creates the maps of one month for several, possibly overlapping, periods
+    given as list of (startyear, stopyear), e.g. [(1979, 2008), (1981, 2010)].
 
+    The NSIDC archive is read only once for all years not yet counted, the
+    per year counts are turned into prefix sums (CreatePrefixSums) and the
+    counts of each period are one subtraction of these (WindowAccumulator).
+    Past years found without data are listed in accumulator_emptyyears.txt
+    and not read again in later runs, delete the file to read them again.
+    Results are stored in destinationpath//Month//startyear-stopyear//
+    Returns the list of output folders
+    '''
 
-#Get all files from given month
-#Set this to the startyear and stopyear for your 30-year period (e.g. 1986-2015)
-#Run once for each month 1-2
-startyear = 1986
-stopyear = 2015
-month = 1                          #Values 1 to 12
+    monthDict={1:'January', 2:'February', 3:'March', 4:'April', 5:'May', 6:'June', 7:'July', 8:'August', 9:'September', 10:'October', 11:'November', 12:'December'}
+    outfilepath = destinationpath + monthDict[month] + '//'
+    if not os.path.exists(outfilepath):
+        os.makedirs(outfilepath)
 
-# Set destinationpath where all results are supposed to be stored
-destinationpath = '//mnt//seaiceremotesensing//Isfrekvens//Isfrekvens1986-2015//'
+    firstyear = min(startyear for (startyear, stopyear) in windows)
+    lastyear = max(stopyear for (startyear, stopyear) in windows)
 
+    # Count the years without accumulator file and not known to be empty,
+    # one cube for each run of consecutive years
+    emptyyearsfile = outfilepath + 'accumulator_emptyyears.txt'
+    emptyyears = ReadEmptyYears(emptyyearsfile)
+    missingyears = [year for year in range(firstyear, lastyear + 1) if (year not in emptyyears) and \
+                    not os.path.exists(outfilepath + 'accumulator_' + str(year * 100 + month) + '.npz')]
+    yearruns = []
+    for year in missingyears:
+        if (yearruns != []) and (yearruns[-1][1] == year - 1):
+            yearruns[-1][1] = year
+        else:
+            yearruns.append([year, year])
+    for (runstartyear, runstopyear) in yearruns:
+        cubepath = outfilepath + 'cube//'
+        if not os.path.exists(cubepath):
+            os.makedirs(cubepath)
+        filteredcubefile = PrepareCube(runstartyear, runstopyear, month, nsidcpath, cubepath, \
+                  landmask_raster, coastalerrormask_raster, interpolated1988path, product)
+        CreateYearAccumulators(filteredcubefile, outfilepath, \
+                  OceanPixels(landmask_raster, coastalerrormask_raster))
+        shutil.rmtree(cubepath)
+    
+    # years still without counts have no data, the present month may still get some
+    today = datetime.date.today()
+    newemptyyears = [year for year in missingyears if ((year, month) < (today.year, today.month)) and \
+                     not os.path.exists(outfilepath + 'accumulator_' + str(year * 100 + month) + '.npz')]
+    if newemptyyears != []:
+        print 'No data for ', newemptyyears, ', recorded in ', emptyyearsfile
+        WriteEmptyYears(emptyyearsfile, emptyyears | set(newemptyyears))
 
-# Set path where NSIDC sea ice concentration is stored
-nsidcpath = '//mnt//seaiceremotesensing//SSMI//IceConcentration//NASATEAM//final-gsfc//north//daily//'
+    prefixsums = CreatePrefixSums(outfilepath, month, firstyear, lastyear)
 
-##############################
-# END OF VARIABLES TO BE SET
-##############################
+    windowpaths = []
+    for (startyear, stopyear) in windows:
+        print 'Create ', monthDict[month], ' ', startyear, ' - ', stopyear
+        windowpath = outfilepath + str(startyear) + '-' + str(stopyear) + '//'
+        if not os.path.exists(windowpath):
+            os.makedirs(windowpath)
+        accumulator = WindowAccumulator(prefixsums, startyear, stopyear)
+        max_ice, min_ice = CreateMaxMinIce(windowpath, accumulator, landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask )
+        frequencyfile = CreateSeaIceFrequencyMap(windowpath, accumulator, max_ice, min_ice, landmask_raster)
+        CreateFrequencyIsolines(frequencyfile, oceanmask_buffer5)
+        windowpaths.append(windowpath)
 
+    return windowpaths
 
+def ProcessRollingMonths(windows, months, destinationpath, nsidcpath, landmask_raster, \
+                         coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask, \
+                         interpolated1988path = None, processes = None, product = 'nsidc0051_north'):
+    '''
+    Runs ProcessRollingWindows for all given months in a pool of processes,
+    as ProcessMonths. Returns the list of output folders per month
+    '''
 
+    pool = multiprocessing.Pool(processes)
+    results = []
+    for month in months:
+        results.append(pool.apply_async(ProcessRollingWindows, (windows, month, \
+                        destinationpath, nsidcpath, landmask_raster, coastalerrormask_raster, \
+                        oceanmask_buffer5, NSIDC_balticmask, interpolated1988path, product)))
+    pool.close()
 
-### Set outfilepath where 
-monthDict={1:'January', 2:'February', 3:'March', 4:'April', 5:'May', 6:'June', 7:'July', 8:'August', 9:'September', 10:'October', 11:'November', 12:'December'}
-outfilepath = destinationpath + monthDict[month] + '//'
+    windowpaths = [result.get() for result in results]
+    pool.join()
+    return windowpaths
 
-if os.path.exists(outfilepath):
-    answer = raw_input(outfilepath + " exists, delete and overwrite folder? [Y]es?")
-    if answer.lower().startswith('y'):
-        print "Overwriting " + outfilepath        
-        shutil.rmtree(outfilepath)
-        os.makedirs(outfilepath)
-    else:
-        print "Ending program"
-        sys.exit()
-        
-elif not os.path.exists(outfilepath):
-    os.makedirs(outfilepath)
-    
-#Create filelist including all files for the given month between startyear and stopyear inclusive
-filelist = []
-for year in range(startyear, (stopyear + 1)):
-    foldername = nsidcpath + str(year) + '//'
-    if month < 10: 
-        file_searchstring = 'nt_' + str(year) + '0' + str(month) + '*.bin'
-    else:
-        file_searchstring = 'nt_' + str(year)  + str(month) + '*.bin'
+def ProcessSeason(year, destinationpath, nsidcpath, landmask_raster, coastalerrormask_raster, \
+                  startmonth = 9, interpolated1988path = None, product = 'nsidc0051_north'):
+    '''
+    Creates the ice season maps for the season starting on the first of
+    startmonth in year, stored in destinationpath//IceSeason//
+    '''
     
-    foldersearchstring = foldername + file_searchstring
-    filelist.extend(glob.glob(foldersearchstring))
-
-
-for icechart in filelist:
-    #Convert NSIDC files to GeoTiff
-    print'convert ', icechart
-    Bin2GeoTiff(icechart, outfilepath)
+    season = str(year) + '_' + str(year + 1)
+    outfilepath = destinationpath + 'IceSeason//'
+    cubepath = outfilepath + 'cube' + season + '//'
+    if not os.path.exists(cubepath):
+        os.makedirs(cubepath)
     
-# Fix January 1988
-# 1-12 January 1988 data is missing
-# Manually interpolated data is copied (linear interpolated between 31/12 and 13/1)
-# If other unterpolation wanted, just replace all data in folder
-if month == 1:
-    list1988 = glob.glob("//mnt//seaiceremotesensing//Isfrekvens//interpolatedJanuar1988//nt*.tif")
-    for file1988 in list1988:
-        shutil.copy(file1988, outfilepath)
-
-
-# Add missing days for 3411 as well as 3575 versions
-for year in range(startyear, (stopyear + 1)):
-    AddMissingDays(year,month, outfilepath)
-    AddMissingDays(year,month, outfilepath + "EPSG3575//")
+    filteredcubefile = PrepareDateCube(SeasonDates(year, startmonth), nsidcpath, cubepath, \
+                  landmask_raster, coastalerrormask_raster, interpolated1988path, product)
+    outfiles = CreateIceSeasonMaps(outfilepath, filteredcubefile, landmask_raster, season)
+    shutil.rmtree(cubepath)
+    
+    print "Done creating Ice Season Maps for " + season
+    return outfiles
 
-#Filter erroneous pixels at coast line
-FilterCoastalAreas(outfilepath, landmask_raster, coastalerrormask_raster)
+def ProcessSeasons(startyear, stopyear, destinationpath, nsidcpath, landmask_raster, \
+                   coastalerrormask_raster, startmonth = 9, interpolated1988path = None, processes = None, \
+                   product = 'nsidc0051_north'):
+    '''
+    Runs ProcessSeason for the seasons starting in startyear to stopyear
+    in a pool of processes, as ProcessMonths
+    '''
     
+    pool = multiprocessing.Pool(processes)
+    results = []
+    for year in range(startyear, stopyear + 1):
+        results.append(pool.apply_async(ProcessSeason, (year, destinationpath, nsidcpath, \
+                        landmask_raster, coastalerrormask_raster, startmonth, interpolated1988path, product)))
+    pool.close()
+    
+    outfiles = [result.get() for result in results]
+    pool.join()
+    return outfiles
 
-#Create maximum and minimum extent map
-#Max / Min must be done before sea ice frequency , since the latter is filtered with max-map
-max_ice, min_ice = CreateMaxMinIce(outfilepath, outfilepath, landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask )
+     
+##############################################################################
+
+###   Core of Program follows here ###
 
-#Create the isfrekvens / ice frequency / ice persistence map
-CreateSeaIceFrequencyMap(outfilepath, outfilepath, max_ice, min_ice, landmask_raster)
+##############################################################################
 
-print 24*'#'
-print "Done creating Ice Persistance Map"
-print 24*'#'
+if __name__ == '__main__':
+    
+    #############################
+    # SET PATH AND VARIABLES HERE
+    #############################
+    
+    ### Location of needed Raster Masks ###
+    ### these files are located on \\berner\SeaIceRemoteSensing\Isfrekvens\landmasks
+    ### the present paths below are mounted Ubuntu paths to this location
+    
+    landmask_raster = '//mnt//seaiceremotesensing//Isfrekvens//landmasks//NSIDC_landmask_raster.tif'
+    coastalerrormask_raster = "//mnt//seaiceremotesensing//Isfrekvens//landmasks//NSIDC_coastalerrormask_raster.tif"
+    oceanmask_buffer5 = '//mnt//seaiceremotesensing//Isfrekvens//landmasks//NSIDC_oceanmask_buffer5.shp'
+    NSIDC_balticmask = '//mnt//seaiceremotesensing//Isfrekvens//landmasks//NSIDC_balticmask.tif'
+    
+    
+    #Get all files from given months
+    #Set this to the startyear and stopyear for your 30-year period (e.g. 1986-2015)
+    startyear = 1986
+    stopyear = 2015
+    months = range(1, 13)              #Values 1 to 12, e.g. [1] for January only
+    
+    # Several periods at once, e.g. [(1979, 2008), (1981, 2010), (1986, 2015)]
+    # each stored in destinationpath//Month//startyear-stopyear//
+    # if empty, only startyear - stopyear is processed
+    windows = []
+    
+    # Further ice limits in NSIDC units (250 = 100%), must be edges of HistogramEdges
+    # e.g. [75, 125] for 30% and 50%, stored in Month//threshold30// etc.
+    thresholds = []
+    
+    # Also create first / last ice day, season length and gap maps for the
+    # ice seasons September startyear - August stopyear, in destinationpath//IceSeason//
+    iceseasons = False
+    
+    # Also create trend, p-value and anomaly maps from the per year counts,
+    # the anomaly is given for anomalyyear
+    trends = False
+    anomalyyear = stopyear
+    
+    # Number of bootstrap replicates for lower / upper 2.5% and 97.5% 
+    # percentile frequency maps, 0 for none
+    bootstrapreplicates = 0
+    
+    # Set destinationpath where all results are supposed to be stored
+    destinationpath = '//mnt//seaiceremotesensing//Isfrekvens//Isfrekvens1986-2015//'
+    
+    # Existing month folders are deleted and processed again if True, if False
+    # only the steps whose results are older than their input files are redone
+    overwrite = False
+    
+    # Number of months processed at the same time, None uses all cores
+    processes = None
+    
+    # Set path where NSIDC sea ice concentration is stored
+    nsidcpath = '//mnt//seaiceremotesensing//SSMI//IceConcentration//NASATEAM//final-gsfc//north//daily//'
+    
+    # Product in nsidcpath, one of NSIDCProducts, e.g. 'nsidc0081_north' for near real time
+    # the masks above have to be on the grid of the product
+    product = 'nsidc0051_north'
+    
+    # Manually interpolated files for 1-12 January 1988
+    interpolated1988path = '//mnt//seaiceremotesensing//Isfrekvens//interpolatedJanuar1988//'
+    
+    ##############################
+    # END OF VARIABLES TO BE SET
+    ##############################
+    
+    if not os.path.exists(destinationpath):
+        os.makedirs(destinationpath)
+    
+    if windows != []:
+        ProcessRollingMonths(windows, months, destinationpath, nsidcpath, landmask_raster, \
+                  coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask, \
+                  interpolated1988path, processes, product)
+    else:
+        ProcessMonths(startyear, stopyear, months, destinationpath, nsidcpath, landmask_raster, \
+                  coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask, \
+                  overwrite, interpolated1988path, processes, thresholds, product)
+    
+    if trends:
+        monthDict={1:'January', 2:'February', 3:'March', 4:'April', 5:'May', 6:'June', 7:'July', 8:'August', 9:'September', 10:'October', 11:'November', 12:'December'}
+        for month in months:
+            CreateTrendMaps(destinationpath + monthDict[month] + '//', month, startyear, stopyear, anomalyyear, landmask_raster)
+    
+    if bootstrapreplicates > 0:
+        monthDict={1:'January', 2:'February', 3:'March', 4:'April', 5:'May', 6:'June', 7:'July', 8:'August', 9:'September', 10:'October', 11:'November', 12:'December'}
+        for month in months:
+            # named after the period asked for, as the maps of ProcessMonth
+            CreateBootstrapMaps(destinationpath + monthDict[month] + '//', month, startyear, stopyear, \
+                  landmask_raster, bootstrapreplicates, \
+                  period = AccumulatorPeriod([startyear * 100 + month, stopyear * 100 + month]))
+    
+    if iceseasons:
+        ProcessSeasons(startyear, stopyear - 1, destinationpath, nsidcpath, landmask_raster, \
+                  coastalerrormask_raster, 9, interpolated1988path, processes, product)
+    
+    print 24*'#'
+    print "Done creating Ice Persistance Maps"
+    print 24*'#'
 
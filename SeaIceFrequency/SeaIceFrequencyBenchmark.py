@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the SeaIceFrequency processing chain on synthetic data
+
+Creates synthetic NSIDC charts (flat binary, 300 byte header, 448 x 304,
+land and polar hole coded 251-255) together with matching land, coastal
+error and Baltic mask rasters and the ocean mask shapefile. Each stage of
+SeaIceFrequency.py is then timed separately in its own process:
+
+* Bin2GeoTiff -- converting the binary charts to GeoTIFF (old daily files)
+* Bin2Cube -- decoding the binary charts into the cube
+* AddMissingDays
+* FilterCoastalAreas
+* ReduceIceStack
+* CreateMaxMinIce
+* CreateSeaIceFrequencyMap
+
+For each number of years the throughput in days per second and the peak
+memory added by the stage process (above the resident memory of the 
+benchmark at fork time) are printed and written to benchmark.csv
+"""
+
+import numpy, gdal, ogr, os, shutil, datetime, time, resource, tempfile
+import multiprocessing
+import SeaIceFrequency
+
+
+def CreateSyntheticMasks(workpath):
+    '''
+    Creates the land mask, coastal error mask and Baltic mask rasters and
+    the ocean mask shapefile (buffered by -5000m) on the NSIDC grid
+    Returns the landraster array and the four file names
+    '''
+
+    rows = 448
+    cols = 304
+
+    # Distance in pixels from the North Pole, which is at x = 154, y = 234
+    y, x = numpy.mgrid[0:rows, 0:cols]
+    poledistance = numpy.hypot(x - 154, y - 234)
+
+    # Land all around the grid border and one island, coast (253) one pixel
+    # around the land, a lake (252) and a missing data block (255)
+    landraster = numpy.zeros((rows, cols), numpy.uint8)
+    land = (poledistance > 190) | ((abs(x - 120) < 12) & (abs(y - 190) < 8))
+    landraster[land] = 254
+    coast = ~land & (numpy.roll(land, 1, 0) | numpy.roll(land, -1, 0) | \
+                     numpy.roll(land, 1, 1) | numpy.roll(land, -1, 1))
+    landraster[coast] = 253
+    landraster[400:410, 20:30] = 252
+    landraster[0:10, 0:10] = 255
+
+    # Coastal error areas: 1 next to the coast, 2 Baltic, 3 never ice
+    ocean = landraster == 0
+    coastalerror = numpy.zeros((rows, cols), numpy.uint8)
+    nearcoast = ocean & (numpy.roll(coast, 1, 0) | numpy.roll(coast, -1, 0) | \
+                         numpy.roll(coast, 1, 1) | numpy.roll(coast, -1, 1))
+    coastalerror[nearcoast] = 1
+    baltic = ocean & (abs(x - 230) < 10) & (abs(y - 330) < 15)
+    coastalerror[baltic] = 2
+    coastalerror[ocean & (poledistance > 170) & (y > 300) & (x < 100)] = 3
+
+    landmask_raster = workpath + 'NSIDC_landmask_raster.tif'
+    coastalerrormask_raster = workpath + 'NSIDC_coastalerrormask_raster.tif'
+    NSIDC_balticmask = workpath + 'NSIDC_balticmask.tif'
+    oceanmask_buffer5 = workpath + 'NSIDC_oceanmask_buffer5.shp'
+
+    for (outarray, outfile) in ((landraster, landmask_raster), (coastalerror, coastalerrormask_raster), \
+                                (baltic.astype(numpy.uint8), NSIDC_balticmask)):
+        outraster = SeaIceFrequency.CreateNSIDCGeoTiff(outfile, gdal.GDT_Byte)
+        outraster.GetRasterBand(1).WriteArray(outarray)
+        outraster = None
+
+    # Ocean mask: polygonize the ocean, dissolve and buffer -5000m
+    memraster = SeaIceFrequency.CreateNSIDCGeoTiff('', gdal.GDT_Byte, "MEM")
+    memraster.GetRasterBand(1).WriteArray(ocean.astype(numpy.uint8))
+    polygons = SeaIceFrequency.PolygonizeIceMap(memraster.GetRasterBand(1), None, None)
+    memraster = None
+    oceanpolygon = ogr.Geometry(ogr.wkbMultiPolygon)
+    for polygon in polygons:
+        oceanpolygon = oceanpolygon.Union(polygon)
+    oceanpolygon = oceanpolygon.Buffer(-5000)
+
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    memorysource = SeaIceFrequency.CreateMemoryLayer([oceanpolygon], ogr.wkbMultiPolygon)
+    outsource = driver.CopyDataSource(memorysource, oceanmask_buffer5)
+    outsource = None
+    memorysource = None
+
+    return landraster, landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask
+
+def CreateSyntheticCharts(nsidcpath, landraster, startyear, stopyear, month, missingfraction = 0.01):
+    '''
+    Writes synthetic NSIDC charts nt_YYYYMMDD_f13_v01_n.bin for all days of
+    the given month into one folder per year in nsidcpath.
+
+    Ice concentration falls off from an ice edge around the pole, which moves
+    from day to day, with random noise. The polar hole (251) shrinks over the
+    years as in the real data. A fraction of days is left out, such that
+    AddMissingDays has work to do. Returns the number of files written
+    '''
+
+    rows = 448
+    cols = 304
+    y, x = numpy.mgrid[0:rows, 0:cols]
+    poledistance = numpy.hypot(x - 154, y - 234)
+    angle = numpy.arctan2(y - 234, x - 154)
+    land = landraster >= 251
+
+    randomstate = numpy.random.RandomState(month)
+    header = '\0' * 300
+    NumberOfFiles = 0
+
+    for date in SeaIceFrequency.MonthDates(startyear, stopyear, month):
+        yearpath = nsidcpath + str(date.year) + '//'
+        if not os.path.exists(yearpath):
+            os.makedirs(yearpath)
+        if randomstate.rand() < missingfraction:
+            continue
+
+        # ice edge radius varying with season, direction and noise
+        iceedge = 120 + 30 * numpy.cos(2 * numpy.pi * (date.timetuple().tm_yday / 365.0)) \
+                  + 10 * numpy.sin(3 * angle + date.toordinal() / 10.0)
+        concentration = numpy.clip((iceedge - poledistance) * 10.0 + randomstate.normal(0, 15, (rows, cols)), 0, 250)
+        chart = concentration.astype(numpy.uint8)
+
+        polarhole = 12 if date.year < 1988 else (8 if date.year < 2008 else 4)
+        chart[poledistance < polarhole] = 251
+        chart[land] = landraster[land]
+
+        binfile = open(yearpath + 'nt_' + date.strftime('%Y%m%d') + '_f13_v01_n.bin', 'wb')
+        binfile.write(header)
+        binfile.write(chart.tostring())
+        binfile.close()
+        NumberOfFiles = NumberOfFiles + 1
+
+    return NumberOfFiles
+
+def RunStage(resultqueue, function, arguments):
+    '''
+    Runs one stage, called in a separate process, and puts run time and
+    peak memory (MB) of the stage into resultqueue
+    
+    The forked process starts with the resident memory of the parent in
+    ru_maxrss, so the peak memory is the increase of ru_maxrss during the
+    stage, i.e. the memory the stage needs beyond the parent's at fork time
+    '''
+
+    # ru_maxrss is in kilobytes on Linux
+    startmemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    starttime = time.time()
+    function(*arguments)
+    runtime = time.time() - starttime
+    peakmemory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - startmemory) / 1024.0
+    resultqueue.put((runtime, peakmemory))
+
+def TimeStage(function, arguments):
+    '''
+    Runs function(*arguments) in a fresh process, such that the peak memory
+    belongs to this stage only. Returns run time (s) and peak memory (MB)
+    added by the stage, see RunStage
+    '''
+
+    resultqueue = multiprocessing.Queue()
+    process = multiprocessing.Process(target = RunStage, args = (resultqueue, function, arguments))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(function.__name__ + ' failed with exit code ' + str(process.exitcode))
+    return resultqueue.get()
+
+def ConvertAllBin2GeoTiff(nsidcpath, outfilepath, startyear, stopyear, month):
+    '''
+    The old conversion, one GeoTIFF (and its EPSG:3575 copy) per day
+    '''
+
+    for date in SeaIceFrequency.MonthDates(startyear, stopyear, month):
+        for binfile in SeaIceFrequency.glob.glob(nsidcpath + str(date.year) + '//nt_' + date.strftime('%Y%m%d') + '*.bin'):
+            SeaIceFrequency.Bin2GeoTiff(binfile, outfilepath)
+
+def AddAllMissingDays(startyear, stopyear, month, cubefile):
+    '''
+    AddMissingDays for all years, as done in PrepareCube
+    '''
+
+    for year in range(startyear, stopyear + 1):
+        SeaIceFrequency.AddMissingDays(year, month, cubefile)
+
+def ReduceAndSave(cubefile, accumulatorfile):
+    '''
+    ReduceIceStack, saving the counts for the following stages
+    '''
+
+    SeaIceFrequency.SaveAccumulator(SeaIceFrequency.ReduceIceStack(cubefile), accumulatorfile)
+
+def MaxMinFromFile(outfilepath, accumulatorfile, landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask):
+    '''
+    CreateMaxMinIce from saved counts
+    '''
+
+    accumulator = SeaIceFrequency.LoadAccumulator(accumulatorfile)
+    SeaIceFrequency.CreateMaxMinIce(outfilepath, accumulator, landmask_raster, \
+                        coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask)
+
+def FrequencyFromFile(outfilepath, accumulatorfile, landmask_raster):
+    '''
+    CreateSeaIceFrequencyMap from saved counts, using the maximum map of MaxMinFromFile
+    '''
+
+    accumulator = SeaIceFrequency.LoadAccumulator(accumulatorfile)
+    max_ice = outfilepath + 'icechart_maximum' + accumulator['period'] + '.tif'
+    min_ice = outfilepath + 'icechart_minimum' + accumulator['period'] + '.tif'
+    SeaIceFrequency.CreateSeaIceFrequencyMap(outfilepath, accumulator, max_ice, min_ice, landmask_raster)
+
+def BenchmarkSeaIceFrequency(workpath, numberofyears, month = 1, bin2geotiff = True):
+    '''
+    Creates synthetic data for numberofyears years and times all stages
+    Returns a list of (stage, days, seconds, days per second, peak memory MB)
+    '''
+
+    stopyear = 2015
+    startyear = stopyear - numberofyears + 1
+
+    runpath = workpath + str(numberofyears) + 'years//'
+    nsidcpath = runpath + 'nsidc//'
+    outfilepath = runpath + 'output//'
+    geotiffpath = runpath + 'geotiff//'
+    for path in (nsidcpath, outfilepath, geotiffpath):
+        os.makedirs(path)
+
+    print 'Create synthetic data for ', numberofyears, ' years'
+    landraster, landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask = \
+                        CreateSyntheticMasks(runpath)
+    NumberOfFiles = CreateSyntheticCharts(nsidcpath, landraster, startyear, stopyear, month)
+    NumberOfDays = len(SeaIceFrequency.MonthDates(startyear, stopyear, month))
+
+    cubefile = outfilepath + 'NSIDC_cube.npy'
+    filteredcubefile = outfilepath + 'NSIDC_cube_filtered.npy'
+    accumulatorfile = outfilepath + 'accumulator_climatology.npz'
+
+    stages = []
+    if bin2geotiff:
+        stages.append(('Bin2GeoTiff', NumberOfFiles, ConvertAllBin2GeoTiff, \
+                       (nsidcpath, geotiffpath, startyear, stopyear, month)))
+    stages.append(('Bin2Cube', NumberOfFiles, SeaIceFrequency.Bin2Cube, \
+                   (SeaIceFrequency.MonthDates(startyear, stopyear, month), nsidcpath, cubefile)))
+    stages.append(('AddMissingDays', NumberOfDays, AddAllMissingDays, (startyear, stopyear, month, cubefile)))
+    stages.append(('FilterCoastalAreas', NumberOfDays, SeaIceFrequency.FilterCoastalAreas, \
+                   (cubefile, filteredcubefile, landmask_raster, coastalerrormask_raster)))
+    stages.append(('ReduceIceStack', NumberOfDays, ReduceAndSave, (filteredcubefile, accumulatorfile)))
+    stages.append(('CreateMaxMinIce', NumberOfDays, MaxMinFromFile, (outfilepath, accumulatorfile, \
+                   landmask_raster, coastalerrormask_raster, oceanmask_buffer5, NSIDC_balticmask)))
+    stages.append(('CreateSeaIceFrequencyMap', NumberOfDays, FrequencyFromFile, \
+                   (outfilepath, accumulatorfile, landmask_raster)))
+
+    results = []
+    for (stage, days, function, arguments) in stages:
+        runtime, peakmemory = TimeStage(function, arguments)
+        results.append((stage, days, runtime, days / max(runtime, 1e-9), peakmemory))
+
+    shutil.rmtree(runpath)
+    return results
+
+
+##############################################################################
+
+###   Core of Program follows here ###
+
+##############################################################################
+
+if __name__ == '__main__':
+
+    #############################
+    # SET PATH AND VARIABLES HERE
+    #############################
+
+    # Number of years of synthetic data for each benchmark run
+    yearcounts = [1, 5, 30]
+
+    # Month to process, January has 31 days
+    month = 1
+
+    # The old daily GeoTIFF conversion is slow, switch off for large runs
+    bin2geotiff = True
+
+    # Folder for synthetic data, removed after each run; the report is written here
+    workpath = tempfile.mkdtemp(prefix = 'SeaIceFrequencyBenchmark') + '//'
+
+    ##############################
+    # END OF VARIABLES TO BE SET
+    ##############################
+
+    reportfile = workpath + 'benchmark.csv'
+    report = open(reportfile, 'w')
+    report.write('years, stage, days, seconds, days_per_second, peak_memory_added_mb\n')
+
+    for numberofyears in yearcounts:
+        results = BenchmarkSeaIceFrequency(workpath, numberofyears, month, bin2geotiff)
+        print
+        print 'Years: ', numberofyears
+        print '%-26s %8s %10s %12s %10s' % ('stage', 'days', 'seconds', 'days/second', 'added MB')
+        for (stage, days, runtime, throughput, peakmemory) in results:
+            print '%-26s %8d %10.2f %12.1f %10.1f' % (stage, days, runtime, throughput, peakmemory)
+            report.write('%d, %s, %d, %.3f, %.1f, %.1f\n' % (numberofyears, stage, days, runtime, throughput, peakmemory))
+
+    report.close()
+    print
+    print 'Report written to ', reportfile
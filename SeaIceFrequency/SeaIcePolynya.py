@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Daily polynya and lead time series from NSIDC sea ice concentration
+
+All daily charts of the period are decoded into one memory-mapped cube
+(Bin2Cube of SeaIceFrequency.py). On each day areas of low concentration
+enclosed by ice and land are labelled as connected components, and
+polynyas overlapping from one day to the next are followed as one track
+* DailyPolynyas -- label the polynyas of one day, area, centroid and concentration
+* MatchPolynyas -- pairs of polynyas of two days with largest overlap
+* PolynyaYear -- all polynyas and tracks of one year of the cube
+* PolynyaSeries -- all years in parallel, tracks joined at the year boundaries
+* TrackPersistence -- age of each polynya and duration of each track
+* WritePolynyaCSV -- write daily polynyas and tracks as csv
+
+polynya = connected area of concentration < threshold (NSIDC units, 250 = 100%)
+not touching the border of the grid (open ocean) and smaller than maxarea.
+Land of the landmask and the polar hole (251) count as no polynya
+"""
+
+import numpy, gdal, gdalconst, os, datetime, multiprocessing
+from scipy import ndimage
+import SeaIceFrequency, SeaIceExtent
+
+# 8-connected, open water touching diagonally is one area
+Connectivity = numpy.ones((3, 3), bool)
+
+def DailyPolynyas(dayarray, landpixels, cellarea, x, y, threshold = 175, minarea = 1000.0, maxarea = 100000.0):
+    '''
+    Labels the polynyas of one day. dayarray is the concentration of the
+    day, landpixels is True for land, cellarea the area of each pixel (km2)
+    and x, y the map coordinates of the pixel centres.
+
+    Returns the label raster (0 no polynya, 1 ... n) and for the n polynyas
+    the area (km2), centroid x, y (area weighted, map coordinates) and the
+    mean concentration (%). Components touching the grid border or larger
+    than maxarea are open ocean, those smaller than minarea are dropped.
+    All sums are one bincount over the labels
+    '''
+
+    low = (dayarray < threshold) & ~landpixels
+    labels, NumberOfLabels = ndimage.label(low, Connectivity)
+
+    flatlabels = labels.ravel()
+    area = numpy.bincount(flatlabels, cellarea.ravel(), NumberOfLabels + 1)
+
+    # open ocean -- components reaching the border of the grid
+    keep = (area >= minarea) & (area <= maxarea)
+    keep[0] = False
+    keep[labels[0]] = False
+    keep[labels[-1]] = False
+    keep[labels[:, 0]] = False
+    keep[labels[:, -1]] = False
+
+    # renumber the kept components 1 ... n
+    newlabel = numpy.zeros(NumberOfLabels + 1, numpy.int32)
+    newlabel[keep] = numpy.arange(1, keep.sum() + 1)
+    labels = newlabel[labels]
+
+    weight = cellarea.ravel()
+    polynya = {}
+    polynya['area'] = area[keep]
+    polynya['x'] = numpy.bincount(flatlabels, weight * x.ravel(), NumberOfLabels + 1)[keep] / polynya['area']
+    polynya['y'] = numpy.bincount(flatlabels, weight * y.ravel(), NumberOfLabels + 1)[keep] / polynya['area']
+    polynya['concentration'] = numpy.bincount(flatlabels, weight * dayarray.ravel(), NumberOfLabels + 1)[keep] \
+                               / polynya['area'] / 2.5
+    return labels, polynya
+
+def MatchPolynyas(previous, current):
+    '''
+    Pairs the polynyas of two consecutive days by overlap. previous and
+    current are label rasters (0 no polynya). Each polynya of current is
+    paired with the one of previous it overlaps most, and each polynya of
+    previous with at most one of current, the one with the largest overlap
+    (the others of a split start a new track).
+    Returns the arrays of paired labels of current and previous
+    '''
+
+    overlap = (previous > 0) & (current > 0)
+    K = numpy.int64(previous.max()) + 1
+    pairs, counts = numpy.unique(current[overlap].astype(numpy.int64) * K + previous[overlap], return_counts = True)
+
+    # largest overlap first, then first occurrence of each current and previous
+    order = numpy.argsort(-counts, kind = 'mergesort')
+    currentlabels = pairs[order] // K
+    previouslabels = pairs[order] % K
+    first = numpy.sort(numpy.unique(currentlabels, return_index = True)[1])
+    currentlabels = currentlabels[first]
+    previouslabels = previouslabels[first]
+    first = numpy.unique(previouslabels, return_index = True)[1]
+    return currentlabels[first], previouslabels[first]
+
+def PolynyaYear(cubefile, year, landpixels, cellarea, x, y, threshold = 175, minarea = 1000.0, maxarea = 100000.0):
+    '''
+    Labels the polynyas of all valid days of year in the cube, see
+    DailyPolynyas, and follows them from day to day with MatchPolynyas.
+    A polynya continues the track of the polynya of the day before it is
+    paired with, otherwise it starts a new track. Missing days end all tracks.
+
+    Returns a dictionary with the columns date (YYYYMMDD), track (numbered
+    from 1 within the year), area, x, y, concentration, one entry per
+    polynya and day, and the track rasters of the first and last day with
+    their dates, used to join the tracks of consecutive years
+    '''
+
+    cube, dates, valid = SeaIceFrequency.OpenCube(cubefile)
+    daylist = [day for day in numpy.flatnonzero(valid) if dates[day].year == year]
+
+    columns = dict((name, []) for name in ['date', 'track', 'area', 'x', 'y', 'concentration'])
+    previoustracks = None
+    firsttracks = None
+    NumberOfTracks = 0
+
+    for day in daylist:
+
+        print 'Polynyas ', dates[day]
+        labels, polynya = DailyPolynyas(cube[day], landpixels, cellarea, x, y, threshold, minarea, maxarea)
+        NumberOfPolynyas = len(polynya['area'])
+
+        # continue the tracks of the day before, new tracks for the others
+        trackof = numpy.zeros(NumberOfPolynyas + 1, numpy.int32)
+        if (previoustracks is not None) and ((dates[day] - lastdate).days == 1):
+            currentlabels, previouslabels = MatchPolynyas(previoustracks, labels)
+            trackof[currentlabels] = previouslabels
+        new = numpy.flatnonzero(trackof == 0)[1:]
+        trackof[new] = NumberOfTracks + 1 + numpy.arange(len(new))
+        NumberOfTracks += len(new)
+
+        previoustracks = trackof[labels]
+        lastdate = dates[day]
+        if firsttracks is None:
+            firsttracks = previoustracks
+            firstdate = dates[day]
+
+        columns['date'].append(numpy.repeat(int(dates[day].strftime('%Y%m%d')), NumberOfPolynyas))
+        columns['track'].append(trackof[1:])
+        for name in ['area', 'x', 'y', 'concentration']:
+            columns[name].append(polynya[name])
+
+    cube = None
+    if firsttracks is None:
+        return None
+
+    result = dict((name, numpy.concatenate(values)) for (name, values) in columns.items())
+    result['firsttracks'] = firsttracks
+    result['lasttracks'] = previoustracks
+    result['firstdate'] = firstdate
+    result['lastdate'] = lastdate
+    return result
+
+def PolynyaSeries(cubefile, landmask_raster, cellarea, geotransform, threshold = 175, \
+                  minarea = 1000.0, maxarea = 100000.0, processes = None):
+    '''
+    Runs PolynyaYear for all years of the cube in a pool of processes, each
+    reading its days from the same memory-mapped cube. The tracks of
+    consecutive years are joined by pairing the last day of one year with
+    the first day of the next, and numbered from 1 over the whole period.
+    Returns the columns of PolynyaYear for all years
+    '''
+
+    cube, dates, valid = SeaIceFrequency.OpenCube(cubefile)
+    years = sorted(set(dates[day].year for day in numpy.flatnonzero(valid)))
+    rows, cols = cube.shape[1:]
+    cube = None
+
+    landmask = gdal.Open(landmask_raster, gdalconst.GA_ReadOnly)
+    landraster = landmask.ReadAsArray()
+    landmask = None
+    landpixels = (landraster >= 252) & (landraster <= 255)
+
+    # map coordinates of pixel centres
+    x = geotransform[0] + (numpy.arange(cols) + 0.5) * geotransform[1]
+    y = geotransform[3] + (numpy.arange(rows) + 0.5) * geotransform[5]
+    x, y = numpy.meshgrid(x, y)
+
+    pool = multiprocessing.Pool(processes)
+    results = [pool.apply_async(PolynyaYear, (cubefile, year, landpixels, cellarea, x, y, threshold, minarea, maxarea)) \
+               for year in years]
+    pool.close()
+    results = [result.get() for result in results]
+    pool.join()
+    results = [result for result in results if result is not None]
+
+    # global track number of the local tracks of each year
+    columns = dict((name, []) for name in ['date', 'track', 'area', 'x', 'y', 'concentration'])
+    NumberOfTracks = 0
+    previous = None
+    for result in results:
+        globaltrack = numpy.zeros(result['track'].max() + 1 if len(result['track']) else 1, numpy.int32)
+        if (previous is not None) and ((result['firstdate'] - previous['lastdate']).days == 1):
+            currentlabels, previouslabels = MatchPolynyas(previous['lasttracks'], result['firsttracks'])
+            globaltrack[currentlabels] = previousglobal[previouslabels]
+        new = numpy.flatnonzero(globaltrack == 0)[1:]
+        globaltrack[new] = NumberOfTracks + 1 + numpy.arange(len(new))
+        NumberOfTracks += len(new)
+
+        columns['track'].append(globaltrack[result['track']])
+        for name in ['date', 'area', 'x', 'y', 'concentration']:
+            columns[name].append(result[name])
+        previous = result
+        previousglobal = globaltrack
+
+    return dict((name, numpy.concatenate(values)) for (name, values) in columns.items())
+
+def TrackPersistence(series):
+    '''
+    Adds to the columns of PolynyaSeries the age of each polynya (days
+    since the start of its track, 1 on the first day) and the duration of
+    its track in days, both from one sort by track and date
+    '''
+
+    order = numpy.lexsort((series['date'], series['track']))
+    tracks = series['track'][order]
+    start = numpy.flatnonzero(numpy.r_[True, tracks[1:] != tracks[:-1]])
+    length = numpy.diff(numpy.r_[start, len(tracks)])
+
+    age = numpy.empty(len(tracks), numpy.int32)
+    age[order] = numpy.arange(len(tracks)) - numpy.repeat(start, length) + 1
+    duration = numpy.empty(len(tracks), numpy.int32)
+    duration[order] = numpy.repeat(length, length)
+
+    series['age'] = age
+    series['duration'] = duration
+    return series
+
+def WritePolynyaCSV(outfile, series):
+    '''
+    Writes one row per polynya and day, ordered by date and track
+    '''
+
+    order = numpy.lexsort((series['track'], series['date']))
+    csvfile = open(outfile, 'w')
+    csvfile.write('date, track, area_km2, x, y, concentration, age, duration\n')
+    for i in order:
+        date = str(series['date'][i])
+        csvfile.write(date[:4] + '-' + date[4:6] + '-' + date[6:] + ', %d, %.1f, %.0f, %.0f, %.1f, %d, %d\n' % \
+                      (series['track'][i], series['area'][i], series['x'][i], series['y'][i], \
+                       series['concentration'][i], series['age'][i], series['duration'][i]))
+    csvfile.close()
+
+
+##############################################################################
+
+###   Core of Program follows here ###
+
+##############################################################################
+
+if __name__ == '__main__':
+
+    #############################
+    # SET PATH AND VARIABLES HERE
+    #############################
+
+    landmask_raster = '//mnt//seaiceremotesensing//Isfrekvens//landmasks//NSIDC_landmask_raster.tif'
+
+    # Pixel areas in km2 on the NSIDC grid, None calculates them from the projection
+    cellarea_raster = None
+
+    # Period of the time series
+    startdate = datetime.date(1979, 1, 1)
+    stopdate = datetime.date.today()
+
+    # Polynya is concentration below threshold (NSIDC units, 175 = 70%),
+    # area between minarea and maxarea km2
+    threshold = 175
+    minarea = 1000.0
+    maxarea = 100000.0
+
+    # Number of years processed at the same time, None uses all cores
+    processes = None
+
+    # Set path where NSIDC sea ice concentration is stored
+    nsidcpath = '//mnt//seaiceremotesensing//SSMI//IceConcentration//NASATEAM//final-gsfc//north//daily//'
+
+    # Product in nsidcpath, one of SeaIceFrequency.NSIDCProducts, landmask on its grid
+    product = 'nsidc0051_north'
+
+    # Results, the cube is kept here such that a rerun does not decode again
+    outfilepath = '//mnt//seaiceremotesensing//Isfrekvens//SeaIcePolynya//'
+
+    ##############################
+    # END OF VARIABLES TO BE SET
+    ##############################
+
+    if not os.path.exists(outfilepath):
+        os.makedirs(outfilepath)
+
+    datelist = [startdate + datetime.timedelta(days = i) for i in range((stopdate - startdate).days + 1)]
+    cubefile = outfilepath + 'NSIDC_cube_' + startdate.strftime('%Y%m%d') + '_' + stopdate.strftime('%Y%m%d') + '.npy'
+    if not os.path.exists(cubefile):
+        SeaIceFrequency.Bin2Cube(datelist, nsidcpath, cubefile, product)
+
+    grid = SeaIceFrequency.ProductGrid(product)
+    cellarea = SeaIceExtent.CellAreas(cellarea_raster, grid['geotransform'], grid['shape'])
+
+    series = PolynyaSeries(cubefile, landmask_raster, cellarea, grid['geotransform'], threshold, minarea, maxarea, processes)
+    series = TrackPersistence(series)
+    outfile = outfilepath + 'SeaIcePolynya_' + startdate.strftime('%Y%m%d') + '_' + stopdate.strftime('%Y%m%d') + '.csv'
+    WritePolynyaCSV(outfile, series)
+
+    print 'Written ', outfile